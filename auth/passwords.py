@@ -0,0 +1,87 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+from utils.metrics import register_metrics
+
+# bcrypt cost; stored hashes with a different cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Threads doing bcrypt work; bcrypt releases the GIL so these run in parallel
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+# Max hash/verify calls queued or running before new ones are rejected
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 64))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordServiceBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+class PasswordService:
+    """
+    Runs bcrypt hashing/verification on a bounded thread pool so login storms
+    don't block the event loop.
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int, queue_limit: int):
+        self.context = context
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hash")
+        self.pending = 0  # Calls queued or running
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise PasswordServiceBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifies the password and, if the stored hash uses outdated cost
+        parameters, also returns a replacement hash (else None).
+        """
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": min(self.pending, self.max_workers),
+            "queue_depth": max(0, self.pending - self.max_workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_service = PasswordService(pwd_context, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
+register_metrics("password_hashing", password_service.metrics)
@@ -1,23 +1,36 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from passlib.context import CryptContext    
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
 from database import get_db
 from models import Player
+from utils.ttl_cache import TTLCache, MISSING
+from auth.passwords import pwd_context
+from utils.metrics import register_metrics
 import os
+import uuid
 
 # Get secret key from environment or use a secure default for development
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated players are cached per worker so hot endpoints skip the players lookup
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+register_metrics("principal_cache", principal_cache.stats)
+# Channel a player's id is NOTIFYed on after their row changes, so every worker drops its copy
+PRINCIPAL_CHANGED_CHANNEL = "principal_changed"
+# Everything a principal needs; the password hash is never kept in the cache
+PRINCIPAL_COLUMNS = [column.key for column in Player.__mapper__.column_attrs if column.key != "password_hash"]
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# Blocking helpers; request handlers should use auth.passwords.password_service
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -34,22 +47,57 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_db)
-) -> Player:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token_subject(token: str) -> str:
+    """Returns the player id (`sub` claim) of a valid access token"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         player_id: str = payload.get("sub")
         if player_id is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    return player_id
+
+def invalidate_principal(player_id):
+    """Drop this worker's cached copy of a player after its score, username etc. change"""
+    principal_cache.invalidate(str(player_id))
+
+async def notify_principal_changed(db: AsyncSession, player_id):
+    """
+    Tells every worker (this one included, via the listener) to drop the
+    cached player. Only sent if `db` commits, so call it in the transaction
+    that changed the row.
+    """
+    await db.execute(select(func.pg_notify(PRINCIPAL_CHANGED_CHANNEL, str(player_id))))
+
+async def get_current_player_id(token: str = Depends(oauth2_scheme)) -> uuid.UUID:
+    """
+    Claims-only dependency for endpoints that just need the player id.
+    Validates the token signature and expiry without touching the database.
+    """
+    try:
+        return uuid.UUID(decode_token_subject(token))
+    except ValueError:
+        raise _credentials_exception()
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> Player:
+    player_id = decode_token_subject(token)
+
+    # Cached principals are handed out as fresh transient copies so concurrent
+    # requests never share (or accidentally flush) the same instance
+    cached = principal_cache.get(player_id)
+    if cached is not MISSING:
+        return Player(**cached)
 
     # Get user from database
     query = select(Player).where(Player.id == player_id)
@@ -57,5 +105,6 @@ async def get_current_user(
     user = result.scalar_one_or_none()
 
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise _credentials_exception()
+    principal_cache.set(player_id, {key: getattr(user, key) for key in PRINCIPAL_COLUMNS})
+    return user
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark: utils.geofence against the original utils.location helpers.
+
+    python -m benchmarks.bench_geofence
+"""
+import random
+import timeit
+from geoalchemy2 import WKTElement
+from utils.location import validate_location, calculate_distance
+from utils.geofence import Fence, Geofences, DEFAULT_RADIUS_METERS
+
+random.seed(42)
+CENTER = (40.7128, -74.0060)
+
+
+def random_points(n, spread=0.01):
+    return [(CENTER[0] + random.uniform(-spread, spread), CENTER[1] + random.uniform(-spread, spread)) for _ in range(n)]
+
+
+def report(name, seconds, calls):
+    print(f"{name:<55} {seconds / calls * 1e6:10.2f} us/call")
+
+
+def bench_single_code(number=20000):
+    """One scan against one QR code: WKT parse + planar check vs pre-parsed fence"""
+    lat, lon = CENTER
+    location = WKTElement(f"POINT({lon} {lat})", srid=4326)
+    fence = Fence.at(lat, lon)
+    scan_lat, scan_lon = lat + 0.0002, lon + 0.0002
+    report("validate_location (parse WKT every call)", timeit.timeit(lambda: validate_location(scan_lat, scan_lon, location), number=number), number)
+    report("Fence.contains (pre-parsed)", timeit.timeit(lambda: fence.contains(scan_lat, scan_lon), number=number), number)
+
+
+def bench_hunt_steps(steps=50, number=5000):
+    """One scan against every step of a hunt"""
+    points = random_points(steps)
+    fences = Geofences([p[0] for p in points], [p[1] for p in points])
+    lat, lon = CENTER
+    report(f"calculate_distance loop ({steps} steps)", timeit.timeit(
+        lambda: [calculate_distance(lat, lon, p[0], p[1]) <= DEFAULT_RADIUS_METERS for p in points], number=number), number)
+    report(f"Geofences.contains ({steps} steps)", timeit.timeit(lambda: fences.contains(lat, lon), number=number), number)
+
+
+def bench_many_to_many(n_points=1000, n_fences=1000, number=5):
+    """Batch of scans against a batch of fences"""
+    points = random_points(n_points)
+    fence_points = random_points(n_fences)
+    fences = Geofences([p[0] for p in fence_points], [p[1] for p in fence_points])
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    report(f"calculate_distance loop ({n_points}x{n_fences})", timeit.timeit(
+        lambda: [[calculate_distance(a, b, f[0], f[1]) <= DEFAULT_RADIUS_METERS for f in fence_points] for a, b in points], number=number), number)
+    report(f"Geofences.contains_many ({n_points}x{n_fences})", timeit.timeit(lambda: fences.contains_many(lats, lons), number=number), number)
+
+
+def check_agreement(n=2000):
+    """The vectorised and scalar paths must agree with calculate_distance"""
+    points = random_points(n)
+    fences = Geofences([p[0] for p in points], [p[1] for p in points])
+    lat, lon = CENTER
+    expected = [calculate_distance(lat, lon, p[0], p[1]) for p in points]
+    vectorised = fences.distances(lat, lon)
+    scalar = [Fence.at(p[0], p[1]).distance(lat, lon) for p in points]
+    assert max(abs(a - b) for a, b in zip(expected, vectorised)) < 1e-6
+    assert max(abs(a - b) for a, b in zip(expected, scalar)) < 1e-6
+
+
+if __name__ == "__main__":
+    check_agreement()
+    bench_single_code()
+    bench_hunt_steps()
+    bench_many_to_many()
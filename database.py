@@ -1,47 +1,150 @@
+import logging
 import os
+from sqlalchemy import Insert, Update, Delete
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
+from utils.metrics import register_metrics
 import urllib.parse
 
 from dotenv import load_dotenv
 load_dotenv()
+logger = logging.getLogger(__name__)
 # Get the database URL from environment
 database_url = os.getenv("DATABASE_URL", "postgresql://owenmorris@localhost:5432/qrhunter")
+# Optional read replica used by read-only endpoints
+database_read_url = os.getenv("DATABASE_READ_URL")
 print("Database URL:",database_url)
 
-# Parse the URL to remove ssl parameters
-parsed = urllib.parse.urlparse(database_url)
-if parsed.scheme == "postgresql":
-    # Convert to asyncpg scheme
-    scheme = "postgresql+asyncpg"
-else:
-    scheme = parsed.scheme
-
-# Reconstruct the URL without ssl parameters
-query_params = urllib.parse.parse_qs(parsed.query)
-query_params.pop('sslmode', None)  # Remove sslmode parameter
-new_query = urllib.parse.urlencode(query_params, doseq=True)
-
-# Rebuild the connection URL
-database_url = urllib.parse.urlunparse((
-    scheme,
-    parsed.netloc,
-    parsed.path,
-    parsed.params,
-    new_query,
-    parsed.fragment
-))
-
-engine = create_async_engine(database_url, echo=True)
+# Engine settings
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # Seconds, -1 disables
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# asyncpg prepared statement cache per connection; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "qr-game-service")
+
+def to_async_url(url: str) -> str:
+    """Converts a postgresql:// URL to the asyncpg driver and drops ssl parameters"""
+    # Parse the URL to remove ssl parameters
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "postgresql":
+        # Convert to asyncpg scheme
+        scheme = "postgresql+asyncpg"
+    else:
+        scheme = parsed.scheme
+
+    # Reconstruct the URL without ssl parameters
+    query_params = urllib.parse.parse_qs(parsed.query)
+    query_params.pop('sslmode', None)  # Remove sslmode parameter
+    new_query = urllib.parse.urlencode(query_params, doseq=True)
+
+    # Rebuild the connection URL
+    return urllib.parse.urlunparse((
+        scheme,
+        parsed.netloc,
+        parsed.path,
+        parsed.params,
+        new_query,
+        parsed.fragment
+    ))
+
+def create_db_engine(url: str, application_name: str = DB_APPLICATION_NAME, **overrides):
+    """Builds an async engine from the DB_* settings; keyword arguments override them"""
+    url = to_async_url(url)
+    options = dict(
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"application_name": application_name},
+        }
+    options.update(overrides)
+    return create_async_engine(url, **options)
+
+def pool_metrics(engine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checked_in": pool.checkedin(),
+    }
+
+engine = create_db_engine(database_url)
+read_engine = create_db_engine(database_read_url, application_name=f"{DB_APPLICATION_NAME}-read") if database_read_url else engine
+
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+
+class RoutingSession(Session):
+    """Sends reads to the replica and anything that writes or flushes to the primary"""
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            return engine.sync_engine
+        return read_engine.sync_engine
+
+AsyncReadSessionLocal = sessionmaker(
+    class_=AsyncSession, sync_session_class=RoutingSession, expire_on_commit=False
+)
+
+register_metrics("db_pool", lambda: pool_metrics(engine))
+if read_engine is not engine:
+    register_metrics("db_read_pool", lambda: pool_metrics(read_engine))
+
 Base = declarative_base()
 
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# Set to false to skip the startup schema check (e.g. throwaway local databases)
+DB_SCHEMA_CHECK = os.getenv("DB_SCHEMA_CHECK", "true").lower() == "true"
+ALEMBIC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+def _current_revisions(sync_conn) -> set:
+    from alembic.runtime.migration import MigrationContext
+    return set(MigrationContext.configure(sync_conn).get_current_heads())
+
+async def check_schema():
+    """
+    Refuses to start unless every Alembic migration has been applied
+    (`alembic upgrade head`). The schema is owned by migrations/, not create_all.
+    """
+    if not DB_SCHEMA_CHECK:
+        return
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    config = Config(os.path.join(ALEMBIC_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ALEMBIC_DIR, "migrations"))
+    script = ScriptDirectory.from_config(config)
+
+    async with engine.connect() as conn:
+        current = await conn.run_sync(_current_revisions)
+    known = {revision.revision for revision in script.walk_revisions()}
+    if current - known:
+        # Migrated by a newer release; its migrations only ever add to what this one needs
+        logger.warning("Database schema is ahead of this release: %s", ", ".join(sorted(current - known)))
+        return
+    applied = set()
+    for head in current:
+        applied.update(revision.revision for revision in script.iterate_revisions(head, "base"))
+    missing = set(script.get_heads()) - applied
+    if missing:
+        raise SchemaOutOfDate(
+            f"Database schema is at {', '.join(sorted(current)) or 'no revision'} but this release needs "
+            f"{', '.join(sorted(missing))}; run `alembic upgrade head` first"
+        )
 
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -52,4 +155,16 @@ async def get_db():
             await session.rollback()
             raise
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+async def get_read_db():
+    """Session for read-only endpoints; queries go to DATABASE_READ_URL when configured"""
+    async with AsyncReadSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
@@ -1,8 +1,15 @@
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from database import init_db
-from routes import qr, player, websocket, auth, hunts
+from database import check_schema, AsyncSessionLocal
+from routes import qr, player, websocket, auth, hunts, metrics, leaderboard, stats
+from auth.passwords import password_service
+from utils.scan_engine import backfill_scan_counters
+from utils.player_stats import backfill_player_stats
+from utils.scan_buffer import scan_buffer
+from utils.geo_rollup import geo_rollup, backfill_geo_rollups
+from utils.scan_partitions import scan_partitions
+from utils.leaderboard import leaderboard as leaderboard_service
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,11 +35,44 @@ app.include_router(player.router, prefix="/player", tags=["player"])
 app.include_router(websocket.router, tags=["websocket"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(hunts.router, prefix="/hunts", tags=["hunts"])
+app.include_router(leaderboard.router, prefix="/leaderboard", tags=["leaderboard"])
+app.include_router(stats.router, prefix="/stats", tags=["stats"])
+app.include_router(metrics.router, tags=["metrics"])
 
 @app.on_event("startup")
 async def startup_event():
-    await init_db()
+    # Fails startup when migrations are pending, so a worker never serves an old schema
+    await check_schema()
+    # This month's player_scans partition has to exist before the first scan
+    await scan_partitions.run_once()
+    async with AsyncSessionLocal() as db:
+        await backfill_scan_counters(db)
+        await backfill_player_stats(db)
+        await backfill_geo_rollups(db)
+        await leaderboard_service.rebuild(db)
+    scan_buffer.start()
+    geo_rollup.start()
+    scan_partitions.start()
+    leaderboard_service.start_snapshots()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Write out buffered scans before the process exits
+    await scan_buffer.close()
+    await geo_rollup.close()
+    await leaderboard_service.stop_snapshots()
+    await scan_partitions.stop()
+    password_service.shutdown()
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from utils.ws_connection import WS_PING_INTERVAL_SECONDS, WS_PING_TIMEOUT_SECONDS
+    # permessage-deflate trades server CPU for bandwidth on every websocket frame
+    # (uvicorn CLI: --ws-per-message-deflate true|false)
+    uvicorn.run(
+        app, host="0.0.0.0", port=8000,
+        ws_per_message_deflate=os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true",
+        ws_ping_interval=WS_PING_INTERVAL_SECONDS,
+        ws_ping_timeout=WS_PING_TIMEOUT_SECONDS,
+    )
@@ -1,3 +1,5 @@
+import os
+import re
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -14,11 +16,23 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
-# add your model's MetaData object here
-# for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+# DATABASE_URL (the same variable the app uses) wins over alembic.ini
+if os.getenv("DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["DATABASE_URL"].replace("%", "%%"))
+
+from models import Base  # noqa: E402  (imports database, which reads the environment)
+
+target_metadata = Base.metadata
+
+# Tables that exist in the database but not in the models on purpose:
+# player_scans partitions (utils.scan_partitions) and PostGIS' own table
+UNMANAGED_TABLES = re.compile(r"^(player_scans_.+|spatial_ref_sys)$")
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and reflected and compare_to is None and UNMANAGED_TABLES.match(name):
+        return False
+    return True
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -44,6 +58,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -65,7 +80,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
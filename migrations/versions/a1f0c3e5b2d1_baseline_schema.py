@@ -0,0 +1,183 @@
+"""Baseline schema
+
+Everything database.init_db used to create with metadata.create_all, with
+player_scans still unpartitioned (b7e4c1a9d203 partitions it). Tables that
+already exist are left alone, so databases created by create_all can simply
+be upgraded.
+
+Revision ID: a1f0c3e5b2d1
+Revises:
+Create Date: 2026-10-17 08:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from geoalchemy2 import Geography
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1f0c3e5b2d1'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UUID = postgresql.UUID(as_uuid=True)
+
+
+def _create_table(existing, name, *columns, **kwargs):
+    if name not in existing:
+        op.create_table(name, *columns, **kwargs)
+        return True
+    return False
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    _create_table(
+        existing, "players",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("username", sa.String, nullable=False, unique=True),
+        sa.Column("password_hash", sa.String(256), nullable=False),
+        sa.Column("score", sa.Integer),
+        sa.Column("level", sa.Integer),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    # qr_codes and encounters reference each other; the qr_codes side is added afterwards
+    new_qr_codes = _create_table(
+        existing, "qr_codes",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("code", sa.String, nullable=False, unique=True),
+        sa.Column("description", sa.String),
+        sa.Column("scan_type", sa.String),
+        sa.Column("location", Geography(geometry_type="POINT", srid=4326, spatial_index=False)),
+        sa.Column("requires_location", sa.Boolean),
+        sa.Column("expiration_date", sa.DateTime),
+        sa.Column("scan_cooldown_seconds", sa.Integer),
+        sa.Column("max_scans_per_player", sa.Integer),
+        sa.Column("is_repeatable", sa.Boolean),
+        sa.Column("reward_data", postgresql.JSONB),
+        sa.Column("encounter_id", UUID),
+    )
+    _create_table(
+        existing, "encounters",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("qr_code_id", UUID, sa.ForeignKey("qr_codes.id")),
+        sa.Column("puzzle_type", sa.String),
+        sa.Column("difficulty_level", sa.Integer),
+        sa.Column("data", postgresql.JSONB),
+        sa.Column("repeatable", sa.Boolean),
+        sa.Column("expires_at", sa.DateTime),
+    )
+    if new_qr_codes:
+        op.create_foreign_key("qr_codes_encounter_id_fkey", "qr_codes", "encounters", ["encounter_id"], ["id"])
+
+    if _create_table(
+        existing, "player_scans",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("player_id", UUID, sa.ForeignKey("players.id")),
+        sa.Column("peer_player_id", UUID, sa.ForeignKey("players.id")),
+        sa.Column("qr_code_id", UUID, sa.ForeignKey("qr_codes.id")),
+        sa.Column("scan_time", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("scan_type", sa.String, nullable=False, server_default="standard"),
+        sa.Column("proximity_status", sa.String),
+        sa.Column("success", sa.Boolean),
+        sa.Column("latitude", sa.Float),
+        sa.Column("longitude", sa.Float),
+        sa.Column("attempt_number", sa.Integer),
+        sa.Column("next_scan_available_at", sa.DateTime),
+    ):
+        op.create_index(
+            "ix_player_scans_player_time_id", "player_scans",
+            ["player_id", sa.text("scan_time DESC"), sa.text("id DESC")]
+        )
+    _create_table(
+        existing, "player_qr_scan_counters",
+        sa.Column("player_id", UUID, sa.ForeignKey("players.id"), primary_key=True),
+        sa.Column("qr_code_id", UUID, sa.ForeignKey("qr_codes.id"), primary_key=True),
+        sa.Column("scan_count", sa.Integer, nullable=False),
+        sa.Column("last_scan_at", sa.DateTime(timezone=True)),
+        sa.Column("next_available_at", sa.DateTime(timezone=True)),
+    )
+    _create_table(
+        existing, "player_stats",
+        sa.Column("player_id", UUID, sa.ForeignKey("players.id"), primary_key=True),
+        sa.Column("total_scans", sa.Integer, nullable=False),
+        sa.Column("discovery_scans", sa.Integer, nullable=False),
+        sa.Column("peer_scans", sa.Integer, nullable=False),
+    )
+    _create_table(
+        existing, "hunts",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("description", sa.String),
+    )
+    _create_table(
+        existing, "hunt_steps",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("hunt_id", UUID, sa.ForeignKey("hunts.id")),
+        sa.Column("qr_code_id", UUID, sa.ForeignKey("qr_codes.id")),
+        sa.Column("order", sa.Integer, nullable=False),
+        sa.Column("latitude", sa.Float, nullable=False),
+        sa.Column("longitude", sa.Float, nullable=False),
+        sa.Column("hint", sa.String),
+    )
+    _create_table(
+        existing, "player_hunt_progress",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("player_id", UUID, sa.ForeignKey("players.id")),
+        sa.Column("hunt_id", UUID, sa.ForeignKey("hunts.id")),
+        sa.Column("current_step", sa.Integer),
+        sa.Column("completed_at", sa.DateTime(timezone=True)),
+        sa.Column("last_attempt_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("abandoned_at", sa.DateTime(timezone=True)),
+    )
+    if _create_table(
+        existing, "qr_login_sessions",
+        sa.Column("id", UUID, primary_key=True),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("used", sa.Boolean, nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        prefixes=["UNLOGGED"],
+    ):
+        op.create_index("ix_qr_login_sessions_expires_at", "qr_login_sessions", ["expires_at"])
+    _create_table(
+        existing, "leaderboard_snapshots",
+        sa.Column("taken_at", sa.DateTime(timezone=True), primary_key=True),
+        sa.Column("position", sa.Integer, primary_key=True),
+        sa.Column("rank", sa.Integer, nullable=False),
+        sa.Column("player_id", UUID, sa.ForeignKey("players.id"), nullable=False),
+        sa.Column("score", sa.Integer, nullable=False),
+    )
+    if _create_table(
+        existing, "geo_cell_counts",
+        sa.Column("cell", sa.String, primary_key=True),
+        sa.Column("latitude", sa.Float, nullable=False),
+        sa.Column("longitude", sa.Float, nullable=False),
+        sa.Column("scans", sa.BigInteger, nullable=False),
+    ):
+        op.create_index("ix_geo_cell_counts_lat_lon", "geo_cell_counts", ["latitude", "longitude"])
+    if _create_table(
+        existing, "region_player_counts",
+        sa.Column("region", sa.String, primary_key=True),
+        sa.Column("player_id", UUID, sa.ForeignKey("players.id"), primary_key=True),
+        sa.Column("scans", sa.BigInteger, nullable=False),
+    ):
+        op.create_index("ix_region_player_counts_region_scans", "region_player_counts", ["region", sa.text("scans DESC")])
+
+
+def downgrade() -> None:
+    for name in (
+        "region_player_counts", "geo_cell_counts", "leaderboard_snapshots", "qr_login_sessions",
+        "player_hunt_progress", "hunt_steps", "hunts", "player_stats", "player_qr_scan_counters",
+        "player_scans",
+    ):
+        op.drop_table(name)
+    op.drop_constraint("qr_codes_encounter_id_fkey", "qr_codes", type_="foreignkey")
+    op.drop_table("encounters")
+    op.drop_table("qr_codes")
+    op.drop_table("players")
@@ -0,0 +1,98 @@
+"""Range partition player_scans by month on scan_time
+
+The existing table is attached as a single partition covering everything up
+to the end of the current month, so no rows are copied. Monthly partitions
+after that are created by utils.scan_partitions (the first few here).
+
+Revision ID: b7e4c1a9d203
+Revises: a1f0c3e5b2d1
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from utils.scan_partitions import month_start, add_months, partition_name
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4c1a9d203'
+down_revision: Union[str, None] = 'a1f0c3e5b2d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 2
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.scalar(sa.text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'player_scans'::regclass)")):
+        return  # Created partitioned by create_all from the partitioned model
+
+    # Range partitions can't hold a NULL key
+    op.execute("UPDATE player_scans SET scan_time = 'epoch' WHERE scan_time IS NULL")
+    op.execute("ALTER TABLE player_scans ALTER COLUMN scan_time SET NOT NULL")
+
+    op.execute("ALTER TABLE player_scans RENAME TO player_scans_legacy")
+    op.execute("ALTER TABLE player_scans_legacy RENAME CONSTRAINT player_scans_pkey TO player_scans_legacy_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_player_scans_player_time_id RENAME TO ix_player_scans_legacy_player_time_id")
+
+    op.execute("CREATE TABLE player_scans (LIKE player_scans_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (scan_time)")
+    op.execute("ALTER TABLE player_scans ADD CONSTRAINT player_scans_pkey PRIMARY KEY (id, scan_time)")
+    op.create_foreign_key("player_scans_player_id_fkey", "player_scans", "players", ["player_id"], ["id"])
+    op.create_foreign_key("player_scans_peer_player_id_fkey", "player_scans", "players", ["peer_player_id"], ["id"])
+    op.create_foreign_key("player_scans_qr_code_id_fkey", "player_scans", "qr_codes", ["qr_code_id"], ["id"])
+    op.create_index(
+        "ix_player_scans_player_time_id", "player_scans",
+        ["player_id", sa.text("scan_time DESC"), sa.text("id DESC")]
+    )
+
+    # The legacy table ends at the (UTC) month boundary after its newest row, and at least after this month
+    newest = bind.scalar(sa.text("SELECT max(scan_time) FROM player_scans_legacy"))
+    boundary = add_months(month_start(max(newest or datetime.min.replace(tzinfo=timezone.utc), datetime.now(timezone.utc))), 1)
+    # A validated CHECK matching the bound lets ATTACH skip its full-table scan
+    op.execute(sa.text(
+        "ALTER TABLE player_scans_legacy ADD CONSTRAINT player_scans_legacy_range "
+        f"CHECK (scan_time < '{boundary.isoformat()}') NOT VALID"
+    ))
+    op.execute("ALTER TABLE player_scans_legacy VALIDATE CONSTRAINT player_scans_legacy_range")
+    # ATTACH only reuses an index that backs a matching constraint, so the (id, scan_time)
+    # index becomes the legacy table's primary key instead of a second index being built
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS player_scans_legacy_id_scan_time ON player_scans_legacy (id, scan_time)")
+    op.execute("ALTER TABLE player_scans_legacy DROP CONSTRAINT player_scans_legacy_pkey")
+    op.execute(
+        "ALTER TABLE player_scans_legacy ADD CONSTRAINT player_scans_legacy_pkey "
+        "PRIMARY KEY USING INDEX player_scans_legacy_id_scan_time"
+    )
+    op.execute(sa.text(
+        f"ALTER TABLE player_scans ATTACH PARTITION player_scans_legacy FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+    ))
+    op.execute("ALTER TABLE player_scans_legacy DROP CONSTRAINT player_scans_legacy_range")
+
+    for offset in range(MONTHS_AHEAD):
+        lower, upper = add_months(boundary, offset), add_months(boundary, offset + 1)
+        op.execute(sa.text(
+            f"CREATE TABLE {partition_name(lower)} PARTITION OF player_scans "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        ))
+
+
+def downgrade() -> None:
+    # Folds every partition back into the legacy table and makes it the plain table again
+    bind = op.get_bind()
+    partitions = bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'player_scans'::regclass AND c.relname <> 'player_scans_legacy'"
+    )).scalars().all()
+    op.execute("ALTER TABLE player_scans DETACH PARTITION player_scans_legacy")
+    for name in partitions:
+        op.execute(f"INSERT INTO player_scans_legacy SELECT * FROM {name}")
+    op.execute("DROP TABLE player_scans")
+    op.execute("ALTER TABLE player_scans_legacy RENAME TO player_scans")
+    op.execute("ALTER TABLE player_scans DROP CONSTRAINT player_scans_legacy_pkey")
+    op.execute("ALTER TABLE player_scans ADD CONSTRAINT player_scans_pkey PRIMARY KEY (id)")
+    op.execute("ALTER INDEX IF EXISTS ix_player_scans_legacy_player_time_id RENAME TO ix_player_scans_player_time_id")
+    op.execute("ALTER TABLE player_scans ALTER COLUMN scan_time DROP NOT NULL")
@@ -0,0 +1,78 @@
+"""Indexes for the hot scan, hunt and nearby queries
+
+player_scans(player_id, scan_time) is already covered by the leading columns
+of ix_player_scans_player_time_id, so it doesn't get a second index.
+
+player_scans indexes are built per partition with CREATE INDEX CONCURRENTLY
+and attached to an index created ON ONLY the parent, so writes aren't
+blocked while the big partitions are indexed.
+
+Revision ID: c3d9e2f4a6b8
+Revises: b7e4c1a9d203
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d9e2f4a6b8'
+down_revision: Union[str, None] = 'b7e4c1a9d203'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_partitioned_index(name: str, columns: str):
+    bind = op.get_bind()
+    if bind.scalar(sa.text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:index)"), {"index": name}):
+        return  # Already built, with every partition attached
+    op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY player_scans ({columns})")
+    partitions = bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'player_scans'::regclass"
+    )).scalars().all()
+    for partition in partitions:
+        partition_index = f"{partition}_{name.removeprefix('ix_player_scans_')}"
+        with op.get_context().autocommit_block():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} ({columns})")
+        if not bind.scalar(sa.text(
+            "SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:index))"
+        ), {"index": partition_index}):
+            op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+def upgrade() -> None:
+    _create_partitioned_index("ix_player_scans_player_qr", "player_id, qr_code_id")
+
+    # Keep the most advanced row where a race left two progress rows for one player and hunt
+    op.execute("""
+        DELETE FROM player_hunt_progress p
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY player_id, hunt_id
+                ORDER BY completed_at IS NOT NULL DESC, current_step DESC NULLS LAST, last_attempt_at DESC NULLS LAST
+            ) AS position
+            FROM player_hunt_progress
+            WHERE player_id IS NOT NULL AND hunt_id IS NOT NULL
+        ) ranked
+        WHERE p.id = ranked.id AND ranked.position > 1
+    """)
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_player_hunt_progress_player_hunt "
+            "ON player_hunt_progress (player_id, hunt_id)"
+        )
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_hunt_steps_hunt_order ON hunt_steps (hunt_id, "order")')
+        # Same name geoalchemy2 gives it, so databases where create_all already built it are skipped
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_qr_codes_location ON qr_codes USING gist (location)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_qr_codes_location")
+    op.execute("DROP INDEX IF EXISTS ix_hunt_steps_hunt_order")
+    op.execute("DROP INDEX IF EXISTS ux_player_hunt_progress_player_hunt")
+    # Dropping the parent index drops the attached partition indexes with it
+    op.execute("DROP INDEX IF EXISTS ix_player_scans_player_qr")
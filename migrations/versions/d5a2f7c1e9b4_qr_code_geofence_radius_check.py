@@ -0,0 +1,40 @@
+"""Reject invalid geofence_radius_meters overrides on qr_codes
+
+Existing values that aren't a positive number are removed first, so those
+codes fall back to the default radius as they already did in some paths.
+
+Revision ID: d5a2f7c1e9b4
+Revises: c3d9e2f4a6b8
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a2f7c1e9b4'
+down_revision: Union[str, None] = 'c3d9e2f4a6b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same as utils.geofence.RADIUS_CHECK at the time of writing
+RADIUS_CHECK = (
+    "CASE coalesce(jsonb_typeof(reward_data -> 'geofence_radius_meters'), 'null') "
+    "WHEN 'null' THEN true WHEN 'number' THEN (reward_data ->> 'geofence_radius_meters')::float > 0 ELSE false END"
+)
+
+
+def upgrade() -> None:
+    if op.get_bind().scalar(sa.text("SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ck_qr_codes_geofence_radius')")):
+        return  # Created with the table by create_all from the model
+    op.execute(f"UPDATE qr_codes SET reward_data = reward_data - 'geofence_radius_meters' WHERE NOT ({RADIUS_CHECK})")
+    # Added unvalidated and validated separately so writes aren't blocked during the scan
+    op.execute(f"ALTER TABLE qr_codes ADD CONSTRAINT ck_qr_codes_geofence_radius CHECK ({RADIUS_CHECK}) NOT VALID")
+    op.execute("ALTER TABLE qr_codes VALIDATE CONSTRAINT ck_qr_codes_geofence_radius")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE qr_codes DROP CONSTRAINT IF EXISTS ck_qr_codes_geofence_radius")
@@ -0,0 +1,37 @@
+"""Cluster-wide socket slots for game channels
+
+Revision ID: e6b1c8d3f2a7
+Revises: d5a2f7c1e9b4
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b1c8d3f2a7'
+down_revision: Union[str, None] = 'd5a2f7c1e9b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if "game_channel_slots" in sa.inspect(op.get_bind()).get_table_names():
+        return  # Created by create_all from the model
+    op.create_table(
+        "game_channel_slots",
+        sa.Column("channel_id", sa.String, primary_key=True),
+        sa.Column("slot", sa.Integer, primary_key=True),
+        sa.Column("player_id", sa.String, nullable=False),
+        sa.Column("node_id", sa.String, nullable=False),
+        sa.Column("seen_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        prefixes=["UNLOGGED"],
+    )
+    op.create_index("ix_game_channel_slots_node_id", "game_channel_slots", ["node_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("game_channel_slots")
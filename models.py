@@ -1,10 +1,11 @@
 import uuid
-from sqlalchemy import Column, String, Float, Boolean, DateTime, ForeignKey, Integer, JSON
+from sqlalchemy import Column, String, Float, Boolean, DateTime, ForeignKey, Integer, BigInteger, JSON, Index, CheckConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from geoalchemy2 import Geography
 from sqlalchemy.orm import relationship
 from database import Base
+from utils.geofence import RADIUS_CHECK
 
 class Player(Base):
     __tablename__ = "players"
@@ -17,11 +18,16 @@ class Player(Base):
 
 class QRCode(Base):
     __tablename__ = "qr_codes"
+    __table_args__ = (
+        # Nearby search (ST_DWithin, <-> ordering)
+        Index("idx_qr_codes_location", "location", postgresql_using="gist"),
+        CheckConstraint(RADIUS_CHECK, name="ck_qr_codes_geofence_radius"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     code = Column(String, unique=True, nullable=False)
     description = Column(String)
     scan_type = Column(String)  # item_drop, encounter, transportation
-    location = Column(Geography(geometry_type='POINT', srid=4326))
+    location = Column(Geography(geometry_type='POINT', srid=4326, spatial_index=False))  # Indexed below
     requires_location = Column(Boolean, default=False)
     expiration_date = Column(DateTime, nullable=True)  # Optional expiration (e.g., seasonal event)
     scan_cooldown_seconds = Column(Integer, nullable=True)  # Cooldown before re-scanning allowed
@@ -43,6 +49,15 @@ class Encounter(Base):
 
 class PlayerScan(Base):
     __tablename__ = "player_scans"
+    __table_args__ = (
+        # Keyset pagination of a player's history, newest first
+        Index("ix_player_scans_player_time_id", "player_id", text("scan_time DESC"), text("id DESC")),
+        # A player's scans of one code (counter backfill, per-code lookups)
+        Index("ix_player_scans_player_qr", "player_id", "qr_code_id"),
+        # Monthly range partitions, created ahead of time by utils.scan_partitions.
+        # Queries that bound scan_time only visit the partitions they need
+        {"postgresql_partition_by": "RANGE (scan_time)"},
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     player_id = Column(UUID(as_uuid=True), ForeignKey('players.id'))
     player = relationship("Player", foreign_keys=[player_id])
@@ -50,7 +65,8 @@ class PlayerScan(Base):
     peer_player = relationship("Player", foreign_keys=[peer_player_id])
     qr_code_id = Column(UUID(as_uuid=True), ForeignKey('qr_codes.id'), nullable=True)
     qr_code = relationship("QRCode")
-    scan_time = Column(DateTime(timezone=True), server_default=func.now())
+    # Part of the primary key because the partition key has to be
+    scan_time = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     scan_type = Column(String, nullable=False, server_default="standard")
     proximity_status = Column(String) # Tracks status of geofenced validation
     success = Column(Boolean, default=True)
@@ -59,6 +75,23 @@ class PlayerScan(Base):
     attempt_number = Column(Integer, default=1)  # Tracks number of times player scanned this code
     next_scan_available_at = Column(DateTime, nullable=True)  # When player can scan it again (null if one-time use)
 
+class PlayerQRScanCounter(Base):
+    __tablename__ = "player_qr_scan_counters"
+    # Maintained aggregate of player_scans per (player, code), updated on every scan
+    player_id = Column(UUID(as_uuid=True), ForeignKey('players.id'), primary_key=True)
+    qr_code_id = Column(UUID(as_uuid=True), ForeignKey('qr_codes.id'), primary_key=True)
+    scan_count = Column(Integer, nullable=False, default=0)
+    last_scan_at = Column(DateTime(timezone=True), nullable=True)
+    next_available_at = Column(DateTime(timezone=True), nullable=True)  # Cooldown end, null if none
+
+class PlayerStats(Base):
+    __tablename__ = "player_stats"
+    # Per-player scan totals, bumped in the same statement that records each scan
+    player_id = Column(UUID(as_uuid=True), ForeignKey('players.id'), primary_key=True)
+    total_scans = Column(Integer, nullable=False, default=0)  # Successful scans of any type
+    discovery_scans = Column(Integer, nullable=False, default=0)
+    peer_scans = Column(Integer, nullable=False, default=0)
+
 class Hunt(Base):
     __tablename__ = "hunts"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -67,6 +100,9 @@ class Hunt(Base):
 
 class HuntStep(Base):
     __tablename__ = "hunt_steps"
+    __table_args__ = (
+        Index("ix_hunt_steps_hunt_order", "hunt_id", "order"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     hunt_id = Column(UUID(as_uuid=True), ForeignKey('hunts.id'))
     qr_code_id = Column(UUID(as_uuid=True), ForeignKey('qr_codes.id'))
@@ -77,10 +113,70 @@ class HuntStep(Base):
 
 class PlayerHuntProgress(Base):
     __tablename__ = "player_hunt_progress"
+    __table_args__ = (
+        # One progress row per player and hunt
+        Index("ux_player_hunt_progress_player_hunt", "player_id", "hunt_id", unique=True),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     player_id = Column(UUID(as_uuid=True), ForeignKey('players.id'))
     hunt_id = Column(UUID(as_uuid=True), ForeignKey('hunts.id'))
     current_step = Column(Integer, default=0)
     completed_at = Column(DateTime(timezone=True), nullable=True)
     last_attempt_at = Column(DateTime(timezone=True), server_default=func.now())
-    abandoned_at = Column(DateTime(timezone=True), nullable=True)
\ No newline at end of file
+    abandoned_at = Column(DateTime(timezone=True), nullable=True)
+
+class QRLoginSession(Base):
+    __tablename__ = "qr_login_sessions"
+    # Short-lived and rebuildable, so skip the WAL
+    __table_args__ = (
+        Index("ix_qr_login_sessions_expires_at", "expires_at"),
+        {"prefixes": ["UNLOGGED"]},
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    used = Column(Boolean, nullable=False, default=False)
+    attempts = Column(Integer, nullable=False, default=0)
+
+class LeaderboardSnapshot(Base):
+    __tablename__ = "leaderboard_snapshots"
+    # Periodic copy of the in-memory leaderboard's top N, one row per position
+    taken_at = Column(DateTime(timezone=True), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    rank = Column(Integer, nullable=False)
+    player_id = Column(UUID(as_uuid=True), ForeignKey('players.id'), nullable=False)
+    score = Column(Integer, nullable=False)
+
+class GeoCellCount(Base):
+    __tablename__ = "geo_cell_counts"
+    # Scan density rollup: one row per geohash cell that has seen a located scan
+    __table_args__ = (
+        Index("ix_geo_cell_counts_lat_lon", "latitude", "longitude"),
+    )
+    cell = Column(String, primary_key=True)
+    latitude = Column(Float, nullable=False)  # Cell centre
+    longitude = Column(Float, nullable=False)
+    scans = Column(BigInteger, nullable=False, default=0)
+
+class RegionPlayerCount(Base):
+    __tablename__ = "region_player_counts"
+    # Scans per player per (coarser) geohash region, for regional top-N
+    __table_args__ = (
+        Index("ix_region_player_counts_region_scans", "region", text("scans DESC")),
+    )
+    region = Column(String, primary_key=True)
+    player_id = Column(UUID(as_uuid=True), ForeignKey('players.id'), primary_key=True)
+    scans = Column(BigInteger, nullable=False, default=0)
+
+class GameChannelSlot(Base):
+    __tablename__ = "game_channel_slots"
+    # Which worker holds each socket of a game channel (the websocket player_id).
+    # Rebuilt as players reconnect, so skip the WAL
+    __table_args__ = (
+        Index("ix_game_channel_slots_node_id", "node_id"),
+        {"prefixes": ["UNLOGGED"]},
+    )
+    channel_id = Column(String, primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    player_id = Column(String, nullable=False)  # The connecting player
+    node_id = Column(String, nullable=False)  # Backplane node id of the worker holding the socket
+    seen_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -1,22 +1,36 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, literal, true
 from sqlalchemy.sql import func
-from models import Player, PlayerScan
-from database import get_db
-from auth.utils import verify_password, get_password_hash, create_access_token, get_current_user
+from models import Player, PlayerScan, PlayerStats
+from database import get_db, get_read_db
+from auth.utils import create_access_token, get_current_user
+from auth.passwords import password_service, PasswordServiceBusy
 from datetime import timedelta
 from schemas import PlayerCreate, Token, QRLoginRequest, QRLoginResponse
 import uuid
 from routes.websocket import manager
-from datetime import datetime
+from utils.player_stats import recent_scans as recent_scans_cache, scan_entry, RECENT_SCANS_LIMIT
+from utils.leaderboard import notify_score_changed
+from utils.session_store import login_sessions, CLAIMED, INVALID, ALREADY_USED, EXPIRED, TOO_MANY_ATTEMPTS
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-# Store temporary QR login sessions with expiration
-qr_login_sessions = {}
+QR_LOGIN_ERRORS = {
+    INVALID: "Invalid session",
+    ALREADY_USED: "Session already used",
+    EXPIRED: "Session expired",
+    TOO_MANY_ATTEMPTS: "Too many invalid attempts",
+}
+
+def _password_service_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, try again shortly",
+        headers={"Retry-After": "1"},
+    )
 
 @router.post("/register", response_model=PlayerCreate)
 async def register(
@@ -33,12 +47,17 @@ async def register(
         )
 
     # Create new player with hashed password
+    try:
+        password_hash = await password_service.hash(player.password)
+    except PasswordServiceBusy:
+        raise _password_service_busy()
     new_player = Player(
         id=uuid.uuid4(),
         username=player.username,
-        password_hash=get_password_hash(player.password)
+        password_hash=password_hash
     )
     db.add(new_player)
+    await notify_score_changed(db, new_player.id, 0, new_player.username)
     await db.commit()
     await db.refresh(new_player)
 
@@ -54,13 +73,24 @@ async def login(
     result = await db.execute(query)
     player = result.scalar_one_or_none()
 
-    if not player or not verify_password(form_data.password, player.password_hash):
+    valid, new_hash = False, None
+    if player:
+        try:
+            valid, new_hash = await password_service.verify_and_update(form_data.password, player.password_hash)
+        except PasswordServiceBusy:
+            raise _password_service_busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Transparently upgrade hashes made with old bcrypt cost settings
+    if new_hash:
+        player.password_hash = new_hash
+        await db.commit()
+
     # Create access token
     access_token = create_access_token(
         data={"sub": str(player.id)},
@@ -72,22 +102,7 @@ async def login(
 @router.post("/qr-login-init")
 async def initialize_qr_login():
     """Generate a new QR login session"""
-    # Clean up expired sessions
-    current_time = datetime.utcnow()
-    expired_sessions = [
-        session_id for session_id, session in qr_login_sessions.items()
-        if (current_time - session["created_at"]).total_seconds() > 300  # 5 minutes expiration
-        or session["used"]
-    ]
-    for session_id in expired_sessions:
-        del qr_login_sessions[session_id]
-
-    session_id = str(uuid.uuid4())
-    qr_login_sessions[session_id] = {
-        "created_at": current_time,
-        "used": False,
-        "attempts": 0  # Track invalid attempts
-    }
+    session_id = await login_sessions.create()
     return {"session_id": session_id}
 
 @router.post("/qr-login-complete")
@@ -96,39 +111,14 @@ async def complete_qr_login(
     current_user: Player = Depends(get_current_user)
 ):
     """Complete QR login from mobile device"""
-    print("login request from qr:",login_request)
-    session = qr_login_sessions.get(login_request.session_id)
-    print(session)
-    if not session:
-        raise HTTPException(status_code=400, detail="Invalid session")
-
-    if session["used"]:
-        raise HTTPException(status_code=400, detail="Session already used")
-
-    # Check expiration
-    if (datetime.utcnow() - session["created_at"]).total_seconds() > 300:
-        del qr_login_sessions[login_request.session_id]
-        raise HTTPException(status_code=400, detail="Session expired")
-
-    # Track attempts to prevent brute force
-    session["attempts"] += 1
-    if session["attempts"] > 3:
-        del qr_login_sessions[login_request.session_id]
-        raise HTTPException(status_code=400, detail="Too many invalid attempts")
-
-    # Mark session as used
-    session["used"] = True
-
-    # Create a new token for the web session
-    access_token = create_access_token(
-        data={"sub": str(current_user.id)},
-        expires_delta=timedelta(minutes=30)
-    )
+    result = await login_sessions.claim(login_request.session_id)
+    if result != CLAIMED:
+        raise HTTPException(status_code=400, detail=QR_LOGIN_ERRORS[result])
 
-    # Notify the waiting browser through WebSocket
+    # Notify the waiting browser through WebSocket; its token is created there
     await manager.send_login_success(
         login_request.session_id,
-        access_token
+        str(current_user.id)
     )
 
     return {"status": "success"}
@@ -136,46 +126,47 @@ async def complete_qr_login(
 @router.get("/me")
 async def read_users_me(
     current_user: Player = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    primary_db: AsyncSession = Depends(get_db)
 ):
     player_id = current_user.id
 
-    # Fetch scan counts
-    total_scans_query = select(func.count()).where(
-        PlayerScan.player_id == player_id, PlayerScan.success == True
-    )
-    discovery_scans_query = select(func.count()).where(
-        PlayerScan.player_id == player_id, PlayerScan.scan_type == "discovery"
-    )
-    peer_scans_query = select(func.count()).where(
-        PlayerScan.player_id == player_id, PlayerScan.scan_type == "peer"
-    )
-
-    total_scans_result = await db.execute(total_scans_query)
-    discovery_scans_result = await db.execute(discovery_scans_query)
-    peer_scans_result = await db.execute(peer_scans_query)
-
-    total_scans = total_scans_result.scalar() or 0
-    discovery_scans = discovery_scans_result.scalar() or 0
-    peer_scans = peer_scans_result.scalar() or 0
-
-    # Fetch recent scan history
-    recent_scans_query = (
-        select(PlayerScan.qr_code_id, PlayerScan.scan_time, PlayerScan.success, PlayerScan.scan_type)
-        .where(PlayerScan.player_id == player_id)
-        .order_by(PlayerScan.scan_time.desc())
-        .limit(10)
+    # Counts come from the player's player_stats row; the last scans from the ring buffer cache
+    stats = select(
+        PlayerStats.total_scans, PlayerStats.discovery_scans, PlayerStats.peer_scans
+    ).where(PlayerStats.player_id == player_id)
+    recent_scans = recent_scans_cache.get(player_id)
+    if recent_scans is not None:
+        counts = (await db.execute(stats)).first()
+    else:
+        # Cache miss: counts and recent history in one round trip. The cache is then
+        # kept current by pushes from the scan paths, so it's filled from the primary:
+        # a lagging replica would cache a history missing the latest scans
+        recent = (
+            select(PlayerScan.qr_code_id, PlayerScan.scan_time, PlayerScan.success, PlayerScan.scan_type)
+            .where(PlayerScan.player_id == player_id)
+            .order_by(PlayerScan.scan_time.desc(), PlayerScan.id.desc())
+            .limit(RECENT_SCANS_LIMIT)
+            .subquery()
+        )
+        stats = stats.subquery()
+        # Left joins off a one-row anchor, so a player with no stats row or no scans still gets a row
+        anchor = select(literal(1).label("anchor")).subquery()
+        rows = (await primary_db.execute(
+            select(stats, recent)
+            .select_from(anchor.outerjoin(stats, true()).outerjoin(recent, true()))
+            .order_by(recent.c.scan_time.desc())
+        )).all()
+        counts = rows[0] if rows[0].total_scans is not None else None
+        recent_scans = [
+            scan_entry(row.qr_code_id, row.scan_time, row.success, row.scan_type)
+            for row in rows if row.scan_time is not None
+        ]
+        recent_scans_cache.set(player_id, recent_scans)
+
+    total_scans, discovery_scans, peer_scans = (
+        (counts.total_scans, counts.discovery_scans, counts.peer_scans) if counts else (0, 0, 0)
     )
-    recent_scans_result = await db.execute(recent_scans_query)
-    recent_scans = [
-        {
-            "qr_code_id": scan.qr_code_id,
-            "scan_time": scan.scan_time.isoformat(),
-            "success": scan.success,
-            "scan_type": scan.scan_type,
-        }
-        for scan in recent_scans_result.all()
-    ]
 
     return {
         "id": str(current_user.id),
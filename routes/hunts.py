@@ -1,41 +1,38 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Path
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select,func
-from database import get_db
-from models import Hunt, HuntStep, PlayerHuntProgress, Player, QRCode
+from sqlalchemy import select, func, update, case, exists
+from database import get_db, get_read_db
+from models import PlayerHuntProgress, Player, Hunt
 from schemas import HuntResponse, HuntScanRequest, HuntScanResponse, ActiveHuntResponse
-from auth.utils import get_current_user
+from auth.utils import get_current_player_id, invalidate_principal, notify_principal_changed
+from utils.hunt_catalog import hunt_catalog
+from utils.leaderboard import notify_score_changed
 from datetime import datetime, timedelta
+import uuid
 
 router = APIRouter()
 
 @router.get("/hunt/{hunt_id}", response_model=HuntResponse)
 async def get_hunt(
     hunt_id: str = Path(..., regex=r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"),
-    current_user: Player = Depends(get_current_user),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
     db: AsyncSession = Depends(get_db)
 ):
-    print("hunt_id:",hunt_id)
-    hunt = await db.get(Hunt, hunt_id)
+    hunt = await hunt_catalog.get(db, hunt_id)
     if not hunt:
         raise HTTPException(status_code=404, detail="Hunt not found")
     
-    progress = await db.scalar(select(PlayerHuntProgress).where(
-        PlayerHuntProgress.player_id == current_user.id,
-        PlayerHuntProgress.hunt_id == hunt_id
-    ))
-    
-    step_num = progress.current_step if progress else 0
-    
-    steps = await db.execute(select(HuntStep).where(HuntStep.hunt_id == hunt_id).order_by(HuntStep.order))
-    steps_list = steps.scalars().all()
-    current_step = steps_list[step_num] if step_num < len(steps_list) else None
+    step_num = await db.scalar(select(PlayerHuntProgress.current_step).where(
+        PlayerHuntProgress.player_id == current_player_id,
+        PlayerHuntProgress.hunt_id == hunt.id
+    )) or 0
+    current_step = hunt.step(step_num)
     
     return {
         "id": str(hunt.id),
         "name": hunt.name,
         "description": hunt.description,
-        "steps": len(steps_list),
+        "steps": hunt.step_count,
         "current_step": {
             "latitude": current_step.latitude,
             "longitude": current_step.longitude,
@@ -46,44 +43,79 @@ async def get_hunt(
 @router.post("/scan", response_model=HuntScanResponse)
 async def scan_hunt_qr(
     request: HuntScanRequest,
-    current_user: Player = Depends(get_current_user),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
     db: AsyncSession = Depends(get_db)
 ):
-    progress = await db.scalar(select(PlayerHuntProgress).where(
-        PlayerHuntProgress.player_id == current_user.id,
-        PlayerHuntProgress.hunt_id == request.hunt_id
-    ))
-    if not progress:
-        progress = PlayerHuntProgress(player_id=current_user.id, hunt_id=request.hunt_id)
+    hunt = await hunt_catalog.get(db, request.hunt_id)
+    if not hunt:
+        raise HTTPException(status_code=404, detail="Hunt not found")
+
+    # Steps this scan could complete: right code and inside the step's geofence
+    distances = hunt.fences.distances(request.latitude, request.longitude)
+    inside = distances <= hunt.fences.radius
+    valid_steps = [
+        index for index, step in enumerate(hunt.steps)
+        if step.qr_code == request.qr_code and inside[index]
+    ]
+
+    # Advance only if the player is currently on one of those steps
+    progress = None
+    if valid_steps:
+        progress = (await db.execute(
+            update(PlayerHuntProgress)
+            .where(
+                PlayerHuntProgress.player_id == current_player_id,
+                PlayerHuntProgress.hunt_id == hunt.id,
+                PlayerHuntProgress.current_step.in_(valid_steps)
+            )
+            .values(
+                current_step=PlayerHuntProgress.current_step + 1,
+                last_attempt_at=func.now(),
+                completed_at=case((PlayerHuntProgress.current_step + 1 >= hunt.step_count, func.now()), else_=None)
+            )
+            .returning(PlayerHuntProgress.current_step, PlayerHuntProgress.completed_at)
+        )).first()
+
+    if progress is None:
+        # Slow path: work out why the scan didn't advance, or start the hunt on its first step
+        existing = await db.scalar(select(PlayerHuntProgress).where(
+            PlayerHuntProgress.player_id == current_player_id,
+            PlayerHuntProgress.hunt_id == hunt.id
+        ))
+        step_num = existing.current_step if existing else 0
+        if step_num >= hunt.step_count:
+            raise HTTPException(status_code=400, detail="Hunt already completed")
+        current_step = hunt.step(step_num)
+        if current_step.qr_code != request.qr_code:
+            raise HTTPException(status_code=400, detail="Wrong QR code")
+        if not inside[step_num]:
+            raise HTTPException(status_code=400, detail=f"Too far: {distances[step_num]:.2f}m")
+        if existing:
+            raise HTTPException(status_code=409, detail="Hunt progress changed, try again")
+        progress = PlayerHuntProgress(
+            player_id=current_player_id,
+            hunt_id=hunt.id,
+            current_step=1,
+            last_attempt_at=datetime.utcnow(),
+            completed_at=datetime.utcnow() if hunt.step_count == 1 else None
+        )
         db.add(progress)
     
-    steps = await db.execute(select(HuntStep).where(HuntStep.hunt_id == request.hunt_id).order_by(HuntStep.order))
-    steps_list = steps.scalars().all()
-    if progress.current_step >= len(steps_list):
-        raise HTTPException(status_code=400, detail="Hunt already completed")
-    
-    current_step = steps_list[progress.current_step]
-    qr_code = await db.get(QRCode, current_step.qr_code_id)
-    print("code expected:", qr_code)
-    if qr_code.code != request.qr_code:
-        raise HTTPException(status_code=400, detail="Wrong QR code")
-    
-    from utils.location import calculate_distance
-    distance = calculate_distance(request.latitude, request.longitude, current_step.latitude, current_step.longitude)
-    if distance > 50:
-        raise HTTPException(status_code=400, detail=f"Too far: {distance:.2f}m")
-    
-    progress.current_step += 1
-    progress.last_attempt_at = datetime.utcnow()
-    
-    if progress.current_step == len(steps_list):
-        progress.completed_at = datetime.utcnow()
+    if progress.current_step == hunt.step_count:
         reward = 50 if not progress.completed_at else 5  # Full reward first time, 5 after
-        current_user.score = (current_user.score or 0) + reward
+        score, username = (await db.execute(
+            update(Player)
+            .where(Player.id == current_player_id)
+            .values(score=func.coalesce(Player.score, 0) + reward)
+            .returning(Player.score, Player.username)
+        )).one()
+        await notify_score_changed(db, current_player_id, score, username)
+        await notify_principal_changed(db, current_player_id)
         await db.commit()
+        invalidate_principal(current_player_id)
         return {"status": "completed", "reward": reward}
     
-    next_step = steps_list[progress.current_step]
+    next_step = hunt.step(progress.current_step)
     await db.commit()
     return {
         "status": "success",
@@ -92,45 +124,62 @@ async def scan_hunt_qr(
 
 @router.get("/active", response_model=ActiveHuntResponse)
 async def get_active_hunts(
-    current_user: Player = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
+    db: AsyncSession = Depends(get_read_db),
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(10, ge=1, le=50, description="Number of records to return")
 ):
-    progress_query = select(PlayerHuntProgress).where(
-        PlayerHuntProgress.player_id == current_user.id,
+    active_filter = (
+        PlayerHuntProgress.player_id == current_player_id,
         PlayerHuntProgress.completed_at.is_(None),
-        PlayerHuntProgress.abandoned_at.is_(None)
-    ).offset(skip).limit(limit)
-    
-    total_query = select(func.count()).select_from(
-        select(PlayerHuntProgress).where(
-            PlayerHuntProgress.player_id == current_user.id,
-            PlayerHuntProgress.completed_at.is_(None),
-            PlayerHuntProgress.abandoned_at.is_(None)
-        ).subquery()
+        PlayerHuntProgress.abandoned_at.is_(None),
+        # Progress on deleted hunts is left out here, so the total matches the hunts returned
+        exists().where(Hunt.id == PlayerHuntProgress.hunt_id)
     )
-    total = (await db.execute(total_query)).scalar()
-    
-    progress_list = (await db.execute(progress_query)).scalars().all()
+
+    # One round trip for the page and the total (window count); hunt and step
+    # details come from the in-memory catalog
+    progress_query = (
+        select(
+            PlayerHuntProgress.hunt_id,
+            PlayerHuntProgress.current_step,
+            PlayerHuntProgress.completed_at,
+            func.count().over().label("total")
+        )
+        .where(*active_filter)
+        .order_by(PlayerHuntProgress.last_attempt_at.desc(), PlayerHuntProgress.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    rows = (await db.execute(progress_query)).all()
+
+    if rows:
+        total = rows[0].total
+    elif skip:
+        # Paged past the end, so the window count has no row to ride on
+        total = (await db.execute(select(func.count(PlayerHuntProgress.id)).where(*active_filter))).scalar()
+    else:
+        total = 0
+
+    catalog = await hunt_catalog.get_many(db, [row.hunt_id for row in rows])
     hunts = []
-    for progress in progress_list:
-        hunt = await db.get(Hunt, progress.hunt_id)
-        steps = await db.execute(select(HuntStep).where(HuntStep.hunt_id == hunt.id).order_by(HuntStep.order))
-        steps_list = steps.scalars().all()
-        current_step = steps_list[progress.current_step] if progress.current_step < len(steps_list) else None
+    for row in rows:
+        hunt = catalog.get(str(row.hunt_id))
+        if not hunt:
+            continue  # Deleted since the query ran
+        current_step = hunt.step(row.current_step)
         hunts.append({
             "id": str(hunt.id),
             "name": hunt.name,
             "description": hunt.description,
-            "steps": len(steps_list),
+            "steps": hunt.step_count,
             "current_step": {
                 "latitude": current_step.latitude,
                 "longitude": current_step.longitude,
                 "hint": current_step.hint,
                 "order": current_step.order
             } if current_step else None,
-            "completed_at": progress.completed_at
+            "completed_at": row.completed_at
         })
     
     return {
@@ -141,14 +190,14 @@ async def get_active_hunts(
     }
 
 @router.post("/start/{hunt_id}")
-async def start_hunt(hunt_id: str, current_user: Player = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    hunt = await db.get(Hunt, hunt_id)
+async def start_hunt(hunt_id: str, current_player_id: uuid.UUID = Depends(get_current_player_id), db: AsyncSession = Depends(get_db)):
+    hunt = await hunt_catalog.get(db, hunt_id)
     if not hunt:
         raise HTTPException(status_code=404, detail="Hunt not found")
     
     progress = await db.scalar(select(PlayerHuntProgress).where(
-        PlayerHuntProgress.player_id == current_user.id,
-        PlayerHuntProgress.hunt_id == hunt_id
+        PlayerHuntProgress.player_id == current_player_id,
+        PlayerHuntProgress.hunt_id == hunt.id
     ))
     if progress:
         if progress.completed_at:
@@ -160,16 +209,16 @@ async def start_hunt(hunt_id: str, current_user: Player = Depends(get_current_us
             progress.abandoned_at = None  # Reset if previously abandoned
         db.add(progress)
     else:
-        progress = PlayerHuntProgress(player_id=current_user.id, hunt_id=hunt_id, current_step=0)
+        progress = PlayerHuntProgress(player_id=current_player_id, hunt_id=hunt_id, current_step=0)
         db.add(progress)
     
     await db.commit()
     return {"status": "started", "hunt_id": hunt_id}
 
 @router.post("/abandon/{hunt_id}")
-async def abandon_hunt(hunt_id: str, current_user: Player = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def abandon_hunt(hunt_id: str, current_player_id: uuid.UUID = Depends(get_current_player_id), db: AsyncSession = Depends(get_db)):
     progress = await db.scalar(select(PlayerHuntProgress).where(
-        PlayerHuntProgress.player_id == current_user.id,
+        PlayerHuntProgress.player_id == current_player_id,
         PlayerHuntProgress.hunt_id == hunt_id
     ))
     if not progress:
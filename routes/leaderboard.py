@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from schemas import LeaderboardPage, LeaderboardAround
+from auth.utils import get_current_player_id
+from utils.leaderboard import leaderboard
+import uuid
+
+router = APIRouter()
+
+# Both endpoints read the in-memory board only; nothing here touches the database
+
+def _require_loaded():
+    if not leaderboard.loaded:
+        raise HTTPException(status_code=503, detail="Leaderboard is loading, try again shortly")
+
+@router.get("", response_model=LeaderboardPage)
+async def get_leaderboard(
+    skip: int = Query(0, ge=0, description="Number of records to skip"),
+    limit: int = Query(10, ge=1, le=100, description="Number of records to return")
+):
+    _require_loaded()
+    return {
+        "entries": [entry.__dict__ for entry in leaderboard.top(skip, limit)],
+        "total": len(leaderboard),
+        "skip": skip,
+        "limit": limit
+    }
+
+@router.get("/me", response_model=LeaderboardAround)
+async def get_my_rank(
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
+    radius: int = Query(5, ge=0, le=50, description="Players to include above and below you")
+):
+    _require_loaded()
+    me = leaderboard.rank(current_player_id)
+    return {
+        "me": me.__dict__ if me else None,
+        "entries": [entry.__dict__ for entry in leaderboard.around(current_player_id, radius)],
+        "total": len(leaderboard)
+    }
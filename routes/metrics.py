@@ -0,0 +1,9 @@
+from fastapi import APIRouter
+from utils.metrics import collect_metrics
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics():
+    """Per-worker gauges and counters for caches, pools and queues"""
+    return collect_metrics()
@@ -3,13 +3,13 @@ from cryptography.fernet import InvalidToken
 import math  # For distance calculation
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, or_, func
+from sqlalchemy import select, update, or_, func, tuple_
 from sqlalchemy.orm import joinedload
-from database import get_db
+from database import get_db, get_read_db
 from models import Player, PlayerScan, QRCode
 from schemas import PlayerHistory, ScanHistoryItem, Player as PlayerSchema, PeerScanRequest, PeerScanResponse, ErrorResponse
-from auth.utils import get_current_user
-from typing import List
+from auth.utils import get_current_user, get_current_player_id
+from typing import List, Optional, Tuple
 import os
 import uuid
 import json
@@ -18,43 +18,70 @@ import base64
 from cryptography.fernet import Fernet, InvalidToken
 import math
 from datetime import datetime, timedelta
-from utils.location import calculate_distance
+from utils.geofence import Fence
+from utils.scan_engine import record_counted_scan
+from utils.player_stats import bump_player_stats, recent_scans, scan_entry
 from .websocket import manager
 from time import perf_counter
 
 STRING_ENCODE_SECRET_KEY = os.getenv("STRING_ENCODE_SECRET_KEY", "iNbKium-f8sdpM3yp_g_ZoXz3nin2psxJ7_oPvJN7kU=")
-PEER_SCAN_COOLDOWN = os.getenv("PEER_SCAN_COOLDOWN",5 * 60)
+PEER_SCAN_COOLDOWN = int(os.getenv("PEER_SCAN_COOLDOWN", 5 * 60))
+# Players within this distance of each other pair as "near"
+PEER_PROXIMITY_METERS = 50
 cipher = Fernet(STRING_ENCODE_SECRET_KEY)
 router = APIRouter()
 
 async def get_pagination_params(
     skip: int = Query(0, ge=0, description="Number of records to skip"),
-    limit: int = Query(10, ge=1, le=50, description="Number of records to return")
+    limit: int = Query(10, ge=1, le=50, description="Number of records to return"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous page's next_cursor; overrides skip"),
+    include_total: Optional[bool] = Query(None, description="Count all of the player's scans (costs a full count per request); defaults to true for offset pages and false for cursor pages")
 ):
-    return {"skip": skip, "limit": limit}
+    if include_total is None:
+        # Cursor pages exist to avoid scanning the whole history, so they skip the count unless asked
+        include_total = cursor is None
+    return {"skip": skip, "limit": limit, "cursor": cursor, "include_total": include_total}
+
+def peer_proximity_status(orig_latitude: float, orig_longitude: float, latitude: float, longitude: float) -> str:
+    """"near" when the scanner is inside a PEER_PROXIMITY_METERS fence around the other player"""
+    fence = Fence.at(orig_latitude, orig_longitude, PEER_PROXIMITY_METERS)
+    return "near" if fence.contains(latitude, longitude) else "far"
+
+def encode_history_cursor(scan_time: datetime, scan_id: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(f"{scan_time.isoformat()},{scan_id}".encode()).decode()
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        scan_time, scan_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(",")
+        return datetime.fromisoformat(scan_time), uuid.UUID(scan_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 # Get player history
 @router.get("/my_history", response_model=PlayerHistory)
 async def get_player_history(
-    current_user: Player = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
+    db: AsyncSession = Depends(get_read_db),
     pagination: dict = Depends(get_pagination_params)
 ):
     skip = pagination["skip"]
     limit = pagination["limit"]
-
-    # Base query for PlayerScan
-    base_query = select(PlayerScan).where(PlayerScan.player_id == current_user.id)
+    cursor = pagination["cursor"]
 
     # Count total scans
-    total_query = select(func.count()).select_from(base_query.subquery())
-    total_result = await db.execute(total_query)
-    total = total_result.scalar()
-
-    # Fetch paginated scans with explicit column selection
+    total = None
+    if pagination["include_total"]:
+        total_query = select(func.count()).select_from(PlayerScan).where(PlayerScan.player_id == current_player_id)
+        total_result = await db.execute(total_query)
+        total = total_result.scalar()
+
+    # Fetch paginated scans with explicit column selection, newest first.
+    # (scan_time, id) ordering is served by ix_player_scans_player_time_id, and
+    # since it is also the partition order the first page reads the newest partition first.
     query = (
         select(
             PlayerScan.scan_time,
+            PlayerScan.id,
             PlayerScan.success,
             PlayerScan.scan_type,
             PlayerScan.proximity_status,
@@ -64,18 +91,32 @@ async def get_player_history(
         .select_from(PlayerScan)
         .outerjoin(QRCode, PlayerScan.qr_code_id == QRCode.id)
         .outerjoin(Player, PlayerScan.peer_player_id == Player.id)
-        .where(PlayerScan.player_id == current_user.id)
-        .order_by(PlayerScan.scan_time.desc())
-        .offset(skip)
-        .limit(limit)
+        .where(PlayerScan.player_id == current_player_id)
+        .order_by(PlayerScan.scan_time.desc(), PlayerScan.id.desc())
+        .limit(limit + 1)  # One extra row tells us whether there is a next page
     )
+    if cursor:
+        # Keyset pagination: seek past the last row of the previous page instead of OFFSET
+        cursor_time, cursor_id = decode_history_cursor(cursor)
+        query = query.where(
+            tuple_(PlayerScan.scan_time, PlayerScan.id) < tuple_(cursor_time, cursor_id),
+            PlayerScan.scan_time <= cursor_time  # Plain bound on the partition key, so newer partitions are pruned
+        )
+        skip = 0
+    else:
+        query = query.offset(skip)
     result = await db.execute(query)
     scans = result.fetchall()  # Returns tuples with selected columns
 
+    next_cursor = None
+    if len(scans) > limit:
+        scans = scans[:limit]
+        next_cursor = encode_history_cursor(scans[-1].scan_time, scans[-1].id)
+
     # Build response
     scan_history = []
     for scan_tuple in scans:
-        scan_time, success, scan_type, proximity_status, qr_code, peer_username = scan_tuple
+        scan_time, _, success, scan_type, proximity_status, qr_code, peer_username = scan_tuple
         item = ScanHistoryItem(
             scan_time=scan_time,
             success=success,
@@ -90,7 +131,8 @@ async def get_player_history(
         total=total,
         skip=skip,
         limit=limit,
-        scans=scan_history
+        scans=scan_history,
+        next_cursor=next_cursor
     )
 
 # Get current player profile
@@ -104,10 +146,10 @@ async def get_current_player(
 @router.get("/{player_id}/history", response_model=PlayerHistory)
 async def get_player_scan_history(
     player_id: uuid.UUID,
-    db: AsyncSession = Depends(get_db),
-    current_user: Player = Depends(get_current_user)
+    db: AsyncSession = Depends(get_read_db),
+    current_player_id: uuid.UUID = Depends(get_current_player_id)
 ):
-    if str(current_user.id) != str(player_id):
+    if str(current_player_id) != str(player_id):
         raise HTTPException(status_code=403, detail="Not authorized to view this player's history")
 
     query = select(PlayerScan, QRCode).join(
@@ -145,15 +187,16 @@ async def update_progress(
 async def record_scan(
     qr_code_id: uuid.UUID,
     success: bool,
-    current_user: Player = Depends(get_current_user),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
     db: AsyncSession = Depends(get_db)
 ):
     qr_code = await db.get(QRCode, qr_code_id)
     if not qr_code:
         raise HTTPException(status_code=404, detail="QR code not found")
 
-    new_scan = PlayerScan(player_id=current_user.id, qr_code_id=qr_code_id, success=success)
-    db.add(new_scan)
+    attempt_number = await record_counted_scan(db, current_player_id, qr_code, success=success)
+    if attempt_number is None:
+        raise HTTPException(status_code=429, detail="Scan not available yet for this QR code")
     await db.commit()
     return {"message": "Scan recorded successfully"}
 
@@ -161,7 +204,7 @@ async def record_scan(
 @router.post("/peer_scan/generate")
 async def generate_peer_scan_qr(
     location: dict,  # Expecting JSON object { "latitude": ..., "longitude": ... }
-    current_user: Player = Depends(get_current_user),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
     db: AsyncSession = Depends(get_db)
 ):
     start = perf_counter()
@@ -172,7 +215,7 @@ async def generate_peer_scan_qr(
     print(f"Validation took: {validation_time - start:.4f}s", flush=True)
     # Create payload with player ID, location, and timestamp
     payload = {
-        "player_id": str(current_user.id),
+        "player_id": str(current_player_id),
         "location": location['location'],
         "timestamp": int(time.time())  # Unix timestamp
     }
@@ -234,35 +277,34 @@ async def validate_peer_scan(
     if current_time - timestamp > 300:
         return ErrorResponse(message="You can’t pair with yourself!")
     
-    # Check these players haven't paired recently
-    recent_scan_query = select(PlayerScan).where(
+    # Check these players haven't paired recently. A pairing still cooling down
+    # is at most PEER_SCAN_COOLDOWN old, so only the latest partition(s) are read
+    now = datetime.utcnow()
+    recent_scan_query = select(PlayerScan.next_scan_available_at).where(
         or_(
-            (PlayerScan.player_id == current_user.id) & (PlayerScan.qr_code_id == player_id),
-            (PlayerScan.player_id == player_id) & (PlayerScan.qr_code_id == current_user.id)
+            (PlayerScan.player_id == current_user.id) & (PlayerScan.peer_player_id == uuid.UUID(player_id)),
+            (PlayerScan.player_id == uuid.UUID(player_id)) & (PlayerScan.peer_player_id == current_user.id)
         ),
         PlayerScan.scan_type == "peer",
-        PlayerScan.next_scan_available_at > func.now()
-    )
-    result = await db.execute(recent_scan_query)
-    recent_scan = result.scalars().first()
+        PlayerScan.scan_time >= func.now() - timedelta(seconds=PEER_SCAN_COOLDOWN),
+        PlayerScan.next_scan_available_at > now
+    ).limit(1)
+    recent_scan_until = await db.scalar(recent_scan_query)
 
-    if recent_scan:
-        time_left = (recent_scan.next_scan_available_at - func.now()).total_seconds()
+    if recent_scan_until:
+        time_left = (recent_scan_until - now).total_seconds()
         minutes_left = int(time_left // 60) + 1
         return ErrorResponse(
             message=f"You paired with this player recently. Wait {minutes_left} minute(s) before pairing again."
         )
 
     # Check Proximity
-    distance = calculate_distance(
+    proximity_status = peer_proximity_status(
         orig_location["latitude"],
         orig_location["longitude"],
         body.latitude,
         body.longitude
     )
-    proximity_status = "far"
-    if distance < 50:  # 50 meters threshold
-        proximity_status = "near"
 
     # Fetch Player 1's info
     matched_player = await db.get(Player, uuid.UUID(player_id))
@@ -301,8 +343,12 @@ async def validate_peer_scan(
         next_scan_available_at=next_scan_at
     )
     db.add(scanned_scan)
+    await bump_player_stats(db, current_user.id, True, "peer")
+    await bump_player_stats(db, uuid.UUID(player_id), True, "peer")
 
     await db.commit()
+    recent_scans.push(current_user.id, scan_entry(None, scan_time, True, "peer"))
+    recent_scans.push(player_id, scan_entry(None, scan_time, True, "peer"))
     # Prepare success message
     message = (
         f"Paired successfully with {matched_player.username}! "
@@ -1,15 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from database import get_db
-from models import QRCode, PlayerScan, Player, PlayerHuntProgress
-from schemas import QRScanRequest, QRScanResponse, QRCodeMetadata
-from utils.location import validate_location
-from utils.generate_qr_code import generate_qr_code
-from auth.utils import get_current_user
-from datetime import timedelta, datetime
+from sqlalchemy import select, func, cast
+from geoalchemy2 import Geography
+from database import get_db, get_read_db
+from models import QRCode
+from schemas import QRScanRequest, QRScanResponse, QRCodeMetadata, NearbyQRCodesResponse, NearbyQRCode
+from utils.scan_engine import process_scan
+from utils.qr_cache import qr_code_cache, location_columns
+from utils.spatial_index import nearby_index
+from auth.utils import get_current_player_id
 import logging
 import uuid
+from datetime import datetime, timezone
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -17,102 +19,100 @@ logger = logging.getLogger(__name__)
 @router.post("/scan", response_model=QRScanResponse)
 async def scan_qr_code(
     scan_request: QRScanRequest,
-    current_user: Player = Depends(get_current_user),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
     db: AsyncSession = Depends(get_db)
 ):
     # Validate player
-    print("current user:",  current_user)
-    # if str(current_user.id) != str(scan_request.player_id):
+    # if str(current_player_id) != str(scan_request.player_id):
     #     raise HTTPException(status_code=403, detail="Not authorized to scan for this player")
 
-    # Fetch or create QR code
-    qr_code = await db.execute(
-        select(QRCode).where(QRCode.code == scan_request.qr_code)
-    )
-    qr_code = qr_code.scalar_one_or_none()
-    scan_type = "standard"
-    if not qr_code:
-        scan_type = "discovery"
-        qr_code = await generate_qr_code(scan_request.qr_code, db, latitude=scan_request.latitude, longitude=scan_request.longitude)
-
-    # Check location if required
-    location_valid = True
-    if qr_code.requires_location:
-        if not scan_request.latitude or not scan_request.longitude:
-            location_valid = False
-        else:
-            location_valid = validate_location(
-                scan_request.latitude,
-                scan_request.longitude,
-                qr_code.location
-            )
-
-    # Check how many times the player has scanned this QR code before
-    previous_scans = await db.execute(
-        select(PlayerScan)
-        .where(PlayerScan.player_id == current_user.id)
-        .where(PlayerScan.qr_code_id == qr_code.id)
-    )
-    scan_count = len(previous_scans.scalars().all())  # Get previous scan attempts
-
-    # Determine when the player can scan again
-    next_scan_available_at = None
-    if qr_code.scan_cooldown_seconds:
-        next_scan_available_at = datetime.utcnow() + timedelta(seconds=qr_code.scan_cooldown_seconds)
-
-    # Create new PlayerScan record
-    new_scan = PlayerScan(
-        player_id=current_user.id,
-        qr_code_id=qr_code.id,
+    # Resolve code, attempts, cooldown and hunt status and record the scan in one statement
+    result = await process_scan(
+        db,
+        current_player_id,
+        scan_request.qr_code,
         latitude=scan_request.latitude,
-        longitude=scan_request.longitude,
-        attempt_number=scan_count + 1,  # Increment scan attempt count
-        next_scan_available_at=next_scan_available_at , # Set cooldown time if applicable,
-        success=location_valid,
-        scan_type=scan_type
+        longitude=scan_request.longitude
     )
 
-    db.add(new_scan)
-    await db.commit()
-
-    hunt_status = None
-    if qr_code and qr_code.scan_type == "transportation" and qr_code.reward_data.get("hunt_id"):
-        hunt_id = qr_code.reward_data["hunt_id"]
-        progress = await db.scalar(select(PlayerHuntProgress).where(
-            PlayerHuntProgress.player_id == current_user.id,
-            PlayerHuntProgress.hunt_id == hunt_id
-        ))
-        if progress:
-            if progress.completed_at:
-                hunt_status = "completed"
-            elif progress.abandoned_at:
-                hunt_status = "abandoned"
-            else:
-                hunt_status = "active"
+    if not result.allowed:
+        if result.cooldown_until and result.cooldown_until > datetime.now(timezone.utc):
+            minutes_left = int((result.cooldown_until - datetime.now(timezone.utc)).total_seconds() // 60) + 1
+            message = f"You scanned this code recently. Wait {minutes_left} minute(s) before scanning again."
         else:
-            hunt_status = "new"
+            message = "You have reached the scan limit for this code."
+        return QRScanResponse(
+            status="unavailable",
+            encounter_type=result.encounter_type,
+            reward_data=None,
+            message=message,
+            location_valid=None,
+            ok=False,
+            hunt_status=result.hunt_status
+        )
 
-    print("qr_code:", qr_code.reward_data)
     return QRScanResponse(
         status="success",
-        encounter_type=qr_code.scan_type,
-        reward_data=qr_code.reward_data if qr_code.reward_data else None,
-        message="Location check failed" if not location_valid else None,
-        location_valid=location_valid,
+        encounter_type=result.encounter_type,
+        reward_data=result.reward_data,
+        message="Location check failed" if not result.location_valid else None,
+        location_valid=result.location_valid,
         ok=True,
-        hunt_status=hunt_status
+        hunt_status=result.hunt_status
+    )
+
+@router.get("/nearby", response_model=NearbyQRCodesResponse)
+async def get_nearby_qr_codes(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius: float = Query(500, gt=0, le=5000, description="Search radius in meters"),
+    skip: int = Query(0, ge=0, description="Number of records to skip"),
+    limit: int = Query(20, ge=1, le=100, description="Number of records to return"),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Discovered QR codes within `radius` meters of the player, nearest first"""
+    if db.get_bind().dialect.name == "postgresql":
+        # ST_DWithin and the <-> ordering are both served by the GiST index on qr_codes.location
+        point = cast(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326), Geography(geometry_type="POINT", srid=4326))
+        rows = (await db.execute(
+            select(
+                QRCode.code,
+                QRCode.description,
+                QRCode.scan_type,
+                QRCode.requires_location,
+                *location_columns(QRCode.location),
+                func.ST_Distance(QRCode.location, point).label("distance_meters")
+            )
+            .where(func.ST_DWithin(QRCode.location, point, radius))
+            .order_by(QRCode.location.op("<->")(point))
+            .offset(skip)
+            .limit(limit + 1)  # One extra row tells us whether there is a next page
+        )).all()
+        codes = [NearbyQRCode(**row._mapping) for row in rows]
+    else:
+        # No PostGIS (e.g. SQLite): fall back to the in-process geohash index
+        await nearby_index.ensure_loaded(db)
+        hits = nearby_index.nearby(latitude, longitude, radius)[skip:skip + limit + 1]
+        codes = [
+            NearbyQRCode(code=code, latitude=location[0], longitude=location[1], distance_meters=distance, **data)
+            for code, distance, location, data in hits
+        ]
+
+    return NearbyQRCodesResponse(
+        codes=codes[:limit],
+        skip=skip,
+        limit=limit,
+        has_more=len(codes) > limit
     )
 
 @router.get("/{code}", response_model=QRCodeMetadata)
 async def get_qr_metadata(
     code: str,
-    current_user: Player = Depends(get_current_user),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
     db: AsyncSession = Depends(get_db)
 ):
-    qr_code = await db.execute(
-        select(QRCode).where(QRCode.code == code)
-    )
-    qr_code = qr_code.scalar_one_or_none()
+    qr_code = await qr_code_cache.get(db, code)
     if not qr_code:
         raise HTTPException(status_code=404, detail="QR code not found")
 
@@ -0,0 +1,102 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_, or_
+from database import get_read_db
+from models import GeoCellCount, RegionPlayerCount, Player
+from schemas import HeatmapResponse, RegionalTopResponse
+from utils.geo_rollup import ROLLUP_CELL_PRECISION, ROLLUP_REGION_PRECISION
+from utils.spatial_index import geohash_encode
+from auth.utils import get_current_player_id
+from typing import Optional
+import re
+import uuid
+
+router = APIRouter()
+
+# Everything here reads the rollup tables maintained by utils.geo_rollup, never player_scans
+
+GEOHASH_PATTERN = re.compile(r"^[0-9bcdefghjkmnpqrstuvwxyz]+$")
+
+def _parse_bbox(bbox: str):
+    """Parses min_lon,min_lat,max_lon,max_lat; min_lon > max_lon means the box crosses the antimeridian"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise HTTPException(status_code=400, detail="bbox is out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+@router.get("/heatmap", response_model=HeatmapResponse)
+async def get_heatmap(
+    bbox: str = Query(..., description="min_lon,min_lat,max_lon,max_lat"),
+    precision: int = Query(ROLLUP_CELL_PRECISION, ge=1, le=ROLLUP_CELL_PRECISION, description="Geohash length of the returned cells"),
+    max_cells: int = Query(2000, ge=1, le=10000),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Scan counts per geohash cell inside the box, busiest first"""
+    min_lon, min_lat, max_lon, max_lat = _parse_bbox(bbox)
+    longitude_filter = (
+        GeoCellCount.longitude.between(min_lon, max_lon) if min_lon <= max_lon
+        else or_(GeoCellCount.longitude >= min_lon, GeoCellCount.longitude <= max_lon)
+    )
+    # Served by ix_geo_cell_counts_lat_lon; coarser precisions merge cells sharing a prefix
+    cell = func.substr(GeoCellCount.cell, 1, precision) if precision < ROLLUP_CELL_PRECISION else GeoCellCount.cell
+    scans = func.sum(GeoCellCount.scans)
+    rows = (await db.execute(
+        select(
+            cell.label("cell"),
+            (func.sum(GeoCellCount.latitude * GeoCellCount.scans) / scans).label("latitude"),
+            (func.sum(GeoCellCount.longitude * GeoCellCount.scans) / scans).label("longitude"),
+            scans.label("scans")
+        )
+        .where(and_(GeoCellCount.latitude.between(min_lat, max_lat), longitude_filter))
+        .group_by(cell)
+        .order_by(scans.desc())
+        .limit(max_cells + 1)
+    )).all()
+
+    return {
+        "precision": precision,
+        "cells": [
+            {"cell": row.cell, "latitude": row.latitude, "longitude": row.longitude, "scans": row.scans}
+            for row in rows[:max_cells]
+        ],
+        "truncated": len(rows) > max_cells
+    }
+
+@router.get("/regions/top", response_model=RegionalTopResponse)
+async def get_regional_top(
+    region: Optional[str] = Query(None, description=f"Geohash of the region ({ROLLUP_REGION_PRECISION} characters)"),
+    latitude: Optional[float] = Query(None, ge=-90, le=90),
+    longitude: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(10, ge=1, le=100),
+    current_player_id: uuid.UUID = Depends(get_current_player_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Top scanners of a region, given either its geohash or a point inside it"""
+    if region is None:
+        if latitude is None or longitude is None:
+            raise HTTPException(status_code=400, detail="Pass region or latitude and longitude")
+        region = geohash_encode(latitude, longitude, ROLLUP_REGION_PRECISION)
+    region = region.lower()
+    if len(region) != ROLLUP_REGION_PRECISION or not GEOHASH_PATTERN.match(region):
+        raise HTTPException(status_code=400, detail=f"region must be a {ROLLUP_REGION_PRECISION} character geohash")
+
+    # Backward scan of ix_region_player_counts_region_scans, then `limit` primary key lookups
+    rows = (await db.execute(
+        select(RegionPlayerCount.player_id, RegionPlayerCount.scans, Player.username)
+        .join(Player, Player.id == RegionPlayerCount.player_id)
+        .where(RegionPlayerCount.region == region)
+        .order_by(RegionPlayerCount.scans.desc())
+        .limit(limit)
+    )).all()
+
+    # Competition ranking: ties share a rank
+    players, rank = [], 0
+    for position, row in enumerate(rows, start=1):
+        if position == 1 or row.scans != rows[position - 2].scans:
+            rank = position
+        players.append({"rank": rank, "player_id": str(row.player_id), "username": row.username, "scans": row.scans})
+    return {"region": region, "players": players}
@@ -1,120 +1,345 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from typing import Dict, Set, List, Tuple
+from typing import Dict, Set, List, Optional, Tuple
 import json
 import asyncio
-import asyncpg
 import os
 import logging
 import uuid
 import random
+import time
+from datetime import timedelta
 #from auth.utils import get_current_user_from_token
-from utils.minigames.rps_handler import RPSHandler
+from auth.utils import create_access_token, principal_cache, PRINCIPAL_CHANGED_CHANNEL
 from utils.minigames.GameHandler import GameHandler
-from urllib.parse import urlparse, urlunparse
+from utils.minigames.engine import GameEngine, game_registry, DEFAULT_GAME_TYPE
+from utils.hunt_catalog import hunt_catalog, HUNT_UPDATED_CHANNEL
+from utils.backplane import Backplane, backplane, BACKPLANE_CHANNEL
+from utils.channel_slots import ChannelSlots, Member, channel_slots, CHANNEL_SLOTS
+from utils.ws_connection import QueuedSocket, send_stats, WS_HEARTBEAT_SECONDS, WS_IDLE_TIMEOUT_SECONDS
+from utils.ws_protocol import JSON, InvalidFrame, negotiate, encode_json_text, receive_event
+from utils.metrics import register_metrics, process_rss_bytes
+from utils.session_store import QR_LOGIN_TTL_SECONDS
+from utils.db_listener import NotificationListener, create_listener
+from utils.leaderboard import leaderboard, LEADERBOARD_CHANNEL
+from database import database_url
 from dotenv import load_dotenv
 load_dotenv()
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
-game_registry = {
-    "rps": RPSHandler
-}
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backplane: Backplane, slots: ChannelSlots):
         # Store player connections
-        self.active_player_connections: Dict[str, List[Tuple[WebSocket, str]]] = {}
+        self.active_player_connections: Dict[str, List[Tuple[QueuedSocket, str]]] = {}
         # Store login session connections
-        self.login_session_connections: Dict[str, WebSocket] = {}
-        # Store Game Sessions
-        self.games: Dict[str, GameHandler] = {}  # channel_id -> GameHandler instance
+        self.login_session_connections: Dict[str, QueuedSocket] = {}
+        # Store Game Sessions, keyed by channel_id; turn timeouts report through send_game_result
+        self.games = GameEngine(on_result=self.send_game_result)
+        # Relays deliveries for sockets held by other workers
+        self.backplane = backplane
+        backplane.subscribe(self.handle_remote)
+        # A channel's two sockets may be on different workers: the slots are counted
+        # cluster-wide and the game runs on the worker whose connect filled the channel
+        self.slots = slots
+        # Games running on another worker, channel_id -> that worker's node id
+        self.remote_games: Dict[str, str] = {}
+        self._heartbeat_task: asyncio.Task = None
+        self.reaped = 0
 
-    async def connect_player(self, websocket: WebSocket, player_id: str, connecting_player_id: str):
-        if player_id not in self.active_player_connections:
-            self.active_player_connections[player_id] = []
-        if len(self.active_player_connections[player_id]) >= 2:
+    async def connect_player(self, websocket: WebSocket, player_id: str, connecting_player_id: str, encoding: str = JSON, subprotocol: str = None, game_type: str = DEFAULT_GAME_TYPE, heartbeat: bool = False) -> Optional[QueuedSocket]:
+        # Sockets already closed for failed sends shouldn't hold a slot until the next reap
+        for conn, _ in self.active_player_connections.get(player_id, ()):
+            if conn.closed:
+                await self.disconnect_player(conn.websocket, player_id)
+        claim = await self.slots.claim(player_id, connecting_player_id)
+        if claim is None:
             await websocket.send_text(json.dumps({"event": "rejected", "reason": "game_full"}))
             await websocket.close()
-            return False
-        self.active_player_connections[player_id].append((websocket, connecting_player_id))
-        await websocket.accept()
-        return True
+            return None
+        await websocket.accept(subprotocol=subprotocol)
+        conn = QueuedSocket(websocket, encoding, heartbeat=heartbeat)
+        conn.slot = claim.slot
+        self.active_player_connections.setdefault(player_id, []).append((conn, connecting_player_id))
+        # Start game when two players are connected
+        if len(claim.members) == CHANNEL_SLOTS and player_id not in self.games:
+            await self.start_game(player_id, game_type, claim.members)
+        return conn
 
-    async def connect_login_session(self, websocket: WebSocket, session_id: str):
-        await websocket.accept()
-        self.login_session_connections[session_id] = websocket
+    async def connect_login_session(self, websocket: WebSocket, session_id: str, encoding: str = JSON, subprotocol: str = None):
+        await websocket.accept(subprotocol=subprotocol)
+        self.login_session_connections[session_id] = QueuedSocket(websocket, encoding)
 
-    def disconnect_player(self, websocket: WebSocket, player_id: str):
+    async def disconnect_player(self, websocket: WebSocket, player_id: str):
         print("Disconnecting",player_id)
         if player_id in self.active_player_connections:
-            self.active_player_connections[player_id] = [(ws, pid) for ws, pid in self.active_player_connections[player_id] if ws != websocket]
+            remaining = []
+            left = []
+            for conn, pid in self.active_player_connections[player_id]:
+                if conn.websocket == websocket:
+                    conn.close()
+                    left.append(conn.slot)
+                else:
+                    remaining.append((conn, pid))
+            self.active_player_connections[player_id] = remaining
             if not self.active_player_connections[player_id]:
                 del self.active_player_connections[player_id]
+            for slot in left:
+                await self.leave(player_id, slot)
+
+    async def leave(self, player_id: str, slot: int):
+        """Frees a socket's slot; the game ends once no worker holds a socket of the channel"""
+        await self.slots.release(player_id, slot)
+        if player_id not in self.active_player_connections and not await self.slots.members(player_id):
+            self.games.end(player_id)  # Nobody left to finish it
+            self.remote_games.pop(player_id, None)
+            await self.publish_game(player_id, {"action": "left"})
 
     def disconnect_login_session(self, session_id: str):
         if session_id in self.login_session_connections:
-            del self.login_session_connections[session_id]
+            # Flushes anything still queued (e.g. login_success) before stopping
+            self.login_session_connections.pop(session_id).close()
 
     async def broadcast_to_player(self, player_id: str, message: str):
-        if player_id in self.active_player_connections:
-            for connection in self.active_player_connections[player_id]:
-                print(connection[0].application_state)
-                await connection[0].send_text(message)
+        # The player's other socket may be on another worker; that worker
+        # delivers it and this one skips its own copy
+        await self.deliver_to_player(player_id, message)
+        await self.backplane.publish("player", player_id, message)
+
+    async def deliver_to_player(self, player_id: str, message: str):
+        """Queues the message on this worker's sockets for the player; never waits on the network"""
+        encoded = {JSON: message}  # Each encoding is serialised once per broadcast
+        for conn, _ in self.active_player_connections.get(player_id, ()):
+            if conn.encoding not in encoded:
+                encoded[conn.encoding] = encode_json_text(message, conn.encoding)
+            conn.send(encoded[conn.encoding])
     
     async def broadcast_game_message(self, player_id: str, message: str):
         if player_id not in self.active_player_connections:
             return  # No players - nothing to broadcast
         
-        # Ensure all WebSockets are accepted
-        for websocket, _ in self.active_player_connections[player_id]:
-            # No need to re-accept - already done in connect_player
-            await websocket.send_text(message)
+        # No need to re-accept - already done in connect_player
+        await self.deliver_to_player(player_id, message)
         
         # Start game if two players and no game exists
-        if len(self.active_player_connections[player_id]) == 2 and player_id not in self.games:
-            player_ids = [pid for _, pid in self.active_player_connections[player_id]]
-            game_type = "rps"  # Hardcode for now
-            self.games[player_id] = game_registry[game_type](player_ids)
-            start_message = json.dumps({
-                "event": "start_game",
-                "game_type": game_type,
-                "players": player_ids
-            })
-            # Broadcast start game to all players
-            for websocket, _ in self.active_player_connections[player_id]:
-                await websocket.send_text(start_message)
+        if player_id not in self.games and player_id not in self.remote_games:
+            members = await self.slots.members(player_id)
+            if len(members) == CHANNEL_SLOTS:
+                await self.start_game(player_id, members=members)
+
+    async def start_game(self, player_id: str, game_type: str = DEFAULT_GAME_TYPE, members: List[Member] = ()):
+        player_ids = [member.player_id for member in members]
+        game = self.games.start(player_id, player_ids, game_type)
+        self.remote_games.pop(player_id, None)
+        # Any other worker still running a game on this channel drops it
+        await self.publish_game(player_id, {"action": "started", "node_id": self.backplane.node_id})
+        await self.broadcast_to_player(player_id, self.game_state_message(game))
+
+    async def publish_game(self, player_id: str, event: dict):
+        await self.backplane.publish("game", player_id, json.dumps(event))
+
+    async def play_move(self, player_id: str, slot: int, mover_id: str, data: dict):
+        """Runs a move on the worker holding the game, forwarding it there if that's another worker"""
+        if player_id not in self.games and player_id in self.remote_games:
+            await self.publish_game(player_id, {"action": "move", "slot": slot, "player_id": mover_id, "data": data})
+            return
+        result = await self.games.move(player_id, mover_id, data)
+        if result.error:
+            await self.send_to_slot(player_id, slot, json.dumps({
+                "event": "move_rejected",
+                "reason": result.error
+            }))
+        elif result.finished:
+            # Game state is already cleared by the engine
+            await self.send_game_result(player_id, None, result.winner)
+
+    async def resend_game_state(self, player_id: str, game_type: str = DEFAULT_GAME_TYPE):
+        game = self.games.get(player_id)
+        if game:
+            # Resend existing game state
+            await self.broadcast_to_player(player_id, self.game_state_message(game))
+        elif player_id in self.remote_games:
+            await self.publish_game(player_id, {"action": "state"})
+        else:
+            # Create new game if 2 players are connected
+            members = await self.slots.members(player_id)
+            if len(members) == CHANNEL_SLOTS:
+                await self.start_game(player_id, game_type, members)
 
-    async def send_login_success(self, session_id: str, token: str):
+    def game_state_message(self, game: GameHandler) -> str:
+        # Also sent to players rejoining a running game
+        return json.dumps({
+            "event": "start_game",
+            "game_type": game.game_type,
+            "players": game.player_ids,
+            "state": game.snapshot()
+        })
+
+    async def send_game_result(self, player_id: str, game: GameHandler, winner: str, reason: str = "completed"):
+        await self.publish_game(player_id, {"action": "ended"})
+        await self.broadcast_to_player(player_id, json.dumps({
+            "event": "result",
+            "winner": winner,
+            "reason": reason
+        }))
+
+    def send_to_socket(self, player_id: str, websocket: WebSocket, message: str):
+        for conn, _ in self.active_player_connections.get(player_id, ()):
+            if conn.websocket == websocket:
+                conn.send(encode_json_text(message, conn.encoding))
+
+    async def send_to_slot(self, player_id: str, slot: int, message: str):
+        """Sends to the one socket holding the slot, wherever it's connected"""
+        if not self.deliver_to_slot(player_id, slot, message):
+            await self.backplane.publish("slot", player_id, json.dumps({"slot": slot, "message": message}))
+
+    def deliver_to_slot(self, player_id: str, slot: int, message: str) -> bool:
+        for conn, _ in self.active_player_connections.get(player_id, ()):
+            if conn.slot == slot:
+                conn.send(encode_json_text(message, conn.encoding))
+                return True
+        return False
+
+    async def send_login_success(self, session_id: str, player_id: str):
+        if not await self.deliver_login_success(session_id, player_id):
+            # The browser is waiting on another worker. Only the ids go over the
+            # backplane; the worker holding the socket mints the token itself
+            await self.backplane.publish("login", session_id, player_id)
+
+    async def deliver_login_success(self, session_id: str, player_id: str) -> bool:
         if session_id in self.login_session_connections:
-            print(session_id,token)
-            await self.login_session_connections[session_id].send_text(
-                json.dumps({
-                    "event": "login_success",
-                    "token": token
-                })
-            )
+            # Create a new token for the web session
+            message = json.dumps({
+                "event": "login_success",
+                "token": create_access_token(data={"sub": player_id}, expires_delta=timedelta(minutes=30))
+            })
+            conn = self.login_session_connections[session_id]
+            conn.send(encode_json_text(message, conn.encoding))
             # Clean up the login session after successful login
             self.disconnect_login_session(session_id)
+            return True
+        return False
 
-manager = ConnectionManager()
+    async def handle_remote(self, kind: str, target: str, message: str):
+        """Delivers a message another worker published on the backplane"""
+        if kind == "player":
+            await self.deliver_to_player(target, message)
+        elif kind == "login":
+            await self.deliver_login_success(target, message)
+        elif kind == "slot":
+            data = json.loads(message)
+            self.deliver_to_slot(target, data["slot"], data["message"])
+        elif kind == "game":
+            await self.handle_remote_game(target, json.loads(message))
 
-async def database_listener():
-    raw_url = os.getenv("DATABASE_URL")
-    parsed = urlparse(raw_url)
-    clean_url = urlunparse(("postgresql", parsed.netloc, parsed.path, parsed.params, parsed.query, parsed.fragment))
-    conn = await asyncpg.connect(clean_url)
-    await conn.add_listener('qr_scan', handle_notification)
-    await conn.add_listener('player_interaction', handle_notification)
-    while True:
-        await asyncio.sleep(1)
+    async def handle_remote_game(self, player_id: str, event: dict):
+        action = event["action"]
+        if action == "started":
+            self.games.end(player_id)
+            self.remote_games[player_id] = event["node_id"]
+        elif action in ("ended", "left"):
+            self.remote_games.pop(player_id, None)
+            if action == "left":
+                self.games.end(player_id)
+        elif player_id in self.games:
+            # Only the worker running the game answers moves and state requests
+            if action == "move":
+                await self.play_move(player_id, event["slot"], event["player_id"], event["data"])
+            elif action == "state":
+                await self.resend_game_state(player_id)
 
-async def handle_notification(conn, pid, channel, payload):
+    def start_heartbeat(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop_heartbeat(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            try:
+                reaped = await self.reap()
+                if reaped:
+                    logger.info("Reaped %d dead websockets", reaped)
+                await self.slots.refresh()
+            except Exception:
+                logger.exception("Websocket reaper failed")
+
+    async def reap(self, now: float = None) -> int:
+        """
+        One pass over every socket: drops those that have already failed, and
+        pings quiet heartbeat clients, closing them once silent past
+        WS_IDLE_TIMEOUT_SECONDS. Clients without heartbeat support are only
+        checked by protocol-level pings (WS_PING_INTERVAL_SECONDS), so a silent
+        one keeps its game. Login sockets are closed once their session can no
+        longer be completed.
+        """
+        now = time.monotonic() if now is None else now
+        ping = {JSON: json.dumps({"event": "ping"})}
+        reaped = 0
+        left = []
+        for player_id, conns in list(self.active_player_connections.items()):
+            alive = []
+            for conn, pid in conns:
+                if conn.closed or (conn.heartbeat and now - conn.last_seen > WS_IDLE_TIMEOUT_SECONDS):
+                    conn.abort()
+                    left.append((player_id, conn.slot))
+                    reaped += 1
+                    continue
+                if conn.heartbeat and now - conn.last_seen > WS_HEARTBEAT_SECONDS:
+                    if conn.encoding not in ping:
+                        ping[conn.encoding] = encode_json_text(ping[JSON], conn.encoding)
+                    conn.send(ping[conn.encoding])
+                alive.append((conn, pid))
+            if len(alive) != len(conns):
+                if alive:
+                    self.active_player_connections[player_id] = alive
+                else:
+                    del self.active_player_connections[player_id]
+        for session_id, conn in list(self.login_session_connections.items()):
+            if conn.closed or now - conn.connected_at > QR_LOGIN_TTL_SECONDS:
+                del self.login_session_connections[session_id]
+                conn.abort()
+                reaped += 1
+        for player_id, slot in left:
+            await self.leave(player_id, slot)
+        self.reaped += reaped
+        return reaped
+
+    def metrics(self) -> dict:
+        depths = [conn.depth() for conns in self.active_player_connections.values() for conn, _ in conns]
+        depths += [conn.depth() for conn in self.login_session_connections.values()]
+        return {
+            "player_sockets": sum(len(conns) for conns in self.active_player_connections.values()),
+            "login_sockets": len(self.login_session_connections),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": send_stats.sent,
+            "dropped": send_stats.dropped,
+            "overflow_disconnects": send_stats.overflow_disconnects,
+            "failed_sends": send_stats.failed,
+            "reaped": self.reaped,
+            "rss_bytes": process_rss_bytes(),
+        }
+
+manager = ConnectionManager(backplane, channel_slots)
+register_metrics("websockets", manager.metrics)
+register_metrics("games", manager.games.metrics)
+
+# Every worker LISTENs, so notification handlers only deliver to local sockets.
+# Created in startup_event rather than at import
+listener: Optional[NotificationListener] = None
+
+async def handle_notification(channel, payload):
     data = json.loads(payload)
     event_type = data.get('event_type')
 
     if event_type == 'qr_scan':
         player_id = data['player_id']
-        await manager.broadcast_to_player(
+        await manager.deliver_to_player(
             player_id,
             json.dumps({
                 "event": "qr_scan",
@@ -124,93 +349,113 @@ async def handle_notification(conn, pid, channel, payload):
         )
     elif event_type == 'player_interaction':
         # Handle player-to-player interaction notifications
+        message = json.dumps({
+            "event": "player_interaction",
+            "interaction_type": data['interaction_type'],
+            "success": data['success'],
+            "message": data.get('message')
+        })
         for player_id in [data['player1_id'], data['player2_id']]:
-            await manager.broadcast_to_player(
-                player_id,
-                json.dumps({
-                    "event": "player_interaction",
-                    "interaction_type": data['interaction_type'],
-                    "success": data['success'],
-                    "message": data.get('message')
-                })
-            )
+            await manager.deliver_to_player(player_id, message)
+
+async def handle_notification_batch(channel, payloads):
+    # qr_scan bursts are handed over together; one bad payload shouldn't lose the rest
+    for payload in payloads:
+        try:
+            await handle_notification(channel, payload)
+        except Exception:
+            logger.exception("Bad %s notification: %s", channel, payload)
+
+async def handle_hunt_updated(channel, payload):
+    # Payload is the edited hunt's id; empty means drop every cached hunt
+    hunt_catalog.invalidate(payload or None)
+
+async def handle_principal_changed(channel, payload):
+    # Payload is the changed player's id
+    principal_cache.invalidate(payload)
+
+async def handle_backplane_message(channel, payload):
+    await manager.backplane.dispatch(payload)
+
+def build_listener() -> NotificationListener:
+    listener = create_listener(database_url)
+    listener.add_batch_handler('qr_scan', handle_notification_batch)
+    listener.add_handler('player_interaction', handle_notification)
+    listener.add_handler(HUNT_UPDATED_CHANNEL, handle_hunt_updated)
+    listener.add_handler(PRINCIPAL_CHANGED_CHANNEL, handle_principal_changed)
+    listener.add_handler(BACKPLANE_CHANNEL, handle_backplane_message)
+    listener.add_batch_handler(LEADERBOARD_CHANNEL, leaderboard.handle_notifications)
+    # Hunt edits, player changes and score changes made while the listener was down were never seen
+    listener.on_reconnect(hunt_catalog.invalidate)
+    listener.on_reconnect(principal_cache.clear)
+    listener.on_reconnect(leaderboard.request_rebuild)
+    return listener
 
 @router.websocket("/ws/player/{player_id}")
-async def player_websocket_endpoint(websocket: WebSocket, player_id: str, player2_id: str = Query(None)):
+async def player_websocket_endpoint(websocket: WebSocket, player_id: str, player2_id: str = Query(None), game_type: str = Query(DEFAULT_GAME_TYPE), encoding: str = Query(JSON), heartbeat: bool = Query(False)):
+    if game_type not in game_registry:
+        await websocket.close(code=1008)
+        return
     # Assume connecting_player_id is passed via auth or query param - mock for now
     connecting_player_id = player2_id if player2_id else player_id
     
     # Connect the player and check if accepted (enforces two-player limit)
-    is_accepted = await manager.connect_player(websocket, player_id, connecting_player_id)
-    if not is_accepted:
+    encoding, subprotocol = negotiate(websocket, encoding)
+    conn = await manager.connect_player(websocket, player_id, connecting_player_id, encoding, subprotocol, game_type, heartbeat)
+    if conn is None:
         return  # Exit early if rejected (e.g., third player)
     
-    # Start game when two players are connected
-    print("active games before deciding to start or not:", manager.games, flush=True)
-    if len(manager.active_player_connections[player_id]) == 2 and player_id not in manager.games:
-        player_ids = [pid for _, pid in manager.active_player_connections[player_id]]
-        game_type = 'rps'
-        manager.games[player_id] = game_registry[game_type](player_ids)
-        print("making new game",flush=True)
-        await manager.broadcast_to_player(player_id, json.dumps({
-            "event": "start_game",
-            "game_type": game_type,
-            "players": player_ids
-        }))
-    
     # Handle messages (moves and game logic)
     try:
         while True:
-            data = await websocket.receive_text()
-            data_dict = json.loads(data)
+            try:
+                data_dict = await receive_event(websocket, encoding)
+            except InvalidFrame as e:
+                # One malformed frame shouldn't cost the player their game
+                conn.touch()
+                manager.send_to_socket(player_id, websocket, json.dumps({
+                    "event": "invalid_message",
+                    "reason": str(e)
+                }))
+                continue
+            conn.touch()
+            if data_dict.get("event") == "pong":
+                continue  # Heartbeat reply; touch() is all it's for
             if data_dict.get("event") == "move":
-                print("move detected", data_dict,flush=True)
-                game = manager.games.get(player_id)
-                if game and data_dict["player_id"] in game.player_ids:
-                    game_continues = await game.process_move(data_dict["player_id"], data_dict["data"])
-                    if not game_continues:
-                        winner = await game.check_winner()
-                        if not winner:
-                            winner = "tie"
-                        await manager.broadcast_to_player(player_id, json.dumps({
-                            "event": "result",
-                            "winner": winner
-                        }))
-                        # for ws, _ in manager.active_player_connections[player_id]:
-                        #     await ws.close()
-                        del manager.games[player_id]  # Clear game state after result
+                print("move detected", data_dict.get("player_id"),flush=True)
+                await manager.play_move(player_id, conn.slot, data_dict.get("player_id"), data_dict.get("data"))
             elif data_dict.get("event") == "request_game_state":
-                print("Received request_game_state from:", data_dict["player_id"])
-                game = manager.games.get(player_id)
-                if game:
-                    # Resend existing game state
-                    await manager.broadcast_to_player(player_id, json.dumps({
-                        "event": "start_game",
-                        "game_type": "rps",
-                        "players": game.player_ids
-                    }))
-                elif len(manager.active_player_connections[player_id]) == 2:
-                    # Create new game if 2 players are connected
-                    player_ids = [pid for _, pid in manager.active_player_connections[player_id]]
-                    game_type = "rps"
-                    manager.games[player_id] = game_registry[game_type](player_ids)
-                    await manager.broadcast_to_player(player_id, json.dumps({
-                        "event": "start_game",
-                        "game_type": game_type,
-                        "players": player_ids
-                    }))
+                print("Received request_game_state from:", data_dict.get("player_id"))
+                await manager.resend_game_state(player_id, game_type)
     except WebSocketDisconnect:
-        manager.disconnect_player(websocket, player_id)
+        await manager.disconnect_player(websocket, player_id)
 
 @router.websocket("/ws/login/{session_id}")
-async def login_websocket_endpoint(websocket: WebSocket, session_id: str):
-    await manager.connect_login_session(websocket, session_id)
+async def login_websocket_endpoint(websocket: WebSocket, session_id: str, encoding: str = Query(JSON)):
+    encoding, subprotocol = negotiate(websocket, encoding)
+    await manager.connect_login_session(websocket, session_id, encoding, subprotocol)
     try:
         while True:
-            await websocket.receive_text()
+            try:
+                # Nothing is expected from the browser; this just waits for the disconnect
+                await receive_event(websocket, encoding)
+            except InvalidFrame:
+                pass
     except WebSocketDisconnect:
         manager.disconnect_login_session(session_id)
 
 @router.on_event("startup")
 async def startup_event():
-    asyncio.create_task(database_listener())
\ No newline at end of file
+    global listener
+    if listener is None:
+        listener = build_listener()
+    listener.start()
+    manager.start_heartbeat()
+
+@router.on_event("shutdown")
+async def shutdown_event():
+    if listener is not None:
+        await listener.stop()
+    await manager.games.wheel.stop()
+    await manager.stop_heartbeat()
+    await manager.backplane.close()
@@ -45,6 +45,21 @@ class QRCodeMetadata(BaseModel):
     scan_type: str
     requires_location: bool
 
+class NearbyQRCode(BaseModel):
+    code: str
+    description: Optional[str] = None
+    scan_type: Optional[str] = None
+    requires_location: Optional[bool] = None
+    latitude: float
+    longitude: float
+    distance_meters: float
+
+class NearbyQRCodesResponse(BaseModel):
+    codes: List[NearbyQRCode]
+    skip: int
+    limit: int
+    has_more: bool
+
 class ScanHistoryItem(BaseModel):
     scan_time: datetime
     success: bool
@@ -54,10 +69,11 @@ class ScanHistoryItem(BaseModel):
     peer_username: Optional[str] = None
 
 class PlayerHistory(BaseModel):
-    total: int
+    total: Optional[int] = None  # Only counted when include_total is requested
     skip: int
     limit: int
     scans: List[ScanHistoryItem]
+    next_cursor: Optional[str] = None
 
 class WebSocketMessage(BaseModel):
     event: str
@@ -106,4 +122,41 @@ class ActiveHuntResponse(BaseModel):
     hunts: List[HuntResponse]
     total: int
     skip: int
-    limit: int
\ No newline at end of file
+    limit: int
+class LeaderboardEntry(BaseModel):
+    rank: int  # Players with equal scores share a rank
+    player_id: str
+    username: Optional[str] = None
+    score: int
+
+class LeaderboardPage(BaseModel):
+    entries: List[LeaderboardEntry]
+    total: int
+    skip: int
+    limit: int
+
+class LeaderboardAround(BaseModel):
+    me: Optional[LeaderboardEntry] = None
+    entries: List[LeaderboardEntry]
+    total: int
+
+class HeatmapCell(BaseModel):
+    cell: str  # Geohash
+    latitude: float  # Scan-weighted centre
+    longitude: float
+    scans: int
+
+class HeatmapResponse(BaseModel):
+    precision: int
+    cells: List[HeatmapCell]
+    truncated: bool  # Only the busiest max_cells cells were returned
+
+class RegionalTopEntry(BaseModel):
+    rank: int
+    player_id: str
+    username: Optional[str] = None
+    scans: int
+
+class RegionalTopResponse(BaseModel):
+    region: str
+    players: List[RegionalTopEntry]
@@ -0,0 +1,72 @@
+import uuid
+import numpy as np
+from utils.geo_rollup import quantize, geohash_many, bucket_scans, backfill_buckets, GeoRollup
+from utils.spatial_index import geohash_encode
+
+POINTS = [
+    (0.0, 0.0),
+    (51.5007, -0.1246),
+    (-33.8568, 151.2153),
+    (40.6892, -74.0445),
+    (89.9999, 179.9999),
+    (-90.0, -180.0),
+    (35.6586, 139.7454),
+]
+
+
+def test_geohash_many_matches_geohash_encode():
+    latitudes, longitudes = zip(*POINTS)
+    for precision in (1, 4, 5, 7, 9):
+        rows, cols = quantize(latitudes, longitudes, precision)
+        expected = [geohash_encode(lat, lon, precision) for lat, lon in POINTS]
+        assert list(geohash_many(rows, cols, precision)) == expected
+
+
+def test_geohash_many_matches_on_random_points():
+    rng = np.random.default_rng(7)
+    latitudes = rng.uniform(-90, 90, 500)
+    longitudes = rng.uniform(-180, 180, 500)
+    rows, cols = quantize(latitudes, longitudes, 7)
+    expected = [geohash_encode(lat, lon, 7) for lat, lon in zip(latitudes, longitudes)]
+    assert list(geohash_many(rows, cols, 7)) == expected
+
+
+def test_bucket_scans_counts_cells_and_regions():
+    player = uuid.uuid4()
+    other = uuid.uuid4()
+    cell_rows, region_rows = bucket_scans(
+        [player, player, other], [51.5007, 51.5007, -33.8568], [-0.1246, -0.1246, 151.2153],
+        cell_precision=7, region_precision=4,
+    )
+    assert sorted((cell, scans) for cell, _, _, scans in cell_rows) == sorted([
+        (geohash_encode(51.5007, -0.1246, 7), 2),
+        (geohash_encode(-33.8568, 151.2153, 7), 1),
+    ])
+    assert sorted(region_rows, key=str) == sorted([
+        (geohash_encode(51.5007, -0.1246, 4), player, 2),
+        (geohash_encode(-33.8568, 151.2153, 4), other, 1),
+    ], key=str)
+
+
+def test_backfill_matches_incremental_rollup_over_mixed_scan_types():
+    player = uuid.uuid4()
+    other = uuid.uuid4()
+    # (player_id, latitude, longitude, scan_type, attempt_number) as stored in player_scans
+    scans = [
+        (player, 51.5007, -0.1246, "standard", 1),
+        (player, 51.5007, -0.1246, "discovery", 1),
+        (player, 51.5007, -0.1246, "peer", 1),
+        (other, -33.8568, 151.2153, "peer", 1),
+        (other, -33.8568, 151.2153, "standard", 2),
+        (other, -33.8568, 151.2153, "standard", None),
+        (other, None, None, "standard", 3),
+    ]
+    rollup = GeoRollup()
+    for player_id, latitude, longitude, scan_type, attempt_number in scans:
+        rollup.add(player_id, latitude, longitude, scan_type, attempt_number)
+    incremental = bucket_scans(rollup._player_ids, rollup._latitudes, rollup._longitudes)
+    backfilled = backfill_buckets(scans)
+
+    assert len(rollup) == 3
+    assert sorted(backfilled[0]) == sorted(incremental[0])
+    assert sorted(backfilled[1], key=str) == sorted(incremental[1], key=str)
@@ -0,0 +1,44 @@
+import asyncio
+import base64
+import uuid
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from routes.player import encode_history_cursor, decode_history_cursor, get_pagination_params
+
+
+def test_cursor_round_trip():
+    scan_time = datetime(2026, 10, 17, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    scan_id = uuid.uuid4()
+    cursor = encode_history_cursor(scan_time, scan_id)
+    assert decode_history_cursor(cursor) == (scan_time, scan_id)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_history_cursor(datetime(2026, 1, 1, tzinfo=timezone.utc), uuid.uuid4())
+    assert not set(cursor) - set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"no-comma").decode(),
+    base64.urlsafe_b64encode(b"yesterday," + str(uuid.uuid4()).encode()).decode(),
+    base64.urlsafe_b64encode(b"2026-10-17T12:00:00+00:00,not-a-uuid").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe,\xfd").decode(),
+    base64.urlsafe_b64encode(b"a,b,c").decode(),
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_history_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("cursor, include_total, expected", [
+    (None, None, True),
+    ("abc", None, False),
+    ("abc", True, True),
+    (None, False, False),
+])
+def test_include_total_defaults_to_offset_pages_only(cursor, include_total, expected):
+    params = asyncio.run(get_pagination_params(skip=0, limit=10, cursor=cursor, include_total=include_total))
+    assert params["include_total"] is expected
@@ -0,0 +1,39 @@
+from utils.leaderboard import Leaderboard
+
+
+def make_board(scores):
+    board = Leaderboard()
+    board.load((player_id, score, f"name-{player_id}") for player_id, score in scores.items())
+    return board
+
+
+def test_tied_scores_share_a_rank():
+    board = make_board({"a": 30, "b": 20, "c": 20, "d": 10})
+    assert [(p.player_id, p.rank) for p in board.top(0, 10)] == [("a", 1), ("b", 2), ("c", 2), ("d", 4)]
+    assert board.rank("c").rank == 2
+    assert board.rank("d").rank == 4
+
+
+def test_update_moves_player_and_keeps_ties():
+    board = make_board({"a": 30, "b": 20, "c": 10})
+    board.update("c", 30)
+    assert board.rank("c").rank == 1
+    assert board.rank("a").rank == 1
+    assert board.rank("b").rank == 3
+    assert len(board) == 3
+
+
+def test_around_top_of_board():
+    board = make_board({str(i): 100 - i for i in range(10)})
+    assert [p.player_id for p in board.around("0", radius=2)] == ["0", "1", "2"]
+
+
+def test_around_bottom_of_board():
+    board = make_board({str(i): 100 - i for i in range(10)})
+    assert [p.player_id for p in board.around("9", radius=2)] == ["7", "8", "9"]
+
+
+def test_around_middle_and_unknown_player():
+    board = make_board({str(i): 100 - i for i in range(10)})
+    assert [p.player_id for p in board.around("5", radius=1)] == ["4", "5", "6"]
+    assert board.around("missing") == []
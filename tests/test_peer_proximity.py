@@ -0,0 +1,25 @@
+import math
+from routes.player import peer_proximity_status, PEER_PROXIMITY_METERS
+from utils.geofence import EARTH_RADIUS_METERS
+
+ORIGIN = (51.5007, -0.1246)
+
+
+def north_of(meters: float):
+    return ORIGIN[0] + math.degrees(meters / EARTH_RADIUS_METERS), ORIGIN[1]
+
+
+def test_same_spot_is_near():
+    assert peer_proximity_status(*ORIGIN, *ORIGIN) == "near"
+
+
+def test_just_inside_50m_is_near():
+    assert peer_proximity_status(*ORIGIN, *north_of(PEER_PROXIMITY_METERS - 0.5)) == "near"
+
+
+def test_just_outside_50m_is_far():
+    assert peer_proximity_status(*ORIGIN, *north_of(PEER_PROXIMITY_METERS + 0.5)) == "far"
+
+
+def test_far_away_is_far():
+    assert peer_proximity_status(*ORIGIN, 48.8584, 2.2945) == "far"
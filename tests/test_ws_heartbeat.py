@@ -0,0 +1,54 @@
+import asyncio
+import time
+from routes.websocket import ConnectionManager
+from utils.backplane import InMemoryBackplane
+from utils.channel_slots import MemoryChannelSlots
+from utils.ws_connection import WS_IDLE_TIMEOUT_SECONDS
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        pass
+
+
+def make_manager() -> ConnectionManager:
+    backplane = InMemoryBackplane()
+    return ConnectionManager(backplane, MemoryChannelSlots(backplane.node_id))
+
+
+def test_silent_client_is_not_reaped():
+    async def run():
+        manager = make_manager()
+        conn = await manager.connect_player(FakeWebSocket(), "channel", "p1")
+        reaped = await manager.reap(now=time.monotonic() + WS_IDLE_TIMEOUT_SECONDS * 10)
+        await asyncio.sleep(0)
+        return reaped, conn, manager, conn.websocket.sent
+
+    reaped, conn, manager, sent = asyncio.run(run())
+    assert reaped == 0
+    assert not conn.closed
+    assert [c for c, _ in manager.active_player_connections["channel"]] == [conn]
+    assert sent == []  # Never sent a ping event it doesn't understand
+
+
+def test_silent_heartbeat_client_is_reaped():
+    async def run():
+        manager = make_manager()
+        conn = await manager.connect_player(FakeWebSocket(), "channel", "p1", heartbeat=True)
+        reaped = await manager.reap(now=time.monotonic() + WS_IDLE_TIMEOUT_SECONDS * 10)
+        return reaped, conn, manager, await manager.slots.members("channel")
+
+    reaped, conn, manager, members = asyncio.run(run())
+    assert reaped == 1
+    assert conn.closed
+    assert "channel" not in manager.active_player_connections
+    assert members == []
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# "postgres" relays through NOTIFY on BACKPLANE_CHANNEL; "memory" only reaches this process
+REALTIME_BACKPLANE = os.getenv("REALTIME_BACKPLANE", "postgres")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "ws_backplane")
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD = 7900
+# Queued publishes are sent together, up to this many per statement
+BACKPLANE_BATCH_SIZE = int(os.getenv("BACKPLANE_BATCH_SIZE", 200))
+# Beyond this many unsent publishes (database down) new ones are dropped
+BACKPLANE_MAX_PENDING = int(os.getenv("BACKPLANE_MAX_PENDING", 10000))
+BACKPLANE_RETRY_SECONDS = float(os.getenv("BACKPLANE_RETRY_SECONDS", 1))
+
+Handler = Callable[[str, str, str], Awaitable[None]]  # (kind, target, message)
+
+
+class Backplane(ABC):
+    """
+    Relays websocket deliveries between workers. Every worker delivers to its
+    own sockets first, then publishes; subscribers skip their own messages.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self._handlers: List[Handler] = []
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    def subscribe(self, handler: Handler):
+        self._handlers.append(handler)
+
+    @abstractmethod
+    async def publish(self, kind: str, target: str, message: str):
+        pass
+
+    async def close(self):
+        """Stops any background sending; nothing to do for most backends"""
+
+    async def dispatch(self, payload: str):
+        """Delivers a published envelope to local subscribers unless it came from this node"""
+        envelope = json.loads(payload)
+        if envelope.get("origin") == self.node_id:
+            return
+        self.received += 1
+        for handler in self._handlers:
+            try:
+                await handler(envelope["kind"], envelope["target"], envelope["message"])
+            except Exception:
+                logger.exception("Backplane handler failed for %s %s", envelope.get("kind"), envelope.get("target"))
+
+    def envelope(self, kind: str, target: str, message: str) -> str:
+        return json.dumps({"origin": self.node_id, "kind": kind, "target": target, "message": message})
+
+    def metrics(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class InMemoryBackplane(Backplane):
+    """
+    Connects backplanes that live in the same process. Single-worker setups and
+    tests use it; `linked` builds peers that stand in for separate workers.
+    """
+
+    def __init__(self, peers: List["InMemoryBackplane"] = None):
+        super().__init__()
+        self._peers = peers if peers is not None else []
+        self._peers.append(self)
+
+    def linked(self) -> "InMemoryBackplane":
+        return InMemoryBackplane(self._peers)
+
+    async def publish(self, kind: str, target: str, message: str):
+        self.published += 1
+        payload = self.envelope(kind, target, message)
+        for peer in self._peers:
+            await peer.dispatch(payload)
+
+
+class PostgresBackplane(Backplane):
+    """
+    Publishes with pg_notify; the websocket database listener feeds incoming
+    notifications on BACKPLANE_CHANNEL to `dispatch`. `publish` only queues
+    the envelope: one writer task sends everything queued in a single
+    statement on its own long-lived autocommit connection.
+    """
+
+    def __init__(self, engine=None, batch_size: int = BACKPLANE_BATCH_SIZE, max_pending: int = BACKPLANE_MAX_PENDING):
+        super().__init__()
+        self._engine = engine
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: List[str] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[AsyncConnection] = None
+        self.batches = 0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from database import engine
+            self._engine = engine
+        return self._engine
+
+    async def publish(self, kind: str, target: str, message: str):
+        payload = self.envelope(kind, target, message)
+        if len(payload.encode()) >= MAX_NOTIFY_PAYLOAD:
+            self.dropped += 1
+            logger.error("Backplane message for %s %s is too large for NOTIFY (%d bytes)", kind, target, len(payload))
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(payload)
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                if not await self._send(self._take()):
+                    await asyncio.sleep(BACKPLANE_RETRY_SECONDS)
+
+    def _take(self) -> List[str]:
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        return batch
+
+    async def _send(self, payloads: List[str]) -> bool:
+        try:
+            if self._conn is None:
+                conn = await self.engine.connect()
+                self._conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await self._conn.execute(
+                text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+                {"channel": BACKPLANE_CHANNEL, "payloads": payloads},
+            )
+        except Exception:
+            # Deliveries are best effort, like the sockets they feed; start over on a fresh connection
+            self.dropped += len(payloads)
+            logger.exception("Backplane publish of %d messages failed", len(payloads))
+            await self._discard_connection()
+            return False
+        self.published += len(payloads)
+        self.batches += 1
+        return True
+
+    async def _discard_connection(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception:
+                logger.debug("Closing the backplane connection failed", exc_info=True)
+
+    async def close(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # Send what's left once; anything after a failure is dropped
+        while self._pending and await self._send(self._take()):
+            pass
+        self.dropped += len(self._pending)
+        self._pending = []
+        await self._discard_connection()
+
+    def metrics(self) -> dict:
+        return {**super().metrics(), "pending": len(self._pending), "batches": self.batches}
+
+
+def create_backplane(kind: str = REALTIME_BACKPLANE) -> Backplane:
+    if kind == "memory":
+        return InMemoryBackplane()
+    if kind == "postgres":
+        return PostgresBackplane()
+    raise ValueError(f"Unknown REALTIME_BACKPLANE: {kind}")
+
+
+backplane = create_backplane()
+register_metrics("backplane", backplane.metrics)
@@ -0,0 +1,162 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import select, insert, update, delete, func, literal_column
+from models import GameChannelSlot
+from utils.metrics import register_metrics
+from utils.backplane import backplane
+
+# "postgres" counts a channel's sockets on every worker; "memory" only works with a single worker
+GAME_CHANNEL_STORE = os.getenv("GAME_CHANNEL_STORE", "postgres")
+# Sockets one game channel (the websocket player_id) takes; the game starts once all are connected
+CHANNEL_SLOTS = 2
+# Slots of a worker that stopped refreshing them (e.g. it crashed) are free again after this long
+CHANNEL_SLOT_STALE_SECONDS = float(os.getenv("CHANNEL_SLOT_STALE_SECONDS", 120))
+# Arbitrary constant for the advisory lock that serialises claims on one channel
+CLAIM_LOCK_ID = 7261004
+
+
+class Member(NamedTuple):
+    slot: int
+    player_id: str  # The connecting player
+    node_id: str  # Worker holding the socket
+
+
+class Claim(NamedTuple):
+    slot: int  # The slot just taken
+    members: List[Member]  # Every member by slot, the new one included
+
+
+class ChannelSlots(ABC):
+    """
+    Who holds each socket slot of a game channel across every worker, so the
+    two-player limit holds no matter where the load balancer puts the sockets.
+    """
+
+    def __init__(self, node_id: str):
+        self.node_id = node_id
+        self.claims = 0
+        self.rejected = 0
+
+    @abstractmethod
+    async def claim(self, channel_id: str, player_id: str) -> Optional[Claim]:
+        """Takes the lowest free slot, or returns None when the channel is full"""
+        pass
+
+    @abstractmethod
+    async def release(self, channel_id: str, slot: int):
+        pass
+
+    @abstractmethod
+    async def members(self, channel_id: str) -> List[Member]:
+        pass
+
+    async def refresh(self):
+        """Keeps this worker's slots from going stale; call at least every CHANNEL_SLOT_STALE_SECONDS"""
+
+    def metrics(self) -> dict:
+        return {"backend": type(self).__name__, "claims": self.claims, "rejected": self.rejected}
+
+
+class MemoryChannelSlots(ChannelSlots):
+    def __init__(self, node_id: str):
+        super().__init__(node_id)
+        self._channels: Dict[str, Dict[int, Member]] = {}
+
+    async def claim(self, channel_id: str, player_id: str) -> Optional[Claim]:
+        slots = self._channels.setdefault(channel_id, {})
+        free = next((slot for slot in range(CHANNEL_SLOTS) if slot not in slots), None)
+        if free is None:
+            self.rejected += 1
+            return None
+        slots[free] = Member(free, player_id, self.node_id)
+        self.claims += 1
+        return Claim(free, sorted(slots.values()))
+
+    async def release(self, channel_id: str, slot: int):
+        slots = self._channels.get(channel_id, {})
+        slots.pop(slot, None)
+        if not slots:
+            self._channels.pop(channel_id, None)
+
+    async def members(self, channel_id: str) -> List[Member]:
+        return sorted(self._channels.get(channel_id, {}).values())
+
+    def metrics(self) -> dict:
+        return {**super().metrics(), "channels": len(self._channels)}
+
+
+class PostgresChannelSlots(ChannelSlots):
+    """
+    Slots in the UNLOGGED game_channel_slots table. Claims on one channel are
+    serialised by an advisory lock, so exactly one claim fills a channel.
+    """
+
+    def __init__(self, node_id: str, engine=None, stale_seconds: float = CHANNEL_SLOT_STALE_SECONDS):
+        super().__init__(node_id)
+        self._engine = engine
+        self.stale_seconds = stale_seconds
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from database import engine
+            self._engine = engine
+        return self._engine
+
+    def _fresh(self):
+        return GameChannelSlot.seen_at > func.now() - self.stale_seconds * literal_column("interval '1 second'")
+
+    def _select_members(self, channel_id: str):
+        return (
+            select(GameChannelSlot.slot, GameChannelSlot.player_id, GameChannelSlot.node_id)
+            .where(GameChannelSlot.channel_id == channel_id)
+            .order_by(GameChannelSlot.slot)
+        )
+
+    async def claim(self, channel_id: str, player_id: str) -> Optional[Claim]:
+        async with self.engine.begin() as conn:
+            await conn.execute(select(func.pg_advisory_xact_lock(CLAIM_LOCK_ID, func.hashtext(channel_id))))
+            await conn.execute(delete(GameChannelSlot).where(GameChannelSlot.channel_id == channel_id, ~self._fresh()))
+            members = [Member(*row) for row in await conn.execute(self._select_members(channel_id))]
+            taken = {member.slot for member in members}
+            free = next((slot for slot in range(CHANNEL_SLOTS) if slot not in taken), None)
+            if free is None:
+                self.rejected += 1
+                return None
+            await conn.execute(insert(GameChannelSlot).values(
+                channel_id=channel_id, slot=free, player_id=player_id, node_id=self.node_id
+            ))
+        self.claims += 1
+        return Claim(free, sorted(members + [Member(free, player_id, self.node_id)]))
+
+    async def release(self, channel_id: str, slot: int):
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(GameChannelSlot).where(
+                GameChannelSlot.channel_id == channel_id,
+                GameChannelSlot.slot == slot,
+                GameChannelSlot.node_id == self.node_id,
+            ))
+
+    async def members(self, channel_id: str) -> List[Member]:
+        async with self.engine.connect() as conn:
+            rows = await conn.execute(self._select_members(channel_id).where(self._fresh()))
+            return [Member(*row) for row in rows]
+
+    async def refresh(self):
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                update(GameChannelSlot).where(GameChannelSlot.node_id == self.node_id).values(seen_at=func.now())
+            )
+
+
+def create_channel_slots(node_id: str, kind: str = GAME_CHANNEL_STORE) -> ChannelSlots:
+    if kind == "memory":
+        return MemoryChannelSlots(node_id)
+    if kind == "postgres":
+        return PostgresChannelSlots(node_id)
+    raise ValueError(f"Unknown GAME_CHANNEL_STORE: {kind}")
+
+
+channel_slots = create_channel_slots(backplane.node_id)
+register_metrics("channel_slots", channel_slots.metrics)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+LISTENER_QUEUE_SIZE = int(os.getenv("LISTENER_QUEUE_SIZE", 10000))
+LISTENER_WORKERS = int(os.getenv("LISTENER_WORKERS", 4))
+# Most notifications a worker takes off the queue in one go for batched channels
+LISTENER_BATCH_SIZE = int(os.getenv("LISTENER_BATCH_SIZE", 100))
+LISTENER_BACKOFF_MIN_SECONDS = float(os.getenv("LISTENER_BACKOFF_MIN_SECONDS", 0.5))
+LISTENER_BACKOFF_MAX_SECONDS = float(os.getenv("LISTENER_BACKOFF_MAX_SECONDS", 30))
+# How often the supervisor checks the connection is still alive
+LISTENER_CHECK_SECONDS = float(os.getenv("LISTENER_CHECK_SECONDS", 15))
+
+Handler = Callable[[str, str], Awaitable[None]]  # (channel, payload)
+BatchHandler = Callable[[str, List[str]], Awaitable[None]]  # (channel, payloads)
+
+
+def listener_dsn(url: str) -> str:
+    """Plain postgresql:// DSN for asyncpg from a (possibly SQLAlchemy style) URL"""
+    parsed = urlparse(url)
+    return urlunparse(("postgresql", parsed.netloc, parsed.path, parsed.params, parsed.query, parsed.fragment))
+
+
+class NotificationListener:
+    """
+    Supervised LISTEN connection. The asyncpg callback only queues the
+    notification; a small pool of workers runs the handlers. The connection is
+    re-established with exponential backoff whenever it drops, and
+    `on_reconnect` callbacks run afterwards since notifications sent while
+    disconnected are lost.
+    """
+
+    def __init__(self, dsn: str, queue_size: int = LISTENER_QUEUE_SIZE, workers: int = LISTENER_WORKERS):
+        self.dsn = dsn
+        self.workers = workers
+        self._handlers: Dict[str, Handler] = {}
+        self._batch_handlers: Dict[str, BatchHandler] = {}
+        self._on_reconnect: List[Callable[[], None]] = []
+        self._queue: asyncio.Queue = None
+        self._queue_size = queue_size
+        self._tasks: List[asyncio.Task] = []
+        self._conn: Optional[asyncpg.Connection] = None
+        self._lost: Optional[asyncio.Event] = None
+        self.connected = False
+        self.connects = 0
+        self.received = 0
+        self.dropped = 0
+        self.handler_errors = 0
+        self.last_error: Optional[str] = None
+        self.last_connected_at: Optional[float] = None
+
+    def add_handler(self, channel: str, handler: Handler):
+        self._handlers[channel] = handler
+
+    def add_batch_handler(self, channel: str, handler: BatchHandler):
+        """For bursty channels: the handler gets every queued payload for the channel at once"""
+        self._batch_handlers[channel] = handler
+
+    def on_reconnect(self, callback: Callable[[], None]):
+        self._on_reconnect.append(callback)
+
+    @property
+    def channels(self):
+        return list(self._handlers) + list(self._batch_handlers)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self._queue_size)
+        self._tasks = [asyncio.create_task(self._supervise())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._close()
+
+    def _notify(self, conn, pid, channel, payload):
+        self.received += 1
+        try:
+            self._queue.put_nowait((channel, payload))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _terminated(self, conn):
+        if self._lost:
+            self._lost.set()
+
+    async def _connect(self):
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(self._terminated)
+        for channel in self.channels:
+            await conn.add_listener(channel, self._notify)
+        return conn
+
+    async def _close(self):
+        conn, self._conn = self._conn, None
+        self.connected = False
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+    async def _supervise(self):
+        backoff = LISTENER_BACKOFF_MIN_SECONDS
+        while True:
+            delay = backoff * random.uniform(0.5, 1.5)
+            try:
+                self._lost = asyncio.Event()
+                self._conn = await self._connect()
+                self.connected = True
+                self.last_connected_at = time.time()
+                self.connects += 1
+                backoff = LISTENER_BACKOFF_MIN_SECONDS
+                logger.info("Listening on %s", ", ".join(self.channels))
+                if self.connects > 1:
+                    for callback in self._on_reconnect:
+                        callback()
+                await self._wait_until_lost()
+                logger.warning("Notification listener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.warning("Notification listener failed (%r), retrying in %.1fs", e, delay)
+            await self._close()
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, LISTENER_BACKOFF_MAX_SECONDS)
+
+    async def _wait_until_lost(self):
+        # Termination callbacks don't fire for every network failure, so also probe
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), LISTENER_CHECK_SECONDS)
+                return
+            except asyncio.TimeoutError:
+                if self._conn.is_closed():
+                    return
+                try:
+                    await self._conn.execute("SELECT 1", timeout=LISTENER_CHECK_SECONDS)
+                except Exception as e:
+                    self.last_error = repr(e)
+                    return
+
+    async def _work(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < LISTENER_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._dispatch(batch)
+
+    async def _dispatch(self, batch: List[Tuple[str, str]]):
+        batched: Dict[str, List[str]] = {}
+        for channel, payload in batch:
+            if channel in self._batch_handlers:
+                batched.setdefault(channel, []).append(payload)
+            else:
+                await self._run(self._handlers[channel], channel, payload)
+        for channel, payloads in batched.items():
+            await self._run(self._batch_handlers[channel], channel, payloads)
+
+    async def _run(self, handler, channel, payload):
+        try:
+            await handler(channel, payload)
+        except Exception:
+            self.handler_errors += 1
+            logger.exception("Notification handler for %s failed", channel)
+
+    def metrics(self) -> dict:
+        return {
+            "healthy": self.connected,
+            "connects": self.connects,
+            "reconnects": max(self.connects - 1, 0),
+            "last_connected_at": self.last_connected_at,
+            "last_error": self.last_error,
+            "received": self.received,
+            "dropped": self.dropped,
+            "handler_errors": self.handler_errors,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+        }
+
+
+def create_listener(url: str) -> NotificationListener:
+    listener = NotificationListener(listener_dsn(url))
+    register_metrics("db_listener", listener.metrics)
+    return listener
@@ -1,10 +1,13 @@
 import uuid
 import random
 from datetime import datetime, timedelta
+from typing import Tuple
 from geoalchemy2 import WKTElement
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
+from sqlalchemy import select, exists, literal, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from models import QRCode, Encounter  # Assuming your models are imported here
+from utils.qr_cache import qr_code_cache
 
 # Define possible scan types
 SCAN_TYPES = ["item_drop", "encounter", "transportation"]
@@ -63,17 +66,15 @@ QR_TYPE_PROBABILITIES = {
     "transportation": 0.1  # 10% chance for transportation
 }
 
-async def generate_qr_code(scan_code: str, db: AsyncSession, latitude: float = None, longitude: float = None) -> QRCode:
+async def generate_qr_code(scan_code: str, db: AsyncSession, latitude: float = None, longitude: float = None) -> Tuple[QRCode, bool]:
     """
     Generates a new QR code entry in the database with randomized properties.
+    The code, its encounter and reward payload are written in one
+    INSERT ... ON CONFLICT (code) DO NOTHING statement, so players discovering
+    the same code at once all get back the single row that won the insert.
+    Returns (qr_code, created); created is False when another caller's insert won.
+    Nothing is committed, so the caller adds a created code to nearby_index after its commit.
     """
-    # Check if QR code already exists
-    existing_qr_code = await db.execute(select(QRCode).where(QRCode.code == scan_code))
-    existing_qr_code = existing_qr_code.scalars().first()
-    
-    if existing_qr_code:
-        return existing_qr_code
-    
     scan_type = random.choices(list(QR_TYPE_PROBABILITIES.keys()), weights=QR_TYPE_PROBABILITIES.values())[0]
     
     # Determine cooldown and scan limits based on type
@@ -86,53 +87,35 @@ async def generate_qr_code(scan_code: str, db: AsyncSession, latitude: float = N
     # Set an expiration date (optional, for seasonal events)
     expiration_date = datetime.utcnow() + timedelta(days=random.randint(30, 365)) if random.random() < 0.2 else None
 
-    # Generate QR code entry
-    qr_code = QRCode(
-        id=uuid.uuid4(),
-        code=scan_code,
-        description=f"Generated QR Code {scan_code}",
-        scan_type=scan_type,
-        requires_location=(random.random() < 0.5),  # 50% chance location is required
-        location=WKTElement(f"POINT({longitude} {latitude})", srid=4326) if latitude and longitude else None,
-        scan_cooldown_seconds=cooldown_seconds,
-        max_scans_per_player=max_scans_per_player,
-        is_repeatable=is_repeatable,
-        expiration_date=expiration_date,
-        reward_data={},  # Empty for now, can be extended later
-    )
-
-    db.add(qr_code)
-    await db.flush()
+    qr_code_id = uuid.uuid4()
+    encounter = None
+    reward_data = {}  # Empty for now, can be extended later
 
     # If an encounter, generate associated encounter entry
     if scan_type == "encounter":
-        encounter = Encounter(
-            id=uuid.uuid4(),
-            qr_code_id=qr_code.id,
-            puzzle_type=random.choice(PUZZLE_TYPES),
-            difficulty_level=random.randint(1, 5),
-            data={},  # Placeholder for future puzzle generation
-            repeatable=is_repeatable,
-            expires_at=expiration_date,
-        )
-        db.add(encounter)
-        await db.flush()
+        encounter = {
+            "id": uuid.uuid4(),
+            "qr_code_id": qr_code_id,
+            "puzzle_type": random.choice(PUZZLE_TYPES),
+            "difficulty_level": random.randint(1, 5),
+            "data": {},  # Placeholder for future puzzle generation
+            "repeatable": is_repeatable,
+            "expires_at": expiration_date,
+        }
 
-        qr_code.encounter_id = encounter.id  # Link the QR code to the encounter
-        
         # Add encounter details to reward_data
-        qr_code.reward_data = {
+        reward_data = {
             "type": "encounter",
-            "puzzle_type": encounter.puzzle_type,
-            "difficulty_level": encounter.difficulty_level,
-            "repeatable": encounter.repeatable,
-            "expires_at": encounter.expires_at.isoformat() if encounter.expires_at else None
+            "puzzle_type": encounter["puzzle_type"],
+            "difficulty_level": encounter["difficulty_level"],
+            "repeatable": encounter["repeatable"],
+            "expires_at": encounter["expires_at"].isoformat() if encounter["expires_at"] else None
         }
 
     # If transportation, generate transportation details
     elif scan_type == "transportation":
         destination_name = f"Secret Location {uuid.uuid4().hex[:6]}"  # Generate a name
-        qr_code.reward_data = {
+        reward_data = {
             "type": "transportation",
             "destination": destination_name,
             "coordinates": {
@@ -146,14 +129,61 @@ async def generate_qr_code(scan_code: str, db: AsyncSession, latitude: float = N
         selected_item = random.choice(ITEM_TYPES)
         item_details = ITEM_DATA[selected_item]
 
-        qr_code.reward_data = {
+        reward_data = {
             "type": "item_drop",
             "item_name": selected_item.replace("_", " ").title(),
             "rarity": item_details["rarity"],
             "description": item_details["description"],
             "value": item_details["value"]
         }
-    db.add(qr_code)
-    await db.flush()
+
+    # Insert the QR code unless another player's discovery already did
+    new_qr = (
+        pg_insert(QRCode)
+        .values(
+            id=qr_code_id,
+            code=scan_code,
+            description=f"Generated QR Code {scan_code}",
+            scan_type=scan_type,
+            requires_location=(random.random() < 0.5),  # 50% chance location is required
+            location=WKTElement(f"POINT({longitude} {latitude})", srid=4326) if latitude and longitude else None,
+            scan_cooldown_seconds=cooldown_seconds,
+            max_scans_per_player=max_scans_per_player,
+            is_repeatable=is_repeatable,
+            expiration_date=expiration_date,
+            reward_data=reward_data,
+            encounter_id=encounter["id"] if encounter else None,  # Links the QR code to the encounter
+        )
+        .on_conflict_do_nothing(index_elements=[QRCode.code])
+        .returning(*QRCode.__table__.c)
+        .cte("new_qr")
+    )
+    won = exists(select(new_qr.c.id))
+
+    # Winner's row, or the existing row when we lost the race
+    stmt = union_all(
+        select(*new_qr.c),
+        select(*QRCode.__table__.c).where(QRCode.code == scan_code, ~won)
+    )
+    if encounter:
+        # Only written if our QR code insert won; FKs are checked at end of statement
+        encounter_columns = Encounter.__table__.c
+        stmt = stmt.add_cte(
+            pg_insert(Encounter)
+            .from_select(
+                list(encounter),
+                select(*[literal(value, encounter_columns[key].type) for key, value in encounter.items()]).where(won)
+            )
+            .returning(Encounter.id)
+            .cte("new_encounter")
+        )
+
+    qr_code = (await db.execute(select(QRCode).from_statement(stmt))).scalars().first()
+    if qr_code is None:
+        # The winning insert committed after this statement's snapshot was taken
+        qr_code = await db.scalar(select(QRCode).where(QRCode.code == scan_code))
+
+    # Drop any negative cache entry for the newly discovered code
+    qr_code_cache.invalidate(scan_code)
     
-    return qr_code
+    return qr_code, qr_code.id == qr_code_id
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import math
+import os
+import time
+import uuid
+from typing import List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import PlayerScan, GeoCellCount, RegionPlayerCount
+from utils.metrics import register_metrics
+from utils.spatial_index import _BASE32
+
+logger = logging.getLogger(__name__)
+
+# Heatmap cells; 7 chars is roughly 150m x 150m
+ROLLUP_CELL_PRECISION = int(os.getenv("ROLLUP_CELL_PRECISION", 7))
+# Regions for the regional top-N; 4 chars is roughly 40km x 20km.
+# Must not be longer than ROLLUP_CELL_PRECISION (a region is a cell prefix)
+ROLLUP_REGION_PRECISION = min(int(os.getenv("ROLLUP_REGION_PRECISION", 4)), ROLLUP_CELL_PRECISION)
+# Counters are approximate: scans buffered since the last flush are lost on a crash
+ROLLUP_FLUSH_SECONDS = float(os.getenv("ROLLUP_FLUSH_SECONDS", 5))
+# Beyond this many unflushed scans (database down) new ones are dropped from the stats
+ROLLUP_MAX_PENDING = int(os.getenv("ROLLUP_MAX_PENDING", 200000))
+ROLLUP_BACKFILL_CHUNK = int(os.getenv("ROLLUP_BACKFILL_CHUNK", 100000))
+UPSERT_CHUNK = 5000
+# Arbitrary constant for the advisory lock that lets one worker backfill
+BACKFILL_LOCK_ID = 7261002
+# Scans of QR codes; peer scans (two players meeting) stay out of the rollups
+ROLLUP_SCAN_TYPES = ("standard", "discovery")
+
+_ALPHABET = np.array(list(_BASE32))
+
+
+def _bit_split(precision: int) -> Tuple[int, int]:
+    """(lat bits, lon bits) of a geohash; the extra bit of an odd total goes to longitude"""
+    bits = precision * 5
+    return bits // 2, math.ceil(bits / 2)
+
+
+def quantize(latitudes, longitudes, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Grid row/column of every point at `precision`, as uint64 arrays"""
+    lat_bits, lon_bits = _bit_split(precision)
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    rows = np.floor((lat + 90.0) / 180.0 * (1 << lat_bits))
+    cols = np.floor((lon + 180.0) / 360.0 * (1 << lon_bits))
+    return (
+        np.clip(rows, 0, (1 << lat_bits) - 1).astype(np.uint64),
+        np.clip(cols, 0, (1 << lon_bits) - 1).astype(np.uint64),
+    )
+
+
+def geohash_many(rows: np.ndarray, cols: np.ndarray, precision: int) -> np.ndarray:
+    """Geohash strings for quantized points; matches spatial_index.geohash_encode"""
+    lat_bits, lon_bits = _bit_split(precision)
+    code = np.zeros(rows.shape, dtype=np.uint64)
+    lat_left, lon_left = lat_bits, lon_bits
+    for position in range(precision * 5):
+        # Geohash interleaves bits starting with longitude
+        if position % 2 == 0:
+            lon_left -= 1
+            bit = (cols >> np.uint64(lon_left)) & np.uint64(1)
+        else:
+            lat_left -= 1
+            bit = (rows >> np.uint64(lat_left)) & np.uint64(1)
+        code = (code << np.uint64(1)) | bit
+    chars = [
+        _ALPHABET[((code >> np.uint64(5 * (precision - 1 - i))) & np.uint64(31)).astype(np.intp)]
+        for i in range(precision)
+    ]
+    result = chars[0]
+    for column in chars[1:]:
+        result = np.char.add(result, column)
+    return result
+
+
+def counts_in_rollups(scan_type: str, attempt_number: Optional[int], latitude: Optional[float], longitude: Optional[float]) -> bool:
+    """Whether a recorded scan is counted; the live path and the backfill both go through this"""
+    return (
+        scan_type in ROLLUP_SCAN_TYPES
+        and attempt_number is not None  # Blocked scans
+        and latitude is not None
+        and longitude is not None
+    )
+
+
+def cell_centres(rows: np.ndarray, cols: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    lat_bits, lon_bits = _bit_split(precision)
+    return (
+        (rows.astype(np.float64) + 0.5) * (180.0 / (1 << lat_bits)) - 90.0,
+        (cols.astype(np.float64) + 0.5) * (360.0 / (1 << lon_bits)) - 180.0,
+    )
+
+
+def bucket_scans(player_ids, latitudes, longitudes, cell_precision: int = ROLLUP_CELL_PRECISION,
+                 region_precision: int = ROLLUP_REGION_PRECISION):
+    """
+    Bins a batch of located scans in one vectorised pass.
+    Returns (cell rows, region/player rows):
+      [(cell, centre lat, centre lon, scans)], [(region, player_id, scans)]
+    """
+    if len(player_ids) == 0:
+        return [], []
+    rows, cols = quantize(latitudes, longitudes, cell_precision)
+    cells = geohash_many(rows, cols, cell_precision)
+    unique_cells, first, cell_counts = np.unique(cells, return_index=True, return_counts=True)
+    centre_lats, centre_lons = cell_centres(rows[first], cols[first], cell_precision)
+    cell_rows = [
+        (str(cell), float(lat), float(lon), int(count))
+        for cell, lat, lon, count in zip(unique_cells, centre_lats, centre_lons, cell_counts)
+    ]
+
+    # A geohash's prefix is the geohash of its enclosing coarser cell
+    regions = cells.astype(f"U{region_precision}")
+    players = np.asarray([str(player_id) for player_id in player_ids])
+    pairs, pair_counts = np.unique(np.char.add(np.char.add(regions, ":"), players), return_counts=True)
+    region_rows = []
+    for pair, count in zip(pairs, pair_counts):
+        region, player_id = str(pair).split(":", 1)
+        region_rows.append((region, uuid.UUID(player_id), int(count)))
+    return cell_rows, region_rows
+
+
+async def apply_rollups(db: AsyncSession, cell_rows, region_rows):
+    """Adds bucketed counts onto the rollup tables (caller commits)"""
+    # Chunked to stay under Postgres' 32767 bind parameters per statement
+    for start in range(0, len(cell_rows), UPSERT_CHUNK):
+        stmt = pg_insert(GeoCellCount).values([
+            {"cell": cell, "latitude": lat, "longitude": lon, "scans": scans}
+            for cell, lat, lon, scans in cell_rows[start:start + UPSERT_CHUNK]
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[GeoCellCount.cell],
+            set_={"scans": GeoCellCount.scans + stmt.excluded.scans},
+        ))
+    for start in range(0, len(region_rows), UPSERT_CHUNK):
+        stmt = pg_insert(RegionPlayerCount).values([
+            {"region": region, "player_id": player_id, "scans": scans}
+            for region, player_id, scans in region_rows[start:start + UPSERT_CHUNK]
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[RegionPlayerCount.region, RegionPlayerCount.player_id],
+            set_={"scans": RegionPlayerCount.scans + stmt.excluded.scans},
+        ))
+
+
+class GeoRollup:
+    """
+    Collects located scans as they are recorded and periodically folds them
+    into geo_cell_counts / region_player_counts, so heatmap and regional
+    top-N reads never touch player_scans.
+    """
+
+    def __init__(self, flush_seconds: float = ROLLUP_FLUSH_SECONDS, max_pending: int = ROLLUP_MAX_PENDING):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._player_ids: List[uuid.UUID] = []
+        self._latitudes: List[float] = []
+        self._longitudes: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.added = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+
+    def __len__(self):
+        return len(self._player_ids)
+
+    def add(self, player_id: uuid.UUID, latitude: Optional[float], longitude: Optional[float],
+            scan_type: str, attempt_number: Optional[int]):
+        if not counts_in_rollups(scan_type, attempt_number, latitude, longitude):
+            return
+        if len(self._player_ids) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._player_ids.append(player_id)
+        self._latitudes.append(latitude)
+        self._longitudes.append(longitude)
+        self.added += 1
+
+    def start(self):
+        if self._task is None:
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    async def flush(self) -> bool:
+        from database import AsyncSessionLocal
+        async with self._flush_lock:
+            if not self._player_ids:
+                return True
+            batch = (self._player_ids, self._latitudes, self._longitudes)
+            self._player_ids, self._latitudes, self._longitudes = [], [], []
+            started = time.perf_counter()
+            try:
+                cell_rows, region_rows = bucket_scans(*batch)
+                async with AsyncSessionLocal() as db:
+                    await apply_rollups(db, cell_rows, region_rows)
+                    await db.commit()
+            except BaseException as e:
+                # Put the batch back in front of anything added meanwhile
+                self._player_ids[:0], self._latitudes[:0], self._longitudes[:0] = batch
+                if isinstance(e, Exception):
+                    self.failed_flushes += 1
+                    logger.exception("Flushing %d scans into the geo rollups failed", len(batch[0]))
+                    return False
+                raise
+            self.flushes += 1
+            self.last_flush_seconds = time.perf_counter() - started
+            return True
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self._player_ids),
+            "added": self.added,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+def backfill_buckets(rows):
+    """
+    bucket_scans for player_scans rows of (player_id, latitude, longitude,
+    scan_type, attempt_number), keeping only those GeoRollup.add would count
+    """
+    counted = [
+        (player_id, latitude, longitude)
+        for player_id, latitude, longitude, scan_type, attempt_number in rows
+        if counts_in_rollups(scan_type, attempt_number, latitude, longitude)
+    ]
+    if not counted:
+        return [], []
+    return bucket_scans(*zip(*counted))
+
+
+async def backfill_geo_rollups(db: AsyncSession):
+    """
+    Seeds the rollup tables from player_scans while they are still empty.
+    Runs in one transaction under an advisory lock so concurrent workers
+    can't count the history twice.
+    """
+    if not await db.scalar(select(func.pg_try_advisory_xact_lock(BACKFILL_LOCK_ID))):
+        return
+    if await db.scalar(select(GeoCellCount.cell).limit(1)) is not None:
+        await db.commit()
+        return
+    result = await db.stream(
+        select(
+            PlayerScan.player_id, PlayerScan.latitude, PlayerScan.longitude,
+            PlayerScan.scan_type, PlayerScan.attempt_number,
+        )
+        .where(
+            # Narrows the scan; backfill_buckets applies the exact filter
+            PlayerScan.player_id.is_not(None),
+            PlayerScan.latitude.is_not(None),
+            PlayerScan.longitude.is_not(None),
+            PlayerScan.attempt_number.is_not(None),
+            PlayerScan.scan_type.in_(ROLLUP_SCAN_TYPES),
+        )
+        .execution_options(yield_per=ROLLUP_BACKFILL_CHUNK)
+    )
+    async for chunk in result.partitions():
+        await apply_rollups(db, *backfill_buckets(chunk))
+    await db.commit()
+
+
+geo_rollup = GeoRollup()
+register_metrics("geo_rollup", geo_rollup.metrics)
@@ -0,0 +1,86 @@
+import math
+import os
+from typing import NamedTuple, Optional, Sequence
+import numpy as np
+from sqlalchemy import func, cast, Float
+
+# Same earth radius as utils.location.calculate_distance
+EARTH_RADIUS_METERS = 6371000.0
+# Radius used when a QR code or hunt step doesn't set its own
+DEFAULT_RADIUS_METERS = float(os.getenv("GEOFENCE_RADIUS_METERS", 50))
+# Optional per-code override, stored in QRCode.reward_data. Absent or null
+# means the default; the qr_codes CHECK constraint (RADIUS_CHECK) rejects
+# anything but a positive number on write
+RADIUS_KEY = "geofence_radius_meters"
+RADIUS_CHECK = (
+    f"CASE coalesce(jsonb_typeof(reward_data -> '{RADIUS_KEY}'), 'null') "
+    f"WHEN 'null' THEN true WHEN 'number' THEN (reward_data ->> '{RADIUS_KEY}')::float > 0 ELSE false END"
+)
+
+
+def radius_for(reward_data: Optional[dict]) -> float:
+    """Geofence radius for a QR code, honouring a per-code override in reward_data"""
+    radius = reward_data.get(RADIUS_KEY) if reward_data else None
+    return DEFAULT_RADIUS_METERS if radius is None else float(radius)
+
+
+def radius_expression(reward_data):
+    """radius_for as SQL, for a QRCode.reward_data column"""
+    return func.coalesce(cast(reward_data[RADIUS_KEY].astext, Float), DEFAULT_RADIUS_METERS)
+
+
+class Fence(NamedTuple):
+    """A single circular fence with its trigonometry done up front"""
+    lat: float  # radians
+    lon: float  # radians
+    cos_lat: float
+    radius: float  # meters
+
+    @classmethod
+    def at(cls, latitude: float, longitude: float, radius: float = DEFAULT_RADIUS_METERS) -> "Fence":
+        lat = math.radians(latitude)
+        return cls(lat, math.radians(longitude), math.cos(lat), radius)
+
+    def distance(self, latitude: float, longitude: float) -> float:
+        lat = math.radians(latitude)
+        a = math.sin((lat - self.lat) / 2) ** 2 + self.cos_lat * math.cos(lat) * math.sin((math.radians(longitude) - self.lon) / 2) ** 2
+        return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        return self.distance(latitude, longitude) <= self.radius
+
+
+class Geofences:
+    """
+    A fixed batch of circular fences kept as NumPy arrays (radians), for
+    checking one or many points against every fence at once.
+    """
+
+    def __init__(self, latitudes: Sequence[float], longitudes: Sequence[float], radii=DEFAULT_RADIUS_METERS):
+        self.lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+        self.lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+        self.cos_lat = np.cos(self.lat)
+        self.radius = np.broadcast_to(np.asarray(radii, dtype=np.float64), self.lat.shape)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def distances_many(self, latitudes, longitudes) -> np.ndarray:
+        """(points x fences) matrix of distances in meters"""
+        lat = np.radians(np.asarray(latitudes, dtype=np.float64))[:, None]
+        lon = np.radians(np.asarray(longitudes, dtype=np.float64))[:, None]
+        a = np.sin((lat - self.lat) / 2) ** 2 + np.cos(lat) * self.cos_lat * np.sin((lon - self.lon) / 2) ** 2
+        return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def contains_many(self, latitudes, longitudes) -> np.ndarray:
+        """(points x fences) boolean matrix, True where the point is inside the fence"""
+        return self.distances_many(latitudes, longitudes) <= self.radius
+
+    def distances(self, latitude: float, longitude: float) -> np.ndarray:
+        """Distance in meters from one point to every fence"""
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        a = np.sin((self.lat - lat) / 2) ** 2 + math.cos(lat) * self.cos_lat * np.sin((self.lon - lon) / 2) ** 2
+        return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def contains(self, latitude: float, longitude: float) -> np.ndarray:
+        return self.distances(latitude, longitude) <= self.radius
@@ -0,0 +1,153 @@
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Hunt, HuntStep, QRCode
+from utils.metrics import register_metrics
+from utils.geofence import Geofences, radius_for
+
+# Safety net for hunt edits made without a hunt_updated notification
+HUNT_CATALOG_TTL_SECONDS = float(os.getenv("HUNT_CATALOG_TTL_SECONDS", 300))
+# Hunts are edited in SQL; follow an edit with NOTIFY hunt_updated, '<hunt id>'
+# (or an empty payload for all hunts) to drop it from every worker's catalog
+HUNT_UPDATED_CHANNEL = "hunt_updated"
+
+
+@dataclass(frozen=True)
+class CatalogStep:
+    id: uuid.UUID
+    order: int
+    qr_code_id: uuid.UUID
+    qr_code: Optional[str]  # Pre-resolved QRCode.code
+    latitude: float
+    longitude: float
+    radius: float  # Geofence radius of the step's QR code
+    hint: Optional[str]
+
+
+@dataclass(frozen=True)
+class CatalogHunt:
+    id: uuid.UUID
+    name: str
+    description: Optional[str]
+    steps: Tuple[CatalogStep, ...]  # Sorted by HuntStep.order
+    loaded_at: float
+    fences: Geofences = field(compare=False)  # One fence per step, same order
+
+    @property
+    def step_count(self) -> int:
+        return len(self.steps)
+
+    def step(self, index: int) -> Optional[CatalogStep]:
+        return self.steps[index] if 0 <= index < len(self.steps) else None
+
+
+def normalize_hunt_id(hunt_id) -> Optional[str]:
+    try:
+        return str(uuid.UUID(str(hunt_id)))
+    except ValueError:
+        return None
+
+
+class HuntCatalog:
+    """
+    In-memory, immutable snapshots of hunts and their ordered steps.
+    Every invalidation bumps `generation`; loads that started under an older
+    generation are not stored, so an edit racing a load can't be cached.
+    """
+
+    def __init__(self, ttl: float = HUNT_CATALOG_TTL_SECONDS):
+        self.ttl = ttl
+        self._hunts: Dict[str, CatalogHunt] = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, hunt_id: str) -> Optional[CatalogHunt]:
+        hunt = self._hunts.get(hunt_id)
+        if hunt and time.monotonic() - hunt.loaded_at < self.ttl:
+            return hunt
+        return None
+
+    async def get(self, db: AsyncSession, hunt_id) -> Optional[CatalogHunt]:
+        return (await self.get_many(db, [hunt_id])).get(normalize_hunt_id(hunt_id))
+
+    async def get_many(self, db: AsyncSession, hunt_ids: Iterable) -> Dict[str, CatalogHunt]:
+        """Returns {hunt_id: CatalogHunt} for the ids that exist, loading misses in one query"""
+        found = {}
+        missing = []
+        for hunt_id in {normalize_hunt_id(h) for h in hunt_ids} - {None}:
+            hunt = self._cached(hunt_id)
+            if hunt:
+                self.hits += 1
+                found[hunt_id] = hunt
+            else:
+                self.misses += 1
+                missing.append(hunt_id)
+        if missing:
+            found.update(await self._load(db, missing))
+        return found
+
+    async def _load(self, db: AsyncSession, hunt_ids) -> Dict[str, CatalogHunt]:
+        generation = self.generation
+        rows = (await db.execute(
+            select(Hunt, HuntStep, QRCode.code, QRCode.reward_data)
+            .outerjoin(HuntStep, HuntStep.hunt_id == Hunt.id)
+            .outerjoin(QRCode, QRCode.id == HuntStep.qr_code_id)
+            .where(Hunt.id.in_([uuid.UUID(h) for h in hunt_ids]))
+            .order_by(Hunt.id, HuntStep.order)
+        )).all()
+
+        hunts: Dict[str, Hunt] = {}
+        steps: Dict[str, list] = {}
+        for hunt, step, code, reward_data in rows:
+            key = str(hunt.id)
+            hunts[key] = hunt
+            steps.setdefault(key, [])
+            if step is not None:
+                steps[key].append(CatalogStep(
+                    id=step.id,
+                    order=step.order,
+                    qr_code_id=step.qr_code_id,
+                    qr_code=code,
+                    latitude=step.latitude,
+                    longitude=step.longitude,
+                    radius=radius_for(reward_data),
+                    hint=step.hint
+                ))
+
+        now = time.monotonic()
+        loaded = {
+            key: CatalogHunt(
+                id=hunt.id,
+                name=hunt.name,
+                description=hunt.description,
+                steps=tuple(steps[key]),
+                loaded_at=now,
+                fences=Geofences(
+                    [s.latitude for s in steps[key]], [s.longitude for s in steps[key]], [s.radius for s in steps[key]]
+                )
+            )
+            for key, hunt in hunts.items()
+        }
+        if generation == self.generation:
+            self._hunts.update(loaded)
+        return loaded
+
+    def invalidate(self, hunt_id=None):
+        """Drop one hunt (or everything when hunt_id is None) after an edit"""
+        self.generation += 1
+        if hunt_id is None:
+            self._hunts.clear()
+        else:
+            self._hunts.pop(normalize_hunt_id(hunt_id), None)
+
+    def metrics(self) -> dict:
+        return {"size": len(self._hunts), "generation": self.generation, "hits": self.hits, "misses": self.misses}
+
+
+hunt_catalog = HuntCatalog()
+register_metrics("hunt_catalog", hunt_catalog.metrics)
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, insert, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Player, LeaderboardSnapshot
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Channel score changes are announced on so every worker's board stays in sync
+LEADERBOARD_CHANNEL = "leaderboard_score"
+LEADERBOARD_SNAPSHOT_SECONDS = float(os.getenv("LEADERBOARD_SNAPSHOT_SECONDS", 300))
+LEADERBOARD_SNAPSHOT_SIZE = int(os.getenv("LEADERBOARD_SNAPSHOT_SIZE", 1000))
+# Snapshots older than this are deleted when a new one is taken; 0 keeps everything
+LEADERBOARD_SNAPSHOT_RETENTION_SECONDS = float(os.getenv("LEADERBOARD_SNAPSHOT_RETENTION_SECONDS", 7 * 86400))
+# Arbitrary constant for the advisory lock that picks one worker to snapshot
+SNAPSHOT_LOCK_ID = 7261001
+
+
+@dataclass(frozen=True)
+class RankedPlayer:
+    rank: int  # 1-based; players with equal scores share a rank
+    player_id: str
+    username: Optional[str]
+    score: int
+
+
+class Leaderboard:
+    """
+    Every player's score, kept as a sorted array of (-score, player_id) keys.
+    Rank lookups are a bisect (O(log n)) and never touch the database;
+    score changes are a bisect plus one list insert/remove.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[int, str]] = []
+        self._scores: Dict[str, int] = {}
+        self._names: Dict[str, Optional[str]] = {}
+        self.loaded = False
+        self.updates = 0
+        self.last_rebuild_seconds = 0.0
+        self.snapshots = 0
+        # Changes seen while a rebuild is streaming, re-applied on top of it
+        self._pending: Optional[Dict[str, tuple]] = None
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, player_id, score: Optional[int], username: Optional[str] = None):
+        player_id = str(player_id)
+        score = score or 0
+        if self._pending is not None:
+            self._pending[player_id] = (score, username)
+        if username is not None:
+            self._names[player_id] = username
+        old = self._scores.get(player_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, player_id))]
+        insort(self._keys, (-score, player_id))
+        self._scores[player_id] = score
+        self.updates += 1
+
+    def remove(self, player_id):
+        player_id = str(player_id)
+        old = self._scores.pop(player_id, None)
+        self._names.pop(player_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, player_id))]
+
+    def _rank_of_score(self, score: int) -> int:
+        # 1 + number of players with a strictly higher score
+        return bisect_left(self._keys, (-score, "")) + 1
+
+    def _entry(self, index: int) -> RankedPlayer:
+        negative_score, player_id = self._keys[index]
+        return RankedPlayer(self._rank_of_score(-negative_score), player_id, self._names.get(player_id), -negative_score)
+
+    def rank(self, player_id) -> Optional[RankedPlayer]:
+        player_id = str(player_id)
+        score = self._scores.get(player_id)
+        if score is None:
+            return None
+        return RankedPlayer(self._rank_of_score(score), player_id, self._names.get(player_id), score)
+
+    def top(self, skip: int = 0, limit: int = 10) -> List[RankedPlayer]:
+        return [self._entry(i) for i in range(skip, min(skip + limit, len(self._keys)))]
+
+    def around(self, player_id, radius: int = 5) -> List[RankedPlayer]:
+        """The player plus up to `radius` players either side of them"""
+        player_id = str(player_id)
+        score = self._scores.get(player_id)
+        if score is None:
+            return []
+        index = bisect_left(self._keys, (-score, player_id))
+        return [self._entry(i) for i in range(max(0, index - radius), min(len(self._keys), index + radius + 1))]
+
+    def load(self, rows):
+        """Replaces the board with (player_id, score, username) rows"""
+        scores, names = {}, {}
+        for player_id, score, username in rows:
+            scores[str(player_id)] = score or 0
+            names[str(player_id)] = username
+        self._keys = sorted((-score, player_id) for player_id, score in scores.items())
+        self._scores, self._names = scores, names
+        self.loaded = True
+
+    async def rebuild(self, db: AsyncSession):
+        started = time.perf_counter()
+        self._pending = {}
+        try:
+            result = await db.stream(select(Player.id, Player.score, Player.username).execution_options(yield_per=10000))
+            rows = [tuple(row) async for row in result]
+            pending = self._pending
+        finally:
+            self._pending = None
+        self.load(rows)
+        for player_id, (score, username) in pending.items():
+            self.update(player_id, score, username)
+        self.last_rebuild_seconds = time.perf_counter() - started
+        logger.info("Leaderboard rebuilt with %d players in %.2fs", len(self), self.last_rebuild_seconds)
+
+    def request_rebuild(self):
+        """Reloads from the players table in the background, e.g. after missed notifications"""
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = asyncio.create_task(self._rebuild_in_background())
+
+    async def _rebuild_in_background(self):
+        from database import AsyncSessionLocal
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.rebuild(db)
+        except Exception:
+            logger.exception("Leaderboard rebuild failed")
+
+    def start_snapshots(self):
+        if self._snapshot_task is None:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop_snapshots(self):
+        if self._snapshot_task is not None:
+            task, self._snapshot_task = self._snapshot_task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _snapshot_loop(self):
+        from database import AsyncSessionLocal
+        while True:
+            await asyncio.sleep(LEADERBOARD_SNAPSHOT_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    if await snapshot_leaderboard(db, self):
+                        self.snapshots += 1
+            except Exception:
+                logger.exception("Leaderboard snapshot failed")
+
+    async def handle_notifications(self, channel, payloads: List[str]):
+        """Batch handler for LEADERBOARD_CHANNEL"""
+        for payload in payloads:
+            try:
+                change = json.loads(payload)
+                self.update(change["id"], change["score"], change.get("username"))
+            except (ValueError, KeyError):
+                logger.warning("Bad %s notification: %s", channel, payload)
+
+    def metrics(self) -> dict:
+        return {
+            "players": len(self._keys),
+            "loaded": self.loaded,
+            "updates": self.updates,
+            "last_rebuild_seconds": self.last_rebuild_seconds,
+            "snapshots": self.snapshots,
+        }
+
+
+async def notify_score_changed(db: AsyncSession, player_id, score: int, username: Optional[str] = None):
+    """
+    Tells every worker's board (this one included) about a new score. The
+    NOTIFY is only sent if `db` commits, so call it in the transaction that
+    changed the score.
+    """
+    payload = {"id": str(player_id), "score": score}
+    if username is not None:
+        payload["username"] = username
+    await db.execute(select(func.pg_notify(LEADERBOARD_CHANNEL, json.dumps(payload))))
+
+
+async def snapshot_leaderboard(db: AsyncSession, board: Leaderboard) -> bool:
+    """
+    Writes the board's top LEADERBOARD_SNAPSHOT_SIZE and drops snapshots past
+    retention; only one worker per interval wins the lock.
+    """
+    if not board.loaded:
+        return False
+    if not await db.scalar(select(func.pg_try_advisory_xact_lock(SNAPSHOT_LOCK_ID))):
+        return False
+    latest = await db.scalar(select(func.max(LeaderboardSnapshot.taken_at)))
+    now = await db.scalar(select(func.now()))
+    if latest is not None and (now - latest).total_seconds() < LEADERBOARD_SNAPSHOT_SECONDS / 2:
+        return False  # Another worker just took one
+    entries = board.top(0, LEADERBOARD_SNAPSHOT_SIZE)
+    if entries:
+        await db.execute(insert(LeaderboardSnapshot), [
+            {"taken_at": now, "position": i + 1, "rank": e.rank, "player_id": uuid.UUID(e.player_id), "score": e.score}
+            for i, e in enumerate(entries)
+        ])
+    if LEADERBOARD_SNAPSHOT_RETENTION_SECONDS > 0:
+        # taken_at leads the primary key, so this is an index range delete
+        await db.execute(delete(LeaderboardSnapshot).where(
+            LeaderboardSnapshot.taken_at < now - timedelta(seconds=LEADERBOARD_SNAPSHOT_RETENTION_SECONDS)
+        ))
+    await db.commit()
+    return True
+
+
+leaderboard = Leaderboard()
+register_metrics("leaderboard", leaderboard.metrics)
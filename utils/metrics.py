@@ -0,0 +1,24 @@
+import os
+import resource
+from typing import Callable, Dict
+
+# Name -> callable returning a dict of current gauge/counter values.
+# Components register themselves at import time; GET /metrics collects them.
+_collectors: Dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, collector: Callable[[], dict]):
+    _collectors[name] = collector
+
+
+def collect_metrics() -> dict:
+    return {name: collector() for name, collector in _collectors.items()}
+
+
+def process_rss_bytes() -> int:
+    """Current resident memory of this worker (peak RSS where /proc isn't available)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -1,17 +1,37 @@
 from abc import ABC, abstractmethod
 from typing import Optional, List
+import os
 
+# Seconds a game may wait for the next move before on_timeout settles it
+GAME_TURN_TIMEOUT_SECONDS = float(os.getenv("GAME_TURN_TIMEOUT_SECONDS", 30))
 
 
 class GameHandler(ABC):
+    game_type: str = None
+    turn_timeout_seconds: float = GAME_TURN_TIMEOUT_SECONDS
+
     def __init__(self, player_ids: List[str]):
         self.player_ids = player_ids
         self.state = {}
 
+    def validate_move(self, player_id: str, move: dict) -> Optional[str]:
+        """Reason the move is rejected, or None if process_move may run"""
+        if player_id not in self.player_ids:
+            return "not_in_game"
+        return None
+
     @abstractmethod
     async def process_move(self, player_id: str, move: dict) -> bool:
         pass  # True if game continues, False if ended
 
     @abstractmethod
     async def check_winner(self) -> Optional[str]:
-        pass  # Returns winner player_id or None for tie/in-progress
\ No newline at end of file
+        pass  # Returns winner player_id or None for tie/in-progress
+
+    def on_timeout(self) -> Optional[str]:
+        """Winner when the turn timer runs out; None for a tie"""
+        return None
+
+    def snapshot(self) -> dict:
+        """Public game state sent to players who reconnect mid-game"""
+        return {}
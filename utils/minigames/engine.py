@@ -0,0 +1,98 @@
+import os
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Type
+from utils.minigames.GameHandler import GameHandler
+from utils.minigames.rps_handler import RPSHandler
+from utils.minigames.timer_wheel import TimerWheel
+
+DEFAULT_GAME_TYPE = os.getenv("DEFAULT_GAME_TYPE", "rps")
+# Resolution of turn timeouts
+GAME_TIMER_TICK_SECONDS = float(os.getenv("GAME_TIMER_TICK_SECONDS", 1))
+
+game_registry: Dict[str, Type[GameHandler]] = {
+    "rps": RPSHandler
+}
+
+
+def register_game(handler: Type[GameHandler]) -> Type[GameHandler]:
+    """Makes a GameHandler subclass available under its game_type"""
+    game_registry[handler.game_type] = handler
+    return handler
+
+
+class MoveResult(NamedTuple):
+    error: Optional[str] = None  # Why the move was rejected
+    finished: bool = False
+    winner: Optional[str] = None  # Player id, or "tie"
+
+
+# (channel_id, game, winner, reason) -> sends the result to the players
+ResultCallback = Callable[[str, GameHandler, str, str], Awaitable[None]]
+
+
+class GameEngine:
+    """
+    Running games keyed by channel (the websocket player_id both sockets share).
+    Every game has one turn timer on a shared TimerWheel; when it runs out the
+    handler's on_timeout settles the game and it is dropped, so abandoned
+    games can't accumulate.
+    """
+
+    def __init__(self, wheel: TimerWheel = None, on_result: ResultCallback = None):
+        self.wheel = wheel if wheel is not None else TimerWheel(tick=GAME_TIMER_TICK_SECONDS)
+        self.on_result = on_result
+        self.games: Dict[str, GameHandler] = {}
+        self.started = 0
+        self.finished = 0
+        self.timed_out = 0
+
+    def __contains__(self, channel_id: str):
+        return channel_id in self.games
+
+    def get(self, channel_id: str) -> Optional[GameHandler]:
+        return self.games.get(channel_id)
+
+    def start(self, channel_id: str, player_ids: List[str], game_type: str = DEFAULT_GAME_TYPE) -> GameHandler:
+        """Creates the game; raises KeyError for an unregistered game type"""
+        game = game_registry[game_type](player_ids)
+        self.games[channel_id] = game
+        self.started += 1
+        self.wheel.schedule(channel_id, game.turn_timeout_seconds, self._timed_out)
+        return game
+
+    async def move(self, channel_id: str, player_id: str, move: dict) -> MoveResult:
+        game = self.games.get(channel_id)
+        if game is None:
+            return MoveResult(error="no_game")
+        error = game.validate_move(player_id, move)
+        if error:
+            return MoveResult(error=error)
+        if await game.process_move(player_id, move):
+            self.wheel.schedule(channel_id, game.turn_timeout_seconds, self._timed_out)
+            return MoveResult()
+        winner = await game.check_winner()
+        self.end(channel_id)
+        self.finished += 1
+        return MoveResult(finished=True, winner=winner or "tie")
+
+    def end(self, channel_id: str):
+        """Drops the game and its timer"""
+        self.wheel.cancel(channel_id)
+        self.games.pop(channel_id, None)
+
+    async def _timed_out(self, channel_id: str):
+        game = self.games.get(channel_id)
+        if game is None:
+            return
+        self.end(channel_id)
+        self.timed_out += 1
+        if self.on_result:
+            await self.on_result(channel_id, game, game.on_timeout() or "tie", "timeout")
+
+    def metrics(self) -> dict:
+        return {
+            "active": len(self.games),
+            "timers": len(self.wheel),
+            "started": self.started,
+            "finished": self.finished,
+            "timed_out": self.timed_out,
+        }
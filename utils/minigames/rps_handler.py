@@ -1,8 +1,23 @@
 from utils.minigames.GameHandler import GameHandler
+
+CHOICES = ("rock", "paper", "scissors")
+
+
 class RPSHandler(GameHandler):
+    game_type = "rps"
+
+    def validate_move(self, player_id: str, move: dict):
+        reason = super().validate_move(player_id, move)
+        if reason:
+            return reason
+        if not isinstance(move, dict) or move.get("choice") not in CHOICES:
+            return "invalid_choice"
+        if player_id in self.state:
+            return "already_moved"
+        return None
+
     async def process_move(self, player_id: str, move: dict):
         self.state[player_id] = move["choice"]
-        print(self.state, move['choice'])
         return len(self.state) < 2  # Continue if <2 moves
 
     async def check_winner(self):
@@ -14,4 +29,12 @@ class RPSHandler(GameHandler):
             return None
         if (c1 == "rock" and c2 == "scissors") or (c1 == "scissors" and c2 == "paper") or (c1 == "paper" and c2 == "rock"):
             return p1
-        return p2
\ No newline at end of file
+        return p2
+
+    def on_timeout(self):
+        # Whoever picked wins against a player who never did
+        return next(iter(self.state)) if len(self.state) == 1 else None
+
+    def snapshot(self):
+        # Who has moved, never what they picked
+        return {"moved": list(self.state)}
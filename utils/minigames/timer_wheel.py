@@ -0,0 +1,80 @@
+import asyncio
+import inspect
+import logging
+import math
+from typing import Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel: one task ticks every `tick` seconds and fires the
+    timers in the current slot. Scheduling and cancelling are O(1), so tens of
+    thousands of game timers cost one task instead of one task each.
+    Timers fire with `tick` resolution; a key has at most one pending timer.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, Tuple[int, Callable]]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._cursor = 0
+        self._task = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable):
+        """Runs callback(key) after `delay` seconds, replacing any timer already set for key"""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = ((ticks - 1) // len(self._slots), callback)
+        self._where[key] = slot
+        self.start()
+
+    def cancel(self, key: Hashable):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self._slots[slot].pop(key, None)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            next_tick += self.tick
+            await self.advance()
+
+    async def advance(self):
+        """Moves the wheel one tick and fires whatever is due"""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        due = []
+        for key, (rounds, callback) in list(slot.items()):
+            if rounds:
+                slot[key] = (rounds - 1, callback)
+            else:
+                del slot[key]
+                del self._where[key]
+                due.append((key, callback))
+        for key, callback in due:
+            self.fired += 1
+            try:
+                result = callback(key)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Timer callback for %s failed", key)
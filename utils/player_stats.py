@@ -0,0 +1,111 @@
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import select, func, case, literal, Integer
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import PlayerScan, PlayerStats
+from utils.metrics import register_metrics
+from utils.ttl_cache import TTLCache, MISSING
+
+RECENT_SCANS_LIMIT = 10
+RECENT_SCANS_CACHE_SIZE = int(os.getenv("RECENT_SCANS_CACHE_SIZE", 50000))
+# Other workers' scans only show up once the entry expires
+RECENT_SCANS_CACHE_TTL_SECONDS = float(os.getenv("RECENT_SCANS_CACHE_TTL_SECONDS", 30))
+
+
+def build_stats_upsert(rows):
+    """
+    Adds `rows`, a select of (player_id, total_scans, discovery_scans, peer_scans)
+    increments, onto player_stats.
+    """
+    stmt = pg_insert(PlayerStats).from_select(["player_id", "total_scans", "discovery_scans", "peer_scans"], rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[PlayerStats.player_id],
+        set_={
+            "total_scans": PlayerStats.total_scans + stmt.excluded.total_scans,
+            "discovery_scans": PlayerStats.discovery_scans + stmt.excluded.discovery_scans,
+            "peer_scans": PlayerStats.peer_scans + stmt.excluded.peer_scans,
+        },
+    )
+
+
+def stats_increments(player_id: uuid.UUID, success, scan_type: str):
+    """Select columns for one scan's increments; `success` may be a SQL expression"""
+    return (
+        literal(player_id, UUID(as_uuid=True)),
+        case((success, 1), else_=0),
+        literal(1 if scan_type == "discovery" else 0, Integer),
+        literal(1 if scan_type == "peer" else 0, Integer),
+    )
+
+
+async def bump_player_stats(db: AsyncSession, player_id: uuid.UUID, success: bool, scan_type: str):
+    await db.execute(build_stats_upsert(select(*stats_increments(player_id, literal(success), scan_type))))
+
+
+def scan_counts_select():
+    """Per-player totals computed from player_scans in one FILTER-aggregated pass"""
+    return (
+        select(
+            PlayerScan.player_id,
+            func.count().filter(PlayerScan.success == True),
+            func.count().filter(PlayerScan.scan_type == "discovery"),
+            func.count().filter(PlayerScan.scan_type == "peer"),
+        )
+        .where(PlayerScan.player_id.is_not(None))
+        .group_by(PlayerScan.player_id)
+    )
+
+
+async def backfill_player_stats(db: AsyncSession):
+    """Seeds player_stats from player_scans while it is still empty"""
+    if await db.scalar(select(PlayerStats.player_id).limit(1)) is not None:
+        return
+    await db.execute(
+        pg_insert(PlayerStats)
+        .from_select(["player_id", "total_scans", "discovery_scans", "peer_scans"], scan_counts_select())
+        .on_conflict_do_nothing()
+    )
+    await db.commit()
+
+
+def scan_entry(qr_code_id, scan_time: datetime, success: bool, scan_type: str) -> dict:
+    return {
+        "qr_code_id": qr_code_id,
+        "scan_time": scan_time.isoformat(),
+        "success": success,
+        "scan_type": scan_type,
+    }
+
+
+class RecentScansCache:
+    """Each player's last RECENT_SCANS_LIMIT scans, newest first, as a ring buffer"""
+
+    def __init__(self, maxsize: int = RECENT_SCANS_CACHE_SIZE, ttl: float = RECENT_SCANS_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, player_id) -> Optional[List[dict]]:
+        entries = self._cache.get(str(player_id))
+        return None if entries is MISSING else list(entries)
+
+    def set(self, player_id, entries: List[dict]):
+        self._cache.set(str(player_id), deque(entries[:RECENT_SCANS_LIMIT], maxlen=RECENT_SCANS_LIMIT))
+
+    def push(self, player_id, entry: dict):
+        """Records a new scan for a player whose history is cached; the oldest falls off"""
+        entries = self._cache.get(str(player_id))
+        if entries is not MISSING:
+            entries.appendleft(entry)
+
+    def invalidate(self, player_id):
+        self._cache.invalidate(str(player_id))
+
+    def metrics(self) -> dict:
+        return self._cache.stats()
+
+
+recent_scans = RecentScansCache()
+register_metrics("recent_scans_cache", recent_scans.metrics)
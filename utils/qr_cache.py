@@ -0,0 +1,108 @@
+import os
+import uuid
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Optional
+from geoalchemy2 import Geometry
+from sqlalchemy import select, func, cast
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import QRCode
+from utils.geofence import Fence, radius_for
+from utils.metrics import register_metrics
+from utils.ttl_cache import TTLCache, MISSING
+
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", 50000))
+QR_CACHE_TTL_SECONDS = float(os.getenv("QR_CACHE_TTL_SECONDS", 60))
+# Unknown codes are remembered briefly so repeated lookups don't hit the database
+QR_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("QR_CACHE_NEGATIVE_TTL_SECONDS", 10))
+
+
+@dataclass(frozen=True)
+class CachedQRCode:
+    id: uuid.UUID
+    code: str
+    description: Optional[str]
+    scan_type: Optional[str]
+    requires_location: Optional[bool]
+    latitude: Optional[float]  # Pre-parsed from the geography point
+    longitude: Optional[float]
+    scan_cooldown_seconds: Optional[int]
+    max_scans_per_player: Optional[int]
+    is_repeatable: Optional[bool]
+    expiration_date: Optional[datetime]
+    reward_data: Optional[dict]
+    fence: Optional[Fence] = field(default=None, compare=False)  # Derived from the location
+
+    def __post_init__(self):
+        if self.fence is None and self.latitude is not None and self.longitude is not None:
+            object.__setattr__(self, "fence", Fence.at(self.latitude, self.longitude, radius_for(self.reward_data)))
+
+    @classmethod
+    def from_row(cls, row) -> "CachedQRCode":
+        return cls(**{f.name: getattr(row, f.name) for f in fields(cls) if f.name != "fence"})
+
+    def location_valid(self, latitude: Optional[float], longitude: Optional[float]) -> bool:
+        """Same rules as utils.location.validate_location, against the code's geofence"""
+        if not self.requires_location:
+            return True
+        if latitude is None or longitude is None:
+            return False
+        if self.fence is None:
+            return True
+        return self.fence.contains(latitude, longitude)
+
+
+def location_columns(location):
+    """latitude/longitude of a Geography point column, for selects that feed the cache"""
+    return (
+        func.ST_Y(cast(location, Geometry)).label("latitude"),
+        func.ST_X(cast(location, Geometry)).label("longitude"),
+    )
+
+
+class QRCodeCache:
+    """Read-through cache of QRCode rows keyed by QRCode.code, with negative entries"""
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+
+    def peek(self, code: str):
+        """Cached entry, None for a known-unknown code, or MISSING"""
+        return self._cache.get(code)
+
+    def set(self, code: str, value: Optional[CachedQRCode]):
+        self._cache.set(code, value, ttl=None if value else self.negative_ttl)
+
+    async def get(self, db: AsyncSession, code: str) -> Optional[CachedQRCode]:
+        entry = self._cache.get(code)
+        if entry is not MISSING:
+            return entry
+        row = (await db.execute(
+            select(
+                QRCode.id,
+                QRCode.code,
+                QRCode.description,
+                QRCode.scan_type,
+                QRCode.requires_location,
+                *location_columns(QRCode.location),
+                QRCode.scan_cooldown_seconds,
+                QRCode.max_scans_per_player,
+                QRCode.is_repeatable,
+                QRCode.expiration_date,
+                QRCode.reward_data,
+            ).where(QRCode.code == code)
+        )).first()
+        value = CachedQRCode.from_row(row) if row else None
+        self.set(code, value)
+        return value
+
+    def invalidate(self, code: str):
+        self._cache.invalidate(code)
+
+    def metrics(self) -> dict:
+        return self._cache.stats()
+
+
+qr_code_cache = QRCodeCache(QR_CACHE_SIZE, QR_CACHE_TTL_SECONDS, QR_CACHE_NEGATIVE_TTL_SECONDS)
+register_metrics("qr_code_cache", qr_code_cache.metrics)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+from utils.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Write-behind for player_scans rows. Off by default.
+#
+# Durability: buffered rows are flushed every SCAN_BUFFER_FLUSH_SECONDS, as
+# soon as SCAN_BUFFER_BATCH_SIZE rows are waiting, and on shutdown. A crash
+# (not a clean shutdown) loses at most the rows buffered since the last flush,
+# i.e. roughly SCAN_BUFFER_FLUSH_SECONDS worth of scans. Failed flushes are
+# retried; once SCAN_BUFFER_MAX_ROWS are waiting, callers fall back to
+# inserting synchronously, so nothing is dropped to make room.
+# Scan counters, cooldowns and limits are always written synchronously; only
+# the history row is deferred, and it shows up in history once flushed.
+SCAN_WRITE_BEHIND = os.getenv("SCAN_WRITE_BEHIND", "false").lower() == "true"
+SCAN_BUFFER_BATCH_SIZE = int(os.getenv("SCAN_BUFFER_BATCH_SIZE", 500))
+SCAN_BUFFER_FLUSH_SECONDS = float(os.getenv("SCAN_BUFFER_FLUSH_SECONDS", 1))
+SCAN_BUFFER_MAX_ROWS = int(os.getenv("SCAN_BUFFER_MAX_ROWS", 50000))
+
+# COPY doesn't apply column defaults, so every row carries all of these
+COLUMNS = (
+    "id", "player_id", "qr_code_id", "peer_player_id", "scan_time", "scan_type", "proximity_status",
+    "success", "latitude", "longitude", "attempt_number", "next_scan_available_at",
+)
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # player_scans.next_scan_available_at is a naive UTC timestamp
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class ScanBuffer:
+    """
+    In-process buffer of player_scans rows, written in batches with asyncpg's
+    COPY (copy_records_to_table) by a single flusher task.
+    """
+
+    def __init__(self, enabled: bool = SCAN_WRITE_BEHIND, batch_size: int = SCAN_BUFFER_BATCH_SIZE,
+                 flush_seconds: float = SCAN_BUFFER_FLUSH_SECONDS, max_rows: int = SCAN_BUFFER_MAX_ROWS, engine=None):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_rows = max_rows
+        self._engine = engine
+        self._rows = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.buffered = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rejected = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from database import engine
+            self._engine = engine
+        return self._engine
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def accepting(self) -> bool:
+        return self.enabled and self._task is not None and len(self._rows) < self.max_rows
+
+    def add(self, player_id: uuid.UUID, qr_code_id: Optional[uuid.UUID], *, success: bool, attempt_number: Optional[int],
+            next_scan_available_at: Optional[datetime] = None, scan_type: str = "standard", latitude: float = None,
+            longitude: float = None, peer_player_id: uuid.UUID = None, proximity_status: str = None) -> bool:
+        """
+        Buffers one player_scans row. Returns False when write-behind is off or
+        the buffer is full; the caller must then insert the row itself.
+        """
+        if not self.accepting:
+            if self.enabled:
+                self.rejected += 1
+            return False
+        self._rows.append((
+            uuid.uuid4(), player_id, qr_code_id, peer_player_id, datetime.now(timezone.utc), scan_type, proximity_status,
+            success, latitude, longitude, attempt_number, _naive_utc(next_scan_available_at),
+        ))
+        self.buffered += 1
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stops the flusher and writes out everything still buffered"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None  # New scans are inserted synchronously from here on
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        while self._rows:
+            if not await self.flush():
+                logger.error("Shutting down with %d unflushed scan rows", len(self._rows))
+                return
+
+    async def _run(self):
+        backoff = self.flush_seconds
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            ok = True
+            while ok and self._rows:
+                ok = await self.flush()
+            # Back off while the database is refusing writes
+            backoff = self.flush_seconds if ok else min(backoff * 2, 30)
+
+    async def flush(self) -> bool:
+        """Copies up to one batch of rows; on failure they stay at the front of the buffer"""
+        async with self._flush_lock:
+            batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            if not batch:
+                return True
+            started = time.perf_counter()
+            try:
+                async with self.engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.copy_records_to_table("player_scans", records=batch, columns=COLUMNS)
+            except asyncio.CancelledError:
+                self._rows.extendleft(reversed(batch))
+                raise
+            except Exception:
+                self.failed_flushes += 1
+                self._rows.extendleft(reversed(batch))
+                logger.exception("Flushing %d buffered scans failed", len(batch))
+                return False
+            self.flushes += 1
+            self.flushed += len(batch)
+            self.last_flush_seconds = time.perf_counter() - started
+            return True
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._rows),
+            "buffered": self.buffered,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "sync_fallbacks": self.rejected,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+scan_buffer = ScanBuffer()
+register_metrics("scan_buffer", scan_buffer.metrics)
@@ -0,0 +1,333 @@
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from geoalchemy2 import Geography
+from sqlalchemy import Float, Integer, String, case, cast, func, literal, literal_column, select, true
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import QRCode, PlayerScan, PlayerHuntProgress, PlayerQRScanCounter
+from utils.generate_qr_code import generate_qr_code
+from utils.qr_cache import qr_code_cache, CachedQRCode, location_columns, MISSING
+from utils.geofence import radius_expression
+from utils.spatial_index import nearby_index
+from utils.scan_buffer import scan_buffer
+from utils.geo_rollup import geo_rollup
+from utils.player_stats import build_stats_upsert, stats_increments, bump_player_stats, recent_scans, scan_entry
+
+
+@dataclass
+class ScanResult:
+    qr_code_id: uuid.UUID
+    encounter_type: Optional[str]
+    reward_data: Optional[dict]
+    scan_type: str  # "standard" or "discovery"
+    allowed: bool  # False when blocked by cooldown or max_scans_per_player
+    location_valid: bool
+    attempt_number: Optional[int]
+    next_scan_available_at: Optional[datetime]
+    cooldown_until: Optional[datetime]  # Cooldown left over from the player's previous scans
+    hunt_status: Optional[str]
+
+
+def cooldown_end(cooldown_seconds):
+    """SQL expression for when a scan made now comes off cooldown (null when there is none)"""
+    return case(
+        (cooldown_seconds > 0, func.now() + cooldown_seconds * literal_column("interval '1 second'")),
+        else_=None,
+    )
+
+
+def build_counter_upsert(rows, max_scans):
+    """
+    Upserts PlayerQRScanCounter from `rows`, a select of
+    (player_id, qr_code_id, scan_count, last_scan_at, next_available_at).
+    The conflict update only fires while the cooldown has elapsed and the
+    count is under `max_scans`, so blocked scans return no row.
+    """
+    stmt = pg_insert(PlayerQRScanCounter).from_select(
+        ["player_id", "qr_code_id", "scan_count", "last_scan_at", "next_available_at"], rows
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[PlayerQRScanCounter.player_id, PlayerQRScanCounter.qr_code_id],
+        set_={
+            "scan_count": PlayerQRScanCounter.scan_count + 1,
+            "last_scan_at": stmt.excluded.last_scan_at,
+            "next_available_at": stmt.excluded.next_available_at,
+        },
+        where=(
+            (PlayerQRScanCounter.next_available_at.is_(None) | (PlayerQRScanCounter.next_available_at <= func.now()))
+            & (PlayerQRScanCounter.scan_count < func.coalesce(max_scans, 2147483647))
+        ),
+    ).returning(PlayerQRScanCounter.scan_count, PlayerQRScanCounter.next_available_at)
+
+
+def build_scan_statement(player_id: uuid.UUID, code: str, latitude: Optional[float], longitude: Optional[float], scan_type: str = "standard", cached: Optional[CachedQRCode] = None, record: bool = True):
+    """
+    Builds one statement that resolves the QR code, the player's scan counter,
+    cooldown and hunt progress, bumps the counter and inserts the new PlayerScan.
+    Returns no rows when the code does not exist yet, and a row without an
+    attempt_number when the scan is blocked.
+    With a `cached` code the row is found by primary key and location is checked in Python.
+    With record=False the PlayerScan is left out (the caller buffers it) but the
+    row still carries what it would have held.
+    """
+    qr = (
+        select(
+            QRCode.id,
+            QRCode.code,
+            QRCode.description,
+            QRCode.scan_type,
+            QRCode.reward_data,
+            QRCode.requires_location,
+            QRCode.location,
+            QRCode.scan_cooldown_seconds,
+            QRCode.max_scans_per_player,
+            QRCode.is_repeatable,
+            QRCode.expiration_date,
+        )
+        .where(QRCode.id == cached.id if cached else QRCode.code == code)
+        .cte("qr")
+    )
+
+    prior = (
+        select(PlayerQRScanCounter.next_available_at.label("cooldown_until"))
+        .where(PlayerQRScanCounter.player_id == player_id, PlayerQRScanCounter.qr_code_id.in_(select(qr.c.id)))
+        .cte("prior")
+    )
+
+    counter = build_counter_upsert(
+        select(
+            literal(player_id, UUID(as_uuid=True)),
+            qr.c.id,
+            literal(1, Integer),
+            func.now(),
+            cooldown_end(qr.c.scan_cooldown_seconds),
+        ).where(qr.c.max_scans_per_player.is_(None) | (qr.c.max_scans_per_player > 0)),
+        select(qr.c.max_scans_per_player).scalar_subquery(),
+    ).cte("counter")
+
+    # Location check mirrors validate_location: codes without a stored point always pass
+    if cached:
+        location_valid = literal(cached.location_valid(latitude, longitude))
+    else:
+        if latitude is None or longitude is None:
+            in_range = literal(False)
+        else:
+            scan_point = cast(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326), Geography(geometry_type="POINT", srid=4326))
+            # Sphere rather than spheroid, like the haversine checks in utils.geofence
+            in_range = func.ST_DWithin(qr.c.location, scan_point, radius_expression(qr.c.reward_data), False)
+        location_valid = case(
+            (qr.c.requires_location.is_not(True), true()),
+            (qr.c.location.is_(None), literal(latitude is not None and longitude is not None)),
+            else_=in_range,
+        )
+
+    if not record:
+        scan = (
+            select(
+                counter.c.scan_count.label("attempt_number"),
+                location_valid.label("success"),
+                func.timezone("UTC", counter.c.next_available_at).label("next_scan_available_at"),
+            )
+            .select_from(qr.join(counter, true()))
+            .cte("scan")
+        )
+        return _scan_result_select(player_id, qr, prior, scan, scan_type)
+
+    ins = (
+        pg_insert(PlayerScan)
+        .from_select(
+            ["id", "player_id", "qr_code_id", "latitude", "longitude", "attempt_number", "next_scan_available_at", "success", "scan_type"],
+            select(
+                func.gen_random_uuid(),
+                literal(player_id, UUID(as_uuid=True)),
+                qr.c.id,
+                literal(latitude, Float),
+                literal(longitude, Float),
+                counter.c.scan_count,
+                func.timezone("UTC", counter.c.next_available_at),
+                location_valid,
+                literal(scan_type, String),
+            ).select_from(qr.join(counter, true())),
+        )
+        .returning(PlayerScan.attempt_number, PlayerScan.success, PlayerScan.next_scan_available_at)
+        .cte("ins")
+    )
+    return _scan_result_select(player_id, qr, prior, ins, scan_type)
+
+
+def _scan_result_select(player_id: uuid.UUID, qr, prior, scan, scan_type: str):
+    """Final select of build_scan_statement; `scan` has attempt_number, success and next_scan_available_at"""
+    # Bump the player's totals for the scan being recorded (no row when blocked)
+    stats = build_stats_upsert(
+        select(*stats_increments(player_id, scan.c.success, scan_type)).select_from(scan)
+    ).cte("stats")
+
+    hunt_status = (
+        select(
+            case(
+                (PlayerHuntProgress.completed_at.is_not(None), "completed"),
+                (PlayerHuntProgress.abandoned_at.is_not(None), "abandoned"),
+                else_="active",
+            )
+        )
+        .where(
+            PlayerHuntProgress.player_id == player_id,
+            PlayerHuntProgress.hunt_id == cast(qr.c.reward_data["hunt_id"].astext, UUID(as_uuid=True)),
+        )
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    return select(
+        # Everything CachedQRCode needs, so a miss populates the cache for free
+        qr.c.id,
+        qr.c.code,
+        qr.c.description,
+        qr.c.scan_type,
+        qr.c.reward_data,
+        qr.c.requires_location,
+        *location_columns(qr.c.location),
+        qr.c.scan_cooldown_seconds,
+        qr.c.max_scans_per_player,
+        qr.c.is_repeatable,
+        qr.c.expiration_date,
+        scan.c.attempt_number,
+        scan.c.success,
+        scan.c.next_scan_available_at,
+        prior.c.cooldown_until,
+        case((qr.c.scan_type == "transportation", hunt_status), else_=None).label("hunt_status"),
+    ).select_from(qr.outerjoin(prior, true()).outerjoin(scan, true())).add_cte(stats)
+
+
+async def record_counted_scan(db: AsyncSession, player_id: uuid.UUID, qr_code: QRCode, success: bool = True) -> Optional[int]:
+    """
+    Bumps the player's counter for an already loaded QR code and adds the PlayerScan.
+    Returns the attempt number, or None if cooldown/max scans block the scan.
+    """
+    max_scans = qr_code.max_scans_per_player
+    counter = (await db.execute(build_counter_upsert(
+        select(
+            literal(player_id, UUID(as_uuid=True)),
+            literal(qr_code.id, UUID(as_uuid=True)),
+            literal(1, Integer),
+            func.now(),
+            cooldown_end(literal(qr_code.scan_cooldown_seconds or 0, Integer)),
+        ).where(literal(max_scans is None or max_scans > 0)),
+        literal(max_scans, Integer),
+    ))).first()
+    if counter is None:
+        return None
+
+    await bump_player_stats(db, player_id, success, "standard")
+    # Not committed yet, so drop the cached history rather than guess at it
+    recent_scans.invalidate(player_id)
+
+    next_available_at = counter.next_available_at
+    db.add(PlayerScan(
+        player_id=player_id,
+        qr_code_id=qr_code.id,
+        success=success,
+        attempt_number=counter.scan_count,
+        next_scan_available_at=next_available_at.astimezone(timezone.utc).replace(tzinfo=None) if next_available_at else None,
+    ))
+    return counter.scan_count
+
+
+async def process_scan(db: AsyncSession, player_id: uuid.UUID, code: str, latitude: Optional[float] = None, longitude: Optional[float] = None) -> ScanResult:
+    """
+    Records a scan of `code` for the player in a single round trip.
+    Unknown codes are generated first and recorded as a discovery by whoever created them.
+    """
+    scan_type = "standard"
+    created = False
+    cached = qr_code_cache.peek(code)
+    row = None
+    # Only plain scans of known codes are written behind; discoveries and hunt
+    # (transportation) scans feed progress and rewards, so they stay synchronous
+    write_behind = cached not in (None, MISSING) and cached.scan_type != "transportation" and scan_buffer.accepting
+    if cached is not None:  # Known code or cache miss; negative entries go straight to discovery
+        row = (await db.execute(build_scan_statement(
+            player_id, code, latitude, longitude, scan_type, cached=cached if cached is not MISSING else None,
+            record=not write_behind
+        ))).first()
+    if row is None:
+        write_behind = False
+        _, created = await generate_qr_code(code, db, latitude=latitude, longitude=longitude)
+        # Another worker's discovery may have won the insert; then this is a plain scan of its code
+        if created:
+            scan_type = "discovery"
+        row = (await db.execute(build_scan_statement(player_id, code, latitude, longitude, scan_type))).first()
+    await db.commit()
+    qr_code_cache.set(code, CachedQRCode.from_row(row))
+    if created and nearby_index.loaded and row.latitude is not None and row.longitude is not None:
+        nearby_index.add(code, row.latitude, row.longitude, {
+            "description": row.description,
+            "scan_type": row.scan_type,
+            "requires_location": row.requires_location,
+        })
+    if row.attempt_number is not None:
+        recent_scans.push(player_id, scan_entry(row.id, datetime.now(timezone.utc), bool(row.success), scan_type))
+        geo_rollup.add(player_id, latitude, longitude, scan_type, row.attempt_number)
+
+    if write_behind and row.attempt_number is not None:
+        scan = dict(
+            success=bool(row.success),
+            attempt_number=row.attempt_number,
+            next_scan_available_at=row.next_scan_available_at,
+            scan_type=scan_type,
+            latitude=latitude,
+            longitude=longitude,
+        )
+        if not scan_buffer.add(player_id, row.id, **scan):
+            # Buffer filled up since we checked; insert it now instead
+            db.add(PlayerScan(player_id=player_id, qr_code_id=row.id, **scan))
+            await db.commit()
+
+    allowed = row.attempt_number is not None
+    reward_data = (row.reward_data or None) if allowed else None
+    hunt_status = None
+    if row.scan_type == "transportation" and row.reward_data and row.reward_data.get("hunt_id"):
+        hunt_status = row.hunt_status or "new"
+
+    return ScanResult(
+        qr_code_id=row.id,
+        encounter_type=row.scan_type,
+        reward_data=reward_data,
+        scan_type=scan_type,
+        allowed=allowed,
+        location_valid=bool(row.success),
+        attempt_number=row.attempt_number,
+        next_scan_available_at=row.next_scan_available_at,
+        cooldown_until=row.cooldown_until,
+        hunt_status=hunt_status,
+    )
+
+
+async def backfill_scan_counters(db: AsyncSession):
+    """
+    Seeds player_qr_scan_counters from player_scans while it is still empty,
+    so limits also apply to scans recorded before the counter table existed.
+    """
+    if await db.scalar(select(PlayerQRScanCounter.player_id).limit(1)) is not None:
+        return
+    rows = (
+        select(
+            PlayerScan.player_id,
+            PlayerScan.qr_code_id,
+            func.count(PlayerScan.id),
+            func.max(PlayerScan.scan_time),
+            func.max(func.timezone("UTC", PlayerScan.next_scan_available_at)),
+        )
+        .where(PlayerScan.player_id.is_not(None), PlayerScan.qr_code_id.is_not(None))
+        .group_by(PlayerScan.player_id, PlayerScan.qr_code_id)
+    )
+    await db.execute(
+        pg_insert(PlayerQRScanCounter)
+        .from_select(["player_id", "qr_code_id", "scan_count", "last_scan_at", "next_available_at"], rows)
+        .on_conflict_do_nothing()
+    )
+    await db.commit()
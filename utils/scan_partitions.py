@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from utils.metrics import register_metrics
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional; without it old partitions are kept instead of archived
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# player_scans is range partitioned by scan_time, one partition per month
+# (see migrations/versions). This keeps partitions created ahead of time and
+# archives and drops the ones past retention.
+SCAN_PARTITION_MONTHS_AHEAD = int(os.getenv("SCAN_PARTITION_MONTHS_AHEAD", 2))
+# Months of scans kept in the database, counting the current one; 0 keeps everything
+SCAN_RETENTION_MONTHS = int(os.getenv("SCAN_RETENTION_MONTHS", 0))
+# Expired partitions are written here as zstd-compressed Parquet before being dropped
+SCAN_ARCHIVE_DIR = os.getenv("SCAN_ARCHIVE_DIR", "scan_archive")
+SCAN_ARCHIVE_BATCH_ROWS = int(os.getenv("SCAN_ARCHIVE_BATCH_ROWS", 100000))
+SCAN_PARTITION_CHECK_SECONDS = float(os.getenv("SCAN_PARTITION_CHECK_SECONDS", 6 * 3600))
+# Arbitrary constant for the advisory lock that lets one worker do maintenance
+MAINTENANCE_LOCK_ID = 7261003
+
+ARCHIVE_COLUMNS = (
+    "id", "player_id", "qr_code_id", "peer_player_id", "scan_time", "scan_type", "proximity_status",
+    "success", "latitude", "longitude", "attempt_number", "next_scan_available_at",
+)
+UUID_COLUMNS = {"id", "player_id", "qr_code_id", "peer_player_id"}
+_BOUND = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    lower: Optional[datetime]  # None for MINVALUE
+    upper: Optional[datetime]  # None for MAXVALUE
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"player_scans_{start:%Y_%m}"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('player_scans'))"
+    )))
+
+
+async def list_partitions(conn: AsyncConnection) -> List[Partition]:
+    rows = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'player_scans'::regclass"
+    ))
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or "")
+        if match:
+            partitions.append(Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: p.lower or datetime.min.replace(tzinfo=timezone.utc))
+
+
+def _covered(partitions: List[Partition], moment: datetime) -> bool:
+    return any((p.lower is None or p.lower <= moment) and (p.upper is None or moment < p.upper) for p in partitions)
+
+
+async def ensure_partitions(conn: AsyncConnection, now: datetime, months_ahead: int = SCAN_PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Creates the monthly partitions from this month to `months_ahead` months out; returns new names"""
+    partitions = await list_partitions(conn)
+    created = []
+    start = month_start(now)
+    for offset in range(months_ahead + 1):
+        lower = add_months(start, offset)
+        if _covered(partitions, lower):
+            continue
+        upper = add_months(lower, 1)
+        name = partition_name(lower)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF player_scans "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        ))
+        partitions.append(Partition(name, lower, upper))
+        created.append(name)
+    return created
+
+
+async def archive_partition(conn: AsyncConnection, name: str, directory: str = SCAN_ARCHIVE_DIR) -> int:
+    """Streams one partition into <directory>/<name>.parquet; returns the rows written"""
+    schema = pyarrow.schema([
+        ("id", pyarrow.string()), ("player_id", pyarrow.string()), ("qr_code_id", pyarrow.string()),
+        ("peer_player_id", pyarrow.string()), ("scan_time", pyarrow.timestamp("us", tz="UTC")),
+        ("scan_type", pyarrow.string()), ("proximity_status", pyarrow.string()), ("success", pyarrow.bool_()),
+        ("latitude", pyarrow.float64()), ("longitude", pyarrow.float64()), ("attempt_number", pyarrow.int32()),
+        ("next_scan_available_at", pyarrow.timestamp("us")),
+    ])
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.parquet")
+    columns = ", ".join(f"{column}::text" if column in UUID_COLUMNS else column for column in ARCHIVE_COLUMNS)
+    writer = await asyncio.to_thread(pyarrow.parquet.ParquetWriter, path + ".tmp", schema, compression="zstd")
+    written = 0
+    try:
+        result = await conn.stream(text(f"SELECT {columns} FROM {name}").execution_options(yield_per=SCAN_ARCHIVE_BATCH_ROWS))
+        async for rows in result.partitions():
+            batch = pyarrow.Table.from_pylist([dict(zip(ARCHIVE_COLUMNS, row)) for row in rows], schema=schema)
+            await asyncio.to_thread(writer.write_table, batch)
+            written += len(rows)
+    finally:
+        await asyncio.to_thread(writer.close)
+    os.replace(path + ".tmp", path)
+    return written
+
+
+class ScanPartitionMaintainer:
+    """
+    Periodic player_scans partition upkeep. Every worker runs the loop; an
+    advisory lock makes sure only one of them does the work at a time.
+    """
+
+    def __init__(self, check_seconds: float = SCAN_PARTITION_CHECK_SECONDS, retention_months: int = SCAN_RETENTION_MONTHS,
+                 engine=None):
+        self.check_seconds = check_seconds
+        self.retention_months = retention_months
+        self._engine = engine
+        self._task: Optional[asyncio.Task] = None
+        self.partitioned: Optional[bool] = None
+        self.created = 0
+        self.archived = 0
+        self.archived_rows = 0
+        self.runs = 0
+        self.last_run_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from database import engine
+            self._engine = engine
+        return self._engine
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.exception("player_scans partition maintenance failed")
+
+    async def run_once(self, now: Optional[datetime] = None):
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        async with self.engine.connect() as conn:
+            self.partitioned = await is_partitioned(conn)
+            if not self.partitioned:
+                logger.warning("player_scans is not partitioned; run the migrations to enable partition maintenance")
+                return
+            if not await conn.scalar(text(f"SELECT pg_try_advisory_lock({MAINTENANCE_LOCK_ID})")):
+                return
+            await conn.commit()
+            try:
+                created = await ensure_partitions(conn, now)
+                await conn.commit()
+                if created:
+                    self.created += len(created)
+                    logger.info("Created player_scans partitions %s", ", ".join(created))
+                if self.retention_months > 0:
+                    await self._expire(conn, add_months(month_start(now), 1 - self.retention_months))
+            finally:
+                await conn.rollback()
+                await conn.execute(text(f"SELECT pg_advisory_unlock({MAINTENANCE_LOCK_ID})"))
+                await conn.commit()
+        self.runs += 1
+        self.last_run_seconds = time.perf_counter() - started
+
+    async def _expire(self, conn: AsyncConnection, cutoff: datetime):
+        """Archives, detaches and drops every partition holding only scans before `cutoff`"""
+        for partition in await list_partitions(conn):
+            if partition.upper is None or partition.upper > cutoff:
+                continue
+            if pyarrow is None:
+                logger.warning("Keeping expired partition %s: install pyarrow to archive it", partition.name)
+                continue
+            expected = await conn.scalar(text(f"SELECT count(*) FROM {partition.name}"))
+            written = await archive_partition(conn, partition.name)
+            if written != expected:
+                logger.error("Archive of %s has %d of %d rows; keeping the partition", partition.name, written, expected)
+                await conn.rollback()
+                continue
+            # The archive is on disk, so the rows can go; DROP is instant and leaves no dead tuples to vacuum
+            await conn.execute(text(f"ALTER TABLE player_scans DETACH PARTITION {partition.name}"))
+            await conn.execute(text(f"DROP TABLE {partition.name}"))
+            await conn.commit()
+            self.archived += 1
+            self.archived_rows += written
+            logger.info("Archived and dropped %s (%d scans)", partition.name, written)
+
+    def metrics(self) -> dict:
+        return {
+            "partitioned": self.partitioned,
+            "runs": self.runs,
+            "partitions_created": self.created,
+            "partitions_archived": self.archived,
+            "archived_rows": self.archived_rows,
+            "last_run_seconds": self.last_run_seconds,
+            "last_error": self.last_error,
+        }
+
+
+scan_partitions = ScanPartitionMaintainer()
+register_metrics("scan_partitions", scan_partitions.metrics)
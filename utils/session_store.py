@@ -0,0 +1,174 @@
+import heapq
+from abc import ABC, abstractmethod
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from sqlalchemy import select, insert, update, delete, func, literal_column
+from models import QRLoginSession
+from utils.metrics import register_metrics
+
+# "postgres" shares sessions between workers; "memory" only works with a single worker
+QR_LOGIN_STORE = os.getenv("QR_LOGIN_STORE", "postgres")
+QR_LOGIN_TTL_SECONDS = int(os.getenv("QR_LOGIN_TTL_SECONDS", 300))
+QR_LOGIN_MAX_ATTEMPTS = int(os.getenv("QR_LOGIN_MAX_ATTEMPTS", 3))
+# How often the Postgres store deletes expired rows
+QR_LOGIN_PURGE_SECONDS = float(os.getenv("QR_LOGIN_PURGE_SECONDS", 60))
+
+# Results of LoginSessionStore.claim
+CLAIMED = "claimed"
+INVALID = "invalid"
+ALREADY_USED = "used"
+EXPIRED = "expired"
+TOO_MANY_ATTEMPTS = "too_many_attempts"
+
+
+@dataclass
+class _Session:
+    expires_at: float  # time.monotonic()
+    used: bool = False
+    attempts: int = 0
+
+
+class LoginSessionStore(ABC):
+    """Pending QR login sessions: the browser creates one, the phone claims it once"""
+
+    @abstractmethod
+    async def create(self) -> str:
+        pass
+
+    @abstractmethod
+    async def claim(self, session_id: str) -> str:
+        """Marks the session used; returns CLAIMED or the reason it can't be"""
+        pass
+
+    def metrics(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class MemorySessionStore(LoginSessionStore):
+    """
+    Sessions in a dict with a heap ordered by expiry, so purging expired
+    sessions costs O(log n) each instead of a scan of every pending session.
+    """
+
+    def __init__(self, ttl: float = QR_LOGIN_TTL_SECONDS, max_attempts: int = QR_LOGIN_MAX_ATTEMPTS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._sessions: Dict[str, _Session] = {}
+        self._expiry: List[Tuple[float, str]] = []
+
+    def _purge(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, session_id = heapq.heappop(self._expiry)
+            self._sessions.pop(session_id, None)
+
+    async def create(self) -> str:
+        now = self._clock()
+        self._purge(now)
+        session_id = str(uuid.uuid4())
+        self._sessions[session_id] = _Session(expires_at=now + self.ttl)
+        heapq.heappush(self._expiry, (now + self.ttl, session_id))
+        return session_id
+
+    async def claim(self, session_id: str) -> str:
+        now = self._clock()
+        session = self._sessions.get(session_id)
+        if not session:
+            return INVALID
+        if session.used:
+            return ALREADY_USED
+        if session.expires_at <= now:
+            del self._sessions[session_id]
+            return EXPIRED
+        # Track attempts to prevent brute force
+        session.attempts += 1
+        if session.attempts > self.max_attempts:
+            del self._sessions[session_id]
+            return TOO_MANY_ATTEMPTS
+        session.used = True
+        return CLAIMED
+
+    def metrics(self) -> dict:
+        return {"backend": type(self).__name__, "pending": len(self._sessions)}
+
+
+class PostgresSessionStore(LoginSessionStore):
+    """
+    Sessions in the UNLOGGED qr_login_sessions table, visible to every worker.
+    A claim is a single conditional UPDATE; expired rows are deleted through
+    the expires_at index at most every QR_LOGIN_PURGE_SECONDS.
+    """
+
+    def __init__(self, engine=None, ttl: float = QR_LOGIN_TTL_SECONDS, max_attempts: int = QR_LOGIN_MAX_ATTEMPTS):
+        self._engine = engine
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._last_purge = 0.0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from database import engine
+            self._engine = engine
+        return self._engine
+
+    def _expires_at(self):
+        return func.now() + self.ttl * literal_column("interval '1 second'")
+
+    async def create(self) -> str:
+        session_id = uuid.uuid4()
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(QRLoginSession).values(
+                id=session_id, expires_at=self._expires_at(), used=False, attempts=0
+            ))
+            if time.monotonic() - self._last_purge > QR_LOGIN_PURGE_SECONDS:
+                self._last_purge = time.monotonic()
+                await conn.execute(delete(QRLoginSession).where(QRLoginSession.expires_at <= func.now()))
+        return str(session_id)
+
+    async def claim(self, session_id: str) -> str:
+        try:
+            session_uuid = uuid.UUID(session_id)
+        except ValueError:
+            return INVALID
+        async with self.engine.begin() as conn:
+            claimed = (await conn.execute(
+                update(QRLoginSession)
+                .where(
+                    QRLoginSession.id == session_uuid,
+                    QRLoginSession.used.is_(False),
+                    QRLoginSession.expires_at > func.now(),
+                    QRLoginSession.attempts < self.max_attempts,
+                )
+                .values(attempts=QRLoginSession.attempts + 1, used=True)
+                .returning(QRLoginSession.id)
+            )).first()
+            if claimed:
+                return CLAIMED
+
+            # Work out why, in the same order the checks were always made
+            row = (await conn.execute(
+                select(QRLoginSession.used, (QRLoginSession.expires_at <= func.now()).label("expired"))
+                .where(QRLoginSession.id == session_uuid)
+            )).first()
+            if row is None:
+                return INVALID
+            if row.used:
+                return ALREADY_USED
+            await conn.execute(delete(QRLoginSession).where(QRLoginSession.id == session_uuid))
+            return EXPIRED if row.expired else TOO_MANY_ATTEMPTS
+
+
+def create_session_store(kind: str = QR_LOGIN_STORE) -> LoginSessionStore:
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "postgres":
+        return PostgresSessionStore()
+    raise ValueError(f"Unknown QR_LOGIN_STORE: {kind}")
+
+
+login_sessions = create_session_store()
+register_metrics("qr_login_sessions", login_sessions.metrics)
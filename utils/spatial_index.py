@@ -0,0 +1,127 @@
+import math
+import os
+from typing import Dict, Hashable, List, Optional, Tuple
+from geoalchemy2.shape import to_shape
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import QRCode
+from utils.geofence import Geofences, EARTH_RADIUS_METERS
+
+# Geohash length of the buckets; 6 chars is roughly 1.2km x 0.6km
+GEOHASH_PRECISION = int(os.getenv("GEOHASH_PRECISION", 6))
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int = GEOHASH_PRECISION) -> Tuple[float, float]:
+    """(lat degrees, lon degrees) covered by one cell"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(latitude: float, longitude: float, radius_meters: float, precision: int = GEOHASH_PRECISION) -> set:
+    """Geohash cells intersecting the bounding box of a circle"""
+    lat_step, lon_step = geohash_cell_size(precision)
+    lat_delta = math.degrees(radius_meters / EARTH_RADIUS_METERS)
+    lon_delta = lat_delta / max(math.cos(math.radians(latitude)), 1e-6)
+    lat_min, lat_max = max(-90.0, latitude - lat_delta), min(90.0, latitude + lat_delta)
+    lon_min, lon_max = longitude - lon_delta, longitude + lon_delta
+    cells = set()
+    lat = lat_min
+    while lat <= lat_max + lat_step:
+        lon = lon_min
+        while lon <= lon_max + lon_step:
+            wrapped = (min(lon, lon_max) + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(min(lat, lat_max), wrapped, precision))
+            lon += lon_step
+        lat += lat_step
+    return cells
+
+
+class GeohashIndex:
+    """
+    In-process point index bucketed by geohash. Used for nearby lookups when the
+    database has no PostGIS (SQLite test setups).
+    """
+
+    def __init__(self, precision: int = GEOHASH_PRECISION):
+        self.precision = precision
+        self._buckets: Dict[str, Dict[Hashable, Tuple[float, float]]] = {}
+        self._cells: Dict[Hashable, str] = {}
+        self._data: Dict[Hashable, dict] = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._cells)
+
+    def add(self, key: Hashable, latitude: float, longitude: float, data: Optional[dict] = None):
+        self.remove(key)
+        cell = geohash_encode(latitude, longitude, self.precision)
+        self._buckets.setdefault(cell, {})[key] = (latitude, longitude)
+        self._cells[key] = cell
+        self._data[key] = data or {}
+
+    def remove(self, key: Hashable):
+        cell = self._cells.pop(key, None)
+        if cell is not None:
+            bucket = self._buckets[cell]
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[cell]
+            self._data.pop(key, None)
+
+    def nearby(self, latitude: float, longitude: float, radius_meters: float) -> List[Tuple[Hashable, float, Tuple[float, float], dict]]:
+        """(key, distance in meters, (lat, lon), data) within the radius, nearest first"""
+        keys, lats, lons = [], [], []
+        for cell in covering_cells(latitude, longitude, radius_meters, self.precision):
+            for key, (lat, lon) in self._buckets.get(cell, {}).items():
+                keys.append(key)
+                lats.append(lat)
+                lons.append(lon)
+        if not keys:
+            return []
+        distances = Geofences(lats, lons).distances(latitude, longitude)
+        hits = sorted((d, i) for i, d in enumerate(distances) if d <= radius_meters)
+        return [(keys[i], float(d), (lats[i], lons[i]), self._data[keys[i]]) for d, i in hits]
+
+    async def ensure_loaded(self, db: AsyncSession):
+        """Builds the index from every located QR code the first time it is needed"""
+        if self.loaded:
+            return
+        rows = await db.execute(
+            select(QRCode.code, QRCode.description, QRCode.scan_type, QRCode.requires_location, QRCode.location)
+            .where(QRCode.location.is_not(None))
+        )
+        for code, description, scan_type, requires_location, location in rows:
+            point = to_shape(location)
+            self.add(code, point.y, point.x, {
+                "description": description,
+                "scan_type": scan_type,
+                "requires_location": requires_location,
+            })
+        self.loaded = True
+
+
+# Fallback index for /qr/nearby on databases without PostGIS
+nearby_index = GeohashIndex()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Union
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per socket before the overflow policy kicks in
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 64))
+# "drop" discards the new message, "disconnect" closes the slow socket
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop")
+# A single send taking longer than this marks the client as dead
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", 10))
+# Protocol-level ping frames, answered by every websocket client without app code;
+# a peer missing a pong is disconnected by the server (uvicorn CLI: --ws-ping-interval/--ws-ping-timeout)
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", 20))
+WS_PING_TIMEOUT_SECONDS = float(os.getenv("WS_PING_TIMEOUT_SECONDS", 20))
+# Clients that connected with ?heartbeat=true and have been quiet this long are sent a ping event...
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", 30))
+# ...and are closed once nothing at all has arrived for this long. Other clients may stay silent
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", 90))
+
+_CLOSE = object()
+
+
+class SendStats:
+    def __init__(self):
+        self.sent = 0
+        self.dropped = 0
+        self.overflow_disconnects = 0
+        self.failed = 0
+
+
+send_stats = SendStats()
+
+
+class QueuedSocket:
+    """
+    A websocket with its own bounded outbound queue and writer task, so a slow
+    client only delays its own messages. `send` never awaits the network.
+    """
+
+    def __init__(self, websocket: WebSocket, encoding: str = "json", maxsize: int = WS_SEND_QUEUE_SIZE, overflow_policy: str = WS_OVERFLOW_POLICY, heartbeat: bool = False):
+        self.websocket = websocket
+        self.encoding = encoding  # Negotiated wire format, see utils.ws_protocol
+        self.heartbeat = heartbeat  # Client answers ping events, so silence means it's gone
+        self.slot: Optional[int] = None  # Game channel slot held, see utils.channel_slots
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflow_policy = overflow_policy
+        self.closed = False
+        self.connected_at = self.last_seen = time.monotonic()
+        self._task = asyncio.create_task(self._writer())
+
+    def touch(self):
+        """Marks the client alive; called for every message it sends"""
+        self.last_seen = time.monotonic()
+
+    def send(self, message: Union[str, bytes]) -> bool:
+        """Queues a pre-serialised message; False if it was dropped"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            send_stats.dropped += 1
+            if self.overflow_policy == "disconnect":
+                send_stats.overflow_disconnects += 1
+                logger.warning("Closing websocket with %d queued messages", self.queue.qsize())
+                self.abort()
+            return False
+
+    async def _writer(self):
+        while True:
+            message = await self.queue.get()
+            if message is _CLOSE:
+                return
+            try:
+                if isinstance(message, bytes):
+                    await asyncio.wait_for(self.websocket.send_bytes(message), WS_SEND_TIMEOUT_SECONDS)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(message), WS_SEND_TIMEOUT_SECONDS)
+                send_stats.sent += 1
+            except Exception as e:
+                send_stats.failed += 1
+                logger.info("Websocket send failed, closing: %r", e)
+                self.abort()
+                return
+
+    def close(self):
+        """Stops accepting messages; the writer exits once the queue is flushed"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put_nowait(_CLOSE)
+        except asyncio.QueueFull:
+            self._task.cancel()
+
+    def abort(self):
+        """Stops the writer now and closes the socket; the receive loop then sees the disconnect"""
+        self.closed = True
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    def depth(self) -> int:
+        return self.queue.qsize()
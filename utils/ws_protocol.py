@@ -0,0 +1,106 @@
+import json
+import os
+from typing import Dict, Optional, Tuple, Union
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # Optional; clients asking for it get JSON instead
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+# Sec-WebSocket-Protocol names a client can offer instead of the ?encoding= parameter
+SUBPROTOCOLS = {"qrgame.json": JSON, "qrgame.msgpack": MSGPACK}
+# Lets operators turn the compact encoding off without a client release
+WS_COMPACT_ENCODING = os.getenv("WS_COMPACT_ENCODING", "true").lower() == "true"
+
+# Fixed schema for compact frames: event -> (code, field order).
+# Frames are [code, field1, field2, ...]; events or fields outside the
+# schema are sent as a map with an "event" key instead.
+SCHEMA: Dict[str, Tuple[int, Tuple[str, ...]]] = {
+    "start_game": (1, ("game_type", "players", "state")),
+    "move": (2, ("player_id", "data")),
+    "result": (3, ("winner", "reason")),
+    "qr_scan": (4, ("player_id", "qr_code")),
+    "player_interaction": (5, ("interaction_type", "success", "message")),
+    "peer_pairing_success": (6, ("paired_player", "proximity_status", "message")),
+}
+_EVENTS_BY_CODE = {code: (event, fields) for event, (code, fields) in SCHEMA.items()}
+
+
+class InvalidFrame(ValueError):
+    """A client message that doesn't decode to an event"""
+
+
+def available_encodings():
+    return [JSON, MSGPACK] if msgpack is not None and WS_COMPACT_ENCODING else [JSON]
+
+
+def negotiate(websocket: WebSocket, requested: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Picks the encoding from ?encoding= or the offered subprotocols.
+    Returns (encoding, subprotocol to accept with).
+    """
+    supported = available_encodings()
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        encoding = SUBPROTOCOLS.get(subprotocol)
+        if encoding in supported:
+            return encoding, subprotocol
+    if requested in supported:
+        return requested, None
+    return JSON, None
+
+
+def compact(event: dict) -> Union[list, dict]:
+    name = event.get("event")
+    if name not in SCHEMA:
+        return event
+    code, fields = SCHEMA[name]
+    if not set(event) - {"event"} <= set(fields):
+        return event
+    return [code, *(event.get(field) for field in fields)]
+
+
+def expand(frame: Union[list, dict]) -> dict:
+    if isinstance(frame, dict):
+        return frame
+    event, fields = _EVENTS_BY_CODE[frame[0]]
+    return {"event": event, **dict(zip(fields, frame[1:]))}
+
+
+def encode(event: dict, encoding: str = JSON) -> Union[str, bytes]:
+    if encoding == MSGPACK:
+        return msgpack.packb(compact(event))
+    return json.dumps(event)
+
+
+def encode_json_text(message: str, encoding: str) -> Union[str, bytes]:
+    """Re-encodes an already serialised JSON message; JSON passes through untouched"""
+    if encoding == JSON:
+        return message
+    return encode(json.loads(message), encoding)
+
+
+def decode(data: Union[str, bytes], encoding: str = JSON) -> dict:
+    try:
+        if isinstance(data, bytes) and encoding == MSGPACK:
+            event = expand(msgpack.unpackb(data))
+        else:
+            event = json.loads(data)
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        # Bad JSON/msgpack (both ValueErrors) or a compact frame outside SCHEMA
+        raise InvalidFrame(str(e)) from e
+    if not isinstance(event, dict):
+        raise InvalidFrame("Expected an event object")
+    return event
+
+
+async def receive_event(websocket: WebSocket, encoding: str = JSON) -> dict:
+    """Next client message as an event dict, whichever frame type it arrived in; raises InvalidFrame"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return decode(message["bytes"], encoding)
+    return decode(message["text"], encoding)